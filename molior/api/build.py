@@ -1,6 +1,6 @@
 import re
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from aiohttp import web
 from sqlalchemy.sql import func, or_
 from sqlalchemy.orm import aliased
@@ -13,6 +13,31 @@ from ..model.projectversion import ProjectVersion
 from ..model.maintainer import Maintainer
 from ..tools import paginate, ErrorResponse
 from ..molior.queues import enqueue_task
+from ..molior.core import get_build_duration, get_build_durations
+
+
+def needs_build_estimate(build):
+    return build.buildtype == "deb" and build.buildstate in ("needs_build", "scheduled", "building")
+
+
+def get_build_estimate(build, session, durations=None):
+    """
+    Returns the estimated duration and, for running builds, the
+    estimated finish time of a deb build. The durations of
+    get_build_durations can be given for lists of builds.
+    """
+    if not needs_build_estimate(build):
+        return {}
+    if durations is not None:
+        duration = durations.get((build.sourcename, build.architecture, build.projectversion_id))
+    else:
+        duration = get_build_duration(build.sourcename, build.architecture, build.projectversion_id, session)
+    if duration is None:
+        return {}
+    data = {"estimated_duration": int(duration)}
+    if build.buildstate == "building" and build.startstamp:
+        data["estimated_finish"] = (build.startstamp + timedelta(seconds=duration)).strftime(DATETIME_FORMAT)
+    return data
 
 
 @app.http_get("/api/builds")
@@ -278,8 +303,15 @@ async def get_builds(request):
 
     data = {"total_result_count": nb_builds, "results": []}
     if not count_only:
+        builds = builds.all()
+        # estimate the durations of all builds of the page at once
+        durations = get_build_durations([(build.sourcename, build.architecture, build.projectversion_id)
+                                         for build in builds if needs_build_estimate(build)],
+                                        request.cirrina.db_session)
         for build in builds:
-            data["results"].append(build.data())
+            build_data = build.data()
+            build_data.update(get_build_estimate(build, request.cirrina.db_session, durations))
+            data["results"].append(build_data)
 
     return web.json_response(data)
 
@@ -351,6 +383,8 @@ async def get_build(request):
         "project": project
     }
 
+    data.update(get_build_estimate(build, request.cirrina.db_session))
+
     if build.sourcerepository:
         data.update(
             {
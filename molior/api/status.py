@@ -6,6 +6,8 @@ from ..auth import req_admin
 from ..version import MOLIOR_VERSION
 from ..molior.backend import Backend
 from ..molior.configuration import Configuration
+from ..aptly import get_aptly_connection
+from ..molior.queues import get_aptly_lane_metrics
 
 
 @app.http_get("/api/status")
@@ -187,8 +189,38 @@ async def get_node(request):
     machine_id = request.match_info["machineID"]
     b = Backend()
     backend = b.get_backend()
-    build_nodes = backend.get_nodes_info()
-    for node in build_nodes:
-        if machine_id == node["id"]:
-            return web.json_response(node)
-    return web.Response(text="Node not found", status=404)
+    node = backend.get_node_info(machine_id)
+    if not node:
+        return web.Response(text="Node not found", status=404)
+    return web.json_response(node)
+
+
+@app.http_get("/api/metrics")
+async def get_metrics(request):
+    """
+    Returns scheduling metrics of the build backend and aptly task metrics
+
+    ---
+    description: Returns scheduling metrics of the build backend and aptly task metrics
+    tags:
+        - Status
+    produces:
+        - text/json
+    responses:
+        "200":
+            description: successful
+        "500":
+            description: internal server error
+    """
+    b = Backend()
+    backend = b.get_backend()
+    metrics = {}
+    if hasattr(backend, "get_metrics"):
+        metrics["scheduler"] = backend.get_metrics()
+    aptly = get_aptly_connection()
+    metrics["aptly_tasks"] = aptly.tasks.get_metrics()
+    metrics["aptly_publish"] = aptly.publisher.get_metrics()
+    metrics["aptly_objects"] = aptly.objects.get_metrics()
+    metrics["aptly_repo_locks"] = aptly.repo_locks.get_metrics()
+    metrics["aptly_lanes"] = get_aptly_lane_metrics()
+    return web.json_response(metrics)
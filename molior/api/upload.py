@@ -1,14 +1,15 @@
 import os
+import hashlib
 
 from aiohttp import web
+from aiofile import AIOFile, Reader
 from pathlib import Path
 
 from ..app import app, logger
 from ..molior.configuration import Configuration
 from ..model.database import Session
-from ..model.build import Build
-from ..model.buildtask import BuildTask
-from ..molior.queues import buildlog
+from ..model.buildtask import get_build_id
+from ..molior.queues import buildlog, enqueue_backend
 
 
 if not os.environ.get("IS_SPHINX", False):
@@ -25,13 +26,11 @@ async def file_upload(request, tempfile, filename, size):
     token = request.match_info["token"]
     logger.debug("file uploaded: %s (%s) %dbytes, token %s", tempfile, filename, size, token)
 
-    build_id = None
     with Session() as session:
-        build = session.query(Build).join(BuildTask).filter(BuildTask.task_id == token).first()
-        if not build:
-            logger.error("file_upload: no build found for token '%s'", token)
-            return web.Response(status=400, text="Invalid file upload.")
-        build_id = build.id
+        build_id = get_build_id(token, session)
+    if not build_id:
+        logger.error("file_upload: no build found for token '%s'", token)
+        return web.Response(status=400, text="Invalid file upload.")
 
     try:
         # FIXME: do not overwrite
@@ -42,21 +41,146 @@ async def file_upload(request, tempfile, filename, size):
     return web.Response(text="file uploaded: {} ({} bytes)".format(filename, size))
 
 
+# received chunks of chunked uploads
+# (build_id, filename): {offset: (size, sha256)}
+upload_chunks = {}
+
+
+def get_chunked_upload(request):
+    """
+    Returns the build id, file name and partial file path of a chunked upload.
+    """
+    token = request.match_info["token"]
+    filename = request.match_info["filename"]
+    if not filename or filename.startswith(".") or "/" in filename:
+        return None, None, None
+
+    with Session() as session:
+        build_id = get_build_id(token, session)
+    if not build_id:
+        logger.error("file_upload: no build found for token '%s'", token)
+        return None, None, None
+
+    part_path = Path(upload_dir) / str(build_id) / (filename + ".part")
+    return build_id, filename, part_path
+
+
+@app.http_get("/internal/buildupload/{token}/{filename}")
+async def chunked_upload_status(request):
+    """
+    Returns the chunks received so far of a chunked upload,
+    as a list of [offset, size, sha256].
+    """
+    build_id, filename, part_path = get_chunked_upload(request)
+    if not build_id:
+        return web.Response(status=400, text="Invalid file upload.")
+
+    chunks = upload_chunks.get((build_id, filename), {})
+    if chunks and not part_path.exists():
+        chunks.clear()
+    return web.json_response({"chunks": [[offset, size, sha256] for offset, (size, sha256) in sorted(chunks.items())]})
+
+
+@app.http_put("/internal/buildupload/{token}/{filename}/{offset:\\d+}")
+async def chunked_upload_chunk(request):
+    """
+    Writes a chunk of a chunked upload at the given offset. The
+    X-Checksum-Sha256 header must contain the sha256 of the chunk.
+    """
+    build_id, filename, part_path = get_chunked_upload(request)
+    if not build_id:
+        return web.Response(status=400, text="Invalid file upload.")
+
+    offset = int(request.match_info["offset"])
+    expected = request.headers.get("X-Checksum-Sha256", "").lower()
+    if not expected:
+        return web.Response(status=400, text="Missing chunk checksum.")
+
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path.touch()
+
+    checksum = hashlib.sha256()
+    size = 0
+    async with AIOFile(str(part_path), "r+b") as afp:
+        async for data in request.content.iter_chunked(1024 * 1024):
+            await afp.write(data, offset=offset + size)
+            checksum.update(data)
+            size += len(data)
+
+    if checksum.hexdigest() != expected:
+        logger.warning("file_upload: checksum mismatch for %s at %d (build %d)", filename, offset, build_id)
+        return web.Response(status=400, text="Chunk checksum mismatch.")
+
+    upload_chunks.setdefault((build_id, filename), {})[offset] = (size, expected)
+    return web.Response(text="chunk received: {} {} ({} bytes)".format(filename, offset, size))
+
+
+@app.http_post("/internal/buildupload/{token}/{filename}")
+async def chunked_upload_complete(request):
+    """
+    Completes a chunked upload, after verifying that all chunks were
+    received and the sha256 of the whole file.
+    """
+    build_id, filename, part_path = get_chunked_upload(request)
+    if not build_id:
+        return web.Response(status=400, text="Invalid file upload.")
+
+    params = await request.json()
+    size = params.get("size")
+    expected = params.get("sha256", "").lower()
+
+    if size == 0:
+        # no chunks are sent for empty files
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path.touch()
+
+    chunks = upload_chunks.get((build_id, filename), {})
+    received = 0
+    for offset, (chunk_size, _) in sorted(chunks.items()):
+        if offset > received:
+            break
+        received = max(received, offset + chunk_size)
+    if received != size or not part_path.exists():
+        return web.Response(status=400, text="Missing chunks, received {} of {} bytes.".format(received, size))
+
+    checksum = hashlib.sha256()
+    async with AIOFile(str(part_path), "rb") as afp:
+        async for data in Reader(afp, chunk_size=1024 * 1024):
+            checksum.update(data)
+
+    upload_chunks.pop((build_id, filename), None)
+    if checksum.hexdigest() != expected:
+        logger.error("file_upload: checksum mismatch for %s (build %d)", filename, build_id)
+        part_path.unlink()
+        return web.Response(status=400, text="File checksum mismatch.")
+
+    try:
+        # truncate data beyond the announced size
+        os.truncate(str(part_path), size)
+        os.rename(str(part_path), str(buildout_path / str(build_id) / filename))
+    except Exception as exc:
+        logger.exception(exc)
+        return web.Response(status=500, text="Error storing uploaded file.")
+
+    logger.debug("file uploaded: %s %dbytes (build %d)", filename, size, build_id)
+    return web.Response(text="file uploaded: {} ({} bytes)".format(filename, size))
+
+
 @app.websocket_connect(group="log")
 async def ws_logs_connected(ws_client):
     token = ws_client.cirrina.request.match_info["token"]
 
-    build_id = None
     with Session() as session:
-        build = session.query(Build).join(BuildTask).filter(BuildTask.task_id == token).first()
-        if not build:
-            logger.error("file_upload: no build found for token '%s'", token)
-            # FIXME: disconnect
-            return ws_client
-        build_id = build.id
+        build_id = get_build_id(token, session)
+    if not build_id:
+        logger.error("file_upload: no build found for token '%s'", token)
+        # FIXME: disconnect
+        return ws_client
 
     logger.debug("ws: recieving logs for build {}".format(build_id))
     ws_client.cirrina.build_id = build_id
+    # not queued with the log lines, so a reconnect is seen before the build outcome
+    await enqueue_backend({"logging_started": build_id})
     return ws_client
 
 
@@ -5,7 +5,8 @@ from pathlib import Path
 from aiofile import AIOFile, Reader
 
 from ..app import app, logger
-from ..molior.notifier import Subject, Event, Action
+from ..molior.notifier import Subject, Event, Action, node_subscribers
+from ..molior.backend import Backend
 from ..model.database import Session
 from ..model.build import Build
 
@@ -136,6 +137,15 @@ async def websocket_message(ws, msg):
         logger.error("unknown websocket message recieved: {}".format(data))
         return
 
+    if data.get("subject") == Subject.node.value:
+        if data.get("action") == Action.start.value:
+            await Backend().get_backend().subscribe_node_status(ws)
+        elif data.get("action") == Action.stop.value:
+            node_subscribers.discard(ws)
+        else:
+            logger.error("unknown websocket message recieved: {}".format(data))
+        return
+
     if data.get("subject") != Subject.buildlog.value:
         logger.error("unknown websocket message recieved: {}".format(data))
         return
@@ -155,5 +165,6 @@ async def websocket_closed(ws):
     On websocket disconnect handler.
     """
     logger.debug("websocket connection closed")
+    node_subscribers.discard(ws)
     if hasattr(ws, "molior_buildlogger"):
         delattr(ws, "molior_buildlogger")
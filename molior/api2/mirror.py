@@ -1,5 +1,6 @@
 import re
 from aiohttp import web
+from datetime import timedelta
 from sqlalchemy import func
 
 from ..app import app, logger
@@ -11,6 +12,7 @@ from ..molior.configuration import Configuration
 from ..model.project import Project
 from ..model.projectversion import ProjectVersion, get_mirror
 from ..model.mirrorkey import MirrorKey
+from ..model.build import DATETIME_FORMAT
 from ..tools import paginate
 
 
@@ -94,8 +96,17 @@ async def get_mirror2(request):
         "mirrorkeyids": mirrorkeyids,
         "mirrorkeyserver": mirrorkeyserver,
         "external_repo": mirror.external_repo,
-        "dependency_policy": mirror.dependency_policy
+        "dependency_policy": mirror.dependency_policy,
+        "update_interval": mirror.mirror_update_interval or 0,
+        "last_check": mirror.mirror_last_check.strftime(DATETIME_FORMAT) if mirror.mirror_last_check else "",
+        "next_check": ""
     }
+    if mirror.mirror_update_interval and mirror.mirror_state == "ready" and not mirror.external_repo:
+        if mirror.mirror_last_check:
+            next_check = mirror.mirror_last_check + timedelta(minutes=mirror.mirror_update_interval)
+            result["next_check"] = next_check.strftime(DATETIME_FORMAT)
+        else:
+            result["next_check"] = "pending"
     return web.json_response(result)
 
 
@@ -546,6 +557,68 @@ async def edit_mirror(request):
     return OKResponse("Mirror update started")
 
 
+@app.http_put("/api2/mirror/{name}/{version}/updates")
+@req_admin
+# FIXME: req_role
+async def put_mirror_updates(request):
+    """
+    Configure scheduled updates of a mirror.
+
+    ---
+    description: Configure scheduled updates of a mirror.
+    tags:
+        - Mirrors
+    parameters:
+        - name: name
+          in: path
+          type: string
+          required: true
+          description: Mirror name
+        - name: version
+          in: path
+          type: string
+          required: true
+          description: Mirror version
+        - name: body
+          in: body
+          description: Update configuration
+          required: true
+          schema:
+              type: object
+              properties:
+                  interval:
+                      required: true
+                      type: integer
+                      description: Minutes between update checks, 0 disables scheduled updates
+    produces:
+        - text/json
+    """
+    db = request.cirrina.db_session
+    mirror_name = request.match_info["name"]
+    mirror_version = request.match_info["version"]
+    params = await request.json()
+
+    try:
+        interval = int(params.get("interval", 0))
+    except (TypeError, ValueError):
+        return ErrorResponse(400, "Invalid update interval")
+    if interval < 0:
+        return ErrorResponse(400, "Invalid update interval")
+
+    mirror = db.query(ProjectVersion).join(Project).filter(
+                func.lower(ProjectVersion.name) == mirror_version.lower(),
+                func.lower(Project.name) == mirror_name.lower(),
+                Project.is_mirror.is_(True)).first()
+    if not mirror:
+        return ErrorResponse(404, "Mirror not found {}/{}".format(mirror_name, mirror_version))
+    if mirror.external_repo:
+        return ErrorResponse(400, "External repositories cannot be updated")
+
+    mirror.mirror_update_interval = interval if interval else None
+    db.commit()
+    return OKResponse("Mirror updates configured")
+
+
 @app.http_delete("/api2/mirror/{name}/{version}")
 @req_admin
 # FIXME: req_role
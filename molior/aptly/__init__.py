@@ -1,2 +1,2 @@
-from .api import AptlyApi, get_aptly_connection, get_snapshot_name  # noqa: F401
+from .api import AptlyApi, get_aptly_connection, close_aptly_connection, get_snapshot_name  # noqa: F401
 from .taskstate import TaskState  # noqa: F401
@@ -1,13 +1,50 @@
+import os
+import time
 import uuid
 import json
+import fcntl
 import asyncio
 import aiohttp
 
+from contextlib import asynccontextmanager
+
 from ..app import logger
 from ..molior.configuration import Configuration
 
-from .taskstate import TaskState
 from .errors import AptlyError
+from .tasktracker import TaskTracker
+from .publishbatcher import PublishBatcher
+from .objectcache import ObjectCache
+from .repolocks import RepoLocks
+
+# ioctl to clone (reflink) a file on btrfs/xfs
+FICLONE = 0x40049409
+
+
+def link_file(src, dst):
+    """
+    Links the file src to dst without copying its data,
+    via hardlink or, across hardlink boundaries, via reflink.
+
+    Returns:
+        bool: True if the file was linked, otherwise False.
+    """
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        pass
+
+    try:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        return True
+    except OSError:
+        try:
+            os.unlink(dst)
+        except OSError:
+            pass
+    return False
 
 
 class AptlyApi:
@@ -26,15 +63,49 @@ class AptlyApi:
     # GPG passphrase file on aptly server machine
     PASSPHRASE_FILE = "/var/lib/aptly/gpg-pass"
 
-    def __init__(self, api_url, gpg_key, username=None, password=None):
+    # Maximum length of package queries in URLs
+    MAX_QUERY_LENGTH = 4000
+
+    def __init__(self, api_url, gpg_key, username=None, password=None, upload_dir=None, upload_concurrency=4,
+                 pool_size=16, timeout=300, publish_window=2, cache_ttl=300):
         self.url = api_url
         self.gpg_key = gpg_key
+        # local aptly upload directory, if aptly runs on the same host
+        self.upload_dir = upload_dir
+        self.upload_concurrency = max(int(upload_concurrency), 1)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = None
+        self.tasks = TaskTracker(self)
+        self.publisher = PublishBatcher(self, publish_window)
+        self.objects = ObjectCache(self, cache_ttl)
+        self.repo_locks = RepoLocks()
         self.headers = {"content-type": "application/json"}
         if username:
             self.auth = aiohttp.BasicAuth(username, password=password)
         else:
             self.auth = None
 
+    @asynccontextmanager
+    async def http(self):
+        """
+        Provides the http session to the aptly api, which is shared
+        by all requests and keeps the connections alive.
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        yield self.session
+
+    async def close(self):
+        """
+        Closes the http session.
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
     @staticmethod
     def __raise_aptly_error(response):
         """
@@ -81,7 +152,7 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         tasks = []
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/tasks", auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -99,7 +170,7 @@ class AptlyApi:
             molior.aptly.errors.AptlyError: If a known error occurs while
                 communicating with the aptly api.
         """
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete(self.url + "/tasks/{}".format(task_id), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -116,7 +187,7 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         state = []
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/tasks/{}".format(task_id), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -185,7 +256,7 @@ class AptlyApi:
             except Exception:
                 raise AptlyError("ConnectionError", "Could not download key: {}".format(key_url))
 
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/gpg/key", headers=self.headers,
                                      data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
@@ -193,7 +264,7 @@ class AptlyApi:
         else:
             data["Keyserver"] = key_server
             data["GpgKeyID"] = " ".join(keys)
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/gpg/key", headers=self.headers,
                                      data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
@@ -225,7 +296,7 @@ class AptlyApi:
                 "DownloadInstaller": download_installer,
             }
 
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/mirrors", headers=self.headers,
                                      data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
@@ -257,7 +328,7 @@ class AptlyApi:
                 "MaxTries": 7,
             }
 
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.put(self.url + "/mirrors/{}-{}".format(name, component), headers=self.headers,
                                     data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
@@ -282,7 +353,7 @@ class AptlyApi:
 
         # remove publish (may fail)
         try:
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.delete(self.url + "/publish/{}/{}".format(publish_name, mirror_distribution),
                                        auth=self.auth,) as resp:
                     if self.__check_status_code(resp.status):
@@ -300,7 +371,7 @@ class AptlyApi:
         # remove mirrors
         for component in components:
             try:
-                async with aiohttp.ClientSession() as http:
+                async with self.http() as http:
                     async with http.delete(self.url + "/mirrors/{}-{}".format(name, component), auth=self.auth) as resp:
                         if self.__check_status_code(resp.status):
                             data = json.loads(await resp.text())
@@ -308,6 +379,7 @@ class AptlyApi:
             except Exception:
                 logger.warning("Error deleting mirror {}/{}".format(publish_name, mirror_distribution))
 
+        self.objects.invalidate()
         return True
 
     async def mirror_snapshot_delete(self, base_mirror, base_mirror_version, mirror, version, components):
@@ -323,7 +395,7 @@ class AptlyApi:
 
         ret = True
         for component in components:
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.delete(self.url + "/snapshots/{}-{}".format(name, component), auth=self.auth) as resp:
                     data = None
                     if self.__check_status_code(resp.status):
@@ -332,6 +404,7 @@ class AptlyApi:
                         ret = False
                     if data and not await self.wait_task(data["ID"]):
                         ret = False
+        self.objects.invalidate("snapshots")
         return ret
 
     async def mirror_snapshot(self, base_mirror, base_mirror_version, mirror, version, components):
@@ -351,19 +424,24 @@ class AptlyApi:
         for component in components:
             data = {"Name": "{}-{}".format(name, component)}
 
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/mirrors/{}-{}/snapshots".format(name, component),
                                      headers=self.headers, data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
                         self.__raise_aptly_error(resp)
                     res = json.loads(await resp.text())
             tasks.append(res["ID"])
+        self.objects.invalidate("snapshots")
         return tasks
 
     async def mirror_get_progress(self, task_id):
         """
         Get progress of an actively running update on aptly.
 
+        The task states are shared with other callers via
+        the task tracker, only the progress detail is
+        fetched per task.
+
         Returns:
             dict: Pending download information
 
@@ -371,23 +449,16 @@ class AptlyApi:
             molior.aptly.errors.AptlyError: If a known error occurs while
                 communicating with the aptly api.
         """
+        state = await self.tasks.get_state(task_id)
+        if not state:
+            raise AptlyError("task {} not found".format(task_id), "")
+        state = dict(state)
+
         progress = {}
-        async with aiohttp.ClientSession() as http:
-            for i in range(20):
-                try:
-                    async with http.get(self.url + "/tasks/{}".format(task_id), auth=self.auth) as resp:
-                        if not self.__check_status_code(resp.status):
-                            self.__raise_aptly_error(resp)
-                        state = json.loads(await resp.text())
-
-                    async with http.get(self.url + "/tasks/{}/detail".format(task_id), auth=self.auth) as resp:
-                        if self.__check_status_code(resp.status):
-                            progress = json.loads(await resp.text())
-                    break
-                except Exception:
-                    logger.warning("Error fetching mirror progress, retrying in 30s")
-                    await asyncio.sleep(30)
-                    continue
+        async with self.http() as http:
+            async with http.get(self.url + "/tasks/{}/detail".format(task_id), auth=self.auth) as resp:
+                if self.__check_status_code(resp.status):
+                    progress = json.loads(await resp.text())
 
         if not progress:
             progress = {
@@ -428,14 +499,74 @@ class AptlyApi:
         for component in components:
             data["Sources"].append({"Component": component, "Name": "{}-{}".format(name, component)})
 
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.post("{}/publish/{}".format(self.url, publish_name), headers=self.headers,
                                  data=json.dumps(data), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 ret = json.loads(await resp.text())["ID"]
+        self.objects.invalidate("publish")
         return ret
 
+    async def mirror_republish(self, base_mirror, base_mirror_version, mirror, version, mirror_distribution, components):
+        """
+        Switches the publish point of an updated mirror to new snapshots.
+
+        Args:
+            mirror (str): The mirror's name.
+            version (str): The mirror's version.
+            mirror_distribution (str): The mirror's distribution.
+            components (list): The mirror's components.
+
+        Returns:
+            bool: True if successful, otherwise False.
+        """
+        name, publish_name = self.get_aptly_names(base_mirror, base_mirror_version, mirror, version, is_mirror=True)
+        # Workaround for aptly ('/' not supported as mirror dist)
+        dist = mirror_distribution.replace("/", "_-")
+
+        snapshots = []
+        for component in components:
+            snapshot_name = "{}-{}".format(name, component)
+            data = {"Name": snapshot_name + "-tmp"}
+            async with self.http() as http:
+                async with http.post(self.url + "/mirrors/{}/snapshots".format(snapshot_name),
+                                     headers=self.headers, data=json.dumps(data), auth=self.auth) as resp:
+                    if not self.__check_status_code(resp.status):
+                        self.__raise_aptly_error(resp)
+                    task_id = json.loads(await resp.text())["ID"]
+            if not await self.wait_task(task_id):
+                return False
+            snapshots.append({"Name": snapshot_name + "-tmp", "Component": component})
+
+        data = json.dumps({
+            "Snapshots": snapshots,
+            "Signing": {
+                "Batch": True,
+                "GpgKey": self.gpg_key,
+                "PassphraseFile": self.PASSPHRASE_FILE,
+            },
+            "AcquireByHash": True,
+        })
+        async with self.http() as http:
+            async with http.put("{}/publish/{}/{}".format(self.url, publish_name, dist),
+                                headers=self.headers, data=data, auth=self.auth) as resp:
+                if not self.__check_status_code(resp.status):
+                    self.__raise_aptly_error(resp)
+                task_id = json.loads(await resp.text())["ID"]
+        if not await self.wait_task(task_id):
+            return False
+
+        for component in components:
+            snapshot_name = "{}-{}".format(name, component)
+            try:
+                await self.wait_task(await self.snapshot_delete(snapshot_name))
+            except Exception:
+                logger.warning("Error deleting mirror snapshot %s", snapshot_name)
+            await self.wait_task(await self.snapshot_rename(snapshot_name + "-tmp", snapshot_name))
+        self.objects.invalidate("snapshots")
+        return True
+
     async def snapshot_create(self, repo_name, snapshot_name, package_refs=None):
         """
         Creates a complete snapshot of a repo or a snapshot with given package_refs.
@@ -448,7 +579,7 @@ class AptlyApi:
         ret = None
         if package_refs:
             data = {"Name": snapshot_name, "PackageRefs": package_refs}
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/snapshots", headers=self.headers,
                                      data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
@@ -456,12 +587,13 @@ class AptlyApi:
                     ret = json.loads(await resp.text())["ID"]
         else:
             data = {"Name": snapshot_name}
-            async with aiohttp.ClientSession() as http:
+            async with self.http() as http:
                 async with http.post(self.url + "/repos/" + repo_name + "/snapshots", headers=self.headers,
                                      data=json.dumps(data), auth=self.auth) as resp:
                     if not self.__check_status_code(resp.status):
                         self.__raise_aptly_error(resp)
                     ret = json.loads(await resp.text())["ID"]
+        self.objects.add("snapshots", snapshot_name)
         return ret
 
     async def snapshot_delete(self, name):
@@ -475,12 +607,13 @@ class AptlyApi:
             int: Aptly's task id.
         """
         ret = None
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete(self.url + "/snapshots/{}".format(name),
                                    headers=self.headers, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 ret = json.loads(await resp.text())["ID"]
+        self.objects.remove("snapshots", name)
         return ret
 
     async def snapshot_get(self):
@@ -491,7 +624,7 @@ class AptlyApi:
             list: List of snapshots
         """
         data = None
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/snapshots", auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -524,12 +657,13 @@ class AptlyApi:
             "AcquireByHash": True,
         }
 
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.post(self.url + "/publish/{}".format(destination),
                                  headers=self.headers, data=json.dumps(data), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 ret = json.loads(await resp.text())["ID"]
+        self.objects.add("publish", "{}/{}".format(destination, dist))
         return ret
 
     async def snapshot_publish_update(self, name, component, dist, destination):
@@ -554,7 +688,7 @@ class AptlyApi:
             "AcquireByHash": True,
         })
 
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.put("{}/publish/{}/{}".format(self.url, destination, dist),
                                 headers=self.headers, data=data, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
@@ -572,12 +706,13 @@ class AptlyApi:
         """
         ret = None
         data = {"Name": new_name}
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.put(self.url + "/snapshots/" + name, headers=self.headers,
                                 data=json.dumps(data), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 ret = json.loads(await resp.text())["ID"]
+        self.objects.rename("snapshots", name, new_name)
         return ret
 
     async def repo_packages_get(self, repo_name, search=None):
@@ -595,13 +730,49 @@ class AptlyApi:
         params = None
         if search:
             params = {"q": search}
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/repos/{}/packages".format(repo_name), params=params, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 ret = json.loads(await resp.text())
         return ret
 
+    async def repo_packages_find(self, repo_name, packages):
+        """
+        Gets the package refs of the given packages from a local repository.
+
+        The packages are looked up with OR-queries, batched to stay
+        within URL length limits, and the batches are run concurrently.
+
+        Args:
+            repo_name (str): The repository's name.
+            packages (list): List of (name, version, arch) tuples,
+                arch being the architecture or "source".
+
+        Returns:
+            list: List of package refs.
+        """
+        queries = []
+        query = ""
+        for package in packages:
+            term = "(%s (= %s) {%s})" % (package[0], package[1], package[2])
+            if query and len(query) + len(term) + 3 > self.MAX_QUERY_LENGTH:
+                queries.append(query)
+                query = ""
+            query = query + " | " + term if query else term
+        if query:
+            queries.append(query)
+
+        results = await asyncio.gather(*[self.repo_packages_get(repo_name, q) for q in queries])
+        package_refs = []
+        seen = set()
+        for refs in results:
+            for ref in refs:
+                if ref not in seen:
+                    seen.add(ref)
+                    package_refs.append(ref)
+        return package_refs
+
     async def repo_packages_delete(self, repo_name, package_refs):
         """
         Removes given packages from the given repository.
@@ -613,7 +784,7 @@ class AptlyApi:
         ret = None
         data = json.dumps({"PackageRefs": package_refs})
         headers = {"content-type": "application/json"}
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete("{}/repos/{}/packages".format(self.url, repo_name),
                                    headers=headers, data=data, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
@@ -629,44 +800,109 @@ class AptlyApi:
             list: List of repos.
         """
         data = None
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/repos", auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 data = json.loads(await resp.text())
         return data
 
-    async def repo_add(self, repo_name, files):
+    async def __upload_file(self, http, sem, upload_dir, filename):
         """
-        Adds the given files to a local aptly repository.
+        Uploads a file to the given aptly upload directory,
+        streaming the file contents.
+        """
+        async with sem:
+            start = time.monotonic()
+            size = os.path.getsize(filename)
+            with open(filename, "rb") as _file:
+                post_files = {"file": _file}
+                async with http.post(self.url + "/files/{}".format(upload_dir), auth=self.auth, data=post_files) as resp:
+                    if not self.__check_status_code(resp.status):
+                        self.__raise_aptly_error(resp)
+            elapsed = max(time.monotonic() - start, 0.001)
+            logger.debug("aptly: uploaded %s (%d bytes) in %.2fs, %.1f MB/s",
+                         os.path.basename(filename), size, elapsed, size / elapsed / 1024 / 1024)
+
+    async def files_upload(self, files):
+        """
+        Uploads the given files to a new aptly upload directory.
 
         Args:
-            repo_name (str): The repository's name.
-            files (list): List of file_paths to be added.
+            files (list): List of file_paths to be uploaded.
 
         Returns:
-            int: The aptly task's id.
+            str: The upload directory.
 
         Raises:
             molior.aptly.errors.AptlyError: If a known error occurs while
                 communicating with the aptly api.
         """
         upload_dir = str(uuid.uuid4())
-        for filename in files:
-            with open(filename, "rb") as _file:
-                post_files = {"file": _file}
-                async with aiohttp.ClientSession() as http:
-                    async with http.post(self.url + "/files/{}".format(upload_dir), auth=self.auth, data=post_files) as resp:
-                        if not self.__check_status_code(resp.status):
-                            self.__raise_aptly_error(resp)
+        local_dir = None
+        if self.upload_dir:
+            local_dir = os.path.join(self.upload_dir, upload_dir)
+            try:
+                os.mkdir(local_dir)
+                # aptly removes the files after adding them
+                os.chmod(local_dir, 0o2775)
+            except OSError as exc:
+                logger.warning("aptly: cannot use local upload dir %s: %s", local_dir, exc)
+                local_dir = None
+
+        uploads = [f for f in files if not (local_dir and link_file(f, os.path.join(local_dir, os.path.basename(f))))]
+
+        async with self.http() as http:
+            sem = asyncio.Semaphore(self.upload_concurrency)
+            await asyncio.gather(*[self.__upload_file(http, sem, upload_dir, f) for f in uploads])
+
+        return upload_dir
+
+    async def repo_add_uploaded(self, repo_name, upload_dir, keep_files=False):
+        """
+        Adds the files of an upload directory to a local aptly repository.
+
+        Args:
+            repo_name (str): The repository's name.
+            upload_dir (str): The upload directory.
+            keep_files (bool): Keep the files in the upload directory,
+                i.e. for adding them to other repositories.
+
+        Returns:
+            int: The aptly task's id.
 
-        async with aiohttp.ClientSession() as http:
-            async with http.post(self.url + "/repos/{}/file/{}".format(repo_name, upload_dir), auth=self.auth) as resp:
+        Raises:
+            molior.aptly.errors.AptlyError: If a known error occurs while
+                communicating with the aptly api.
+        """
+        params = {"noRemove": "1"} if keep_files else None
+        async with self.http() as http:
+            async with http.post(self.url + "/repos/{}/file/{}".format(repo_name, upload_dir),
+                                 params=params, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
                 data = json.loads(await resp.text())
 
-        return data.get("ID"), upload_dir
+        return data.get("ID")
+
+    async def repo_add(self, repo_name, files):
+        """
+        Adds the given files to a local aptly repository.
+
+        Args:
+            repo_name (str): The repository's name.
+            files (list): List of file_paths to be added.
+
+        Returns:
+            int: The aptly task's id.
+
+        Raises:
+            molior.aptly.errors.AptlyError: If a known error occurs while
+                communicating with the aptly api.
+        """
+        upload_dir = await self.files_upload(files)
+        task_id = await self.repo_add_uploaded(repo_name, upload_dir)
+        return task_id, upload_dir
 
     async def repo_create(self, name):
         """
@@ -683,10 +919,11 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         data = {"Name": name}
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.post(self.url + "/repos", headers=self.headers, data=json.dumps(data), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
+        self.objects.add("repos", name)
         return True
 
     async def repo_delete(self, name):
@@ -703,10 +940,11 @@ class AptlyApi:
             molior.aptly.errors.AptlyError: If a known error occurs while
                 communicating with the aptly api.
         """
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete(self.url + "/repos/" + name, headers=self.headers, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
+        self.objects.remove("repos", name)
         return True
 
     async def repo_rename(self, name, new_name):
@@ -724,10 +962,11 @@ class AptlyApi:
                 communicating with the aptly api.
         """
         data = {"Name": new_name}
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.put(self.url + "/repos/" + name, headers=self.headers, data=json.dumps(data), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
+        self.objects.rename("repos", name, new_name)
         return True
 
     async def delete_directory(self, directory_name):
@@ -737,7 +976,7 @@ class AptlyApi:
         Args:
             directory_name (str): The directory's name.
         """
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete(self.url + "/files/{}".format(directory_name), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -751,7 +990,7 @@ class AptlyApi:
             list: List of publish points
         """
         data = None
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.get(self.url + "/publish", auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -772,10 +1011,11 @@ class AptlyApi:
             list: List of publish points
         """
         _, publish_name = self.get_aptly_names(base_mirror, base_mirror_version, repo, version)
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.delete(self.url + "/publish/{}/{}".format(publish_name, distribution), auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
+        self.objects.remove("publish", "{}/{}".format(publish_name, distribution))
         return True
 
     async def cleanup(self):
@@ -787,7 +1027,7 @@ class AptlyApi:
         Returns:
         """
         data = None
-        async with aiohttp.ClientSession() as http:
+        async with self.http() as http:
             async with http.post(self.url + "/db/cleanup", headers=self.headers, auth=self.auth) as resp:
                 if not self.__check_status_code(resp.status):
                     self.__raise_aptly_error(resp)
@@ -803,6 +1043,7 @@ class AptlyApi:
         logger.info("aptly: cleanup succeeded")
 
     async def republish(self, dist, repo_name, publish_name):
+        start = time.monotonic()
         snapshot_name_tmp = get_snapshot_name(publish_name, dist, temporary=True)
 
         # package_refs = await self.__get_packages(ci_build)
@@ -828,6 +1069,7 @@ class AptlyApi:
 
         task_id = await self.snapshot_rename(snapshot_name_tmp, snapshot_name)
         await self.wait_task(task_id)
+        logger.info("aptly: republished %s/%s in %.1fs", publish_name, dist, time.monotonic() - start)
 
     async def wait_task(self, task_id):
         """
@@ -842,39 +1084,50 @@ class AptlyApi:
         if type(task_id) is not int:
             raise Exception("task_id '%s' must be int" % str(task_id))
 
-        while True:
-            await asyncio.sleep(2)
-            try:
-                task_state = await self.get_task_state(task_id)
-            except Exception as exc:
-                logger.exception(exc)
-                return False
+        return await self.tasks.wait(task_id)
 
-            if task_state.get("State") == TaskState.SUCCESSFUL.value:
-                await self.delete_task(task_id)
-                return True
 
-            if task_state.get("State") == TaskState.FAILED.value:
-                logger.error("aptly task %d failed" % task_id)
-                await self.delete_task(task_id)
-                return False
+aptly_connection = None
 
 
 def get_aptly_connection():
     """
     Connects to aptly server and returns aptly
-    object.
+    object, which is shared by all callers.
 
     Returns:
         AptlyApi: The connected aptly api instance.
     """
+    global aptly_connection
+    if aptly_connection:
+        return aptly_connection
+
     cfg = Configuration()
     api_url = cfg.aptly.get("api_url")
     gpg_key = cfg.aptly.get("gpg_key")
     aptly_user = cfg.aptly.get("user")
     aptly_passwd = cfg.aptly.get("pass")
-    aptly = AptlyApi(api_url, gpg_key, username=aptly_user, password=aptly_passwd)
-    return aptly
+    upload_dir = cfg.aptly.get("upload_dir")
+    upload_concurrency = cfg.aptly.get("upload_concurrency", 4)
+    pool_size = cfg.aptly.get("pool_size", 16)
+    timeout = cfg.aptly.get("timeout", 300)
+    publish_window = cfg.aptly.get("publish_window", 2)
+    cache_ttl = cfg.aptly.get("cache_ttl", 300)
+    aptly_connection = AptlyApi(api_url, gpg_key, username=aptly_user, password=aptly_passwd,
+                                upload_dir=upload_dir, upload_concurrency=upload_concurrency,
+                                pool_size=pool_size, timeout=timeout, publish_window=publish_window,
+                                cache_ttl=cache_ttl)
+    return aptly_connection
+
+
+async def close_aptly_connection():
+    """
+    Closes the shared aptly connection.
+    """
+    global aptly_connection
+    if aptly_connection:
+        await aptly_connection.close()
+        aptly_connection = None
 
 
 def get_snapshot_name(publish_name, dist, temporary=False):
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+
+class ObjectCache:
+    """
+    Name indexed cache of the aptly repos, snapshots and publish points.
+
+    The cache is updated on changes done via the aptly api and
+    refreshed completely when it is older than ttl seconds.
+    Publish points are indexed by "<prefix>/<distribution>".
+    """
+
+    KINDS = ("repos", "snapshots", "publish")
+
+    def __init__(self, aptly, ttl=300):
+        self.aptly = aptly
+        self.ttl = ttl
+        self.objects = {}  # kind: {name: object}
+        self.updated = {}  # kind: time of last refresh
+        self.locks = {kind: asyncio.Lock() for kind in self.KINDS}
+        self.stats = {"hits": 0, "refreshes": 0}
+
+    @staticmethod
+    def get_name(kind, obj):
+        if kind == "publish":
+            return "{}/{}".format(obj.get("Prefix"), obj.get("Distribution"))
+        return obj.get("Name")
+
+    async def refresh(self, kind):
+        if kind == "repos":
+            objects = await self.aptly.repo_get()
+        elif kind == "snapshots":
+            objects = await self.aptly.snapshot_get()
+        else:
+            objects = await self.aptly.publish_get()
+        self.objects[kind] = {self.get_name(kind, obj): obj for obj in objects or []}
+        self.updated[kind] = time.monotonic()
+        self.stats["refreshes"] += 1
+
+    async def get(self, kind):
+        """
+        Returns the aptly objects of the given kind, indexed by name.
+        """
+        async with self.locks[kind]:
+            updated = self.updated.get(kind)
+            if updated is None or time.monotonic() - updated > self.ttl:
+                await self.refresh(kind)
+            else:
+                self.stats["hits"] += 1
+        return self.objects[kind]
+
+    async def exists(self, kind, name):
+        return name in await self.get(kind)
+
+    def add(self, kind, name, obj=None):
+        if kind in self.objects:
+            self.objects[kind][name] = obj if obj is not None else {"Name": name}
+
+    def remove(self, kind, name):
+        if kind in self.objects:
+            self.objects[kind].pop(name, None)
+
+    def rename(self, kind, name, new_name):
+        if kind in self.objects:
+            obj = dict(self.objects[kind].pop(name, None) or {})
+            obj["Name"] = new_name
+            self.objects[kind][new_name] = obj
+
+    def invalidate(self, kind=None):
+        for k in [kind] if kind else self.KINDS:
+            self.updated.pop(k, None)
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        for kind in self.KINDS:
+            metrics[kind] = len(self.objects.get(kind, {}))
+        return metrics
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+
+from ..app import logger
+
+
+class PublishBatcher:
+    """
+    Coalesces republishing of aptly publish points.
+
+    Packages are added to the repository right away, while the
+    republish of a (publish_name, dist) is delayed for a short
+    window, or until no more packages are being added, and done
+    once for all packages added meanwhile.
+    """
+
+    def __init__(self, aptly, window=2):
+        self.aptly = aptly
+        self.window = window
+        self.batches = {}  # (publish_name, dist): (future, repo_name)
+        self.locks = {}  # (publish_name, dist): asyncio.Lock
+        self.adding = 0
+        self.stats = {"requests": 0, "republishes": 0}
+
+    @asynccontextmanager
+    async def add(self):
+        """
+        Marks packages being added, which delays pending republishes.
+        """
+        self.adding += 1
+        try:
+            yield
+        finally:
+            self.adding -= 1
+
+    async def republish(self, dist, repo_name, publish_name):
+        """
+        Republishes the publish point, together with other
+        requests for the same publish point.
+
+        Raises:
+            Exception: if the republish failed.
+        """
+        self.stats["requests"] += 1
+        key = (publish_name, dist)
+        batch = self.batches.get(key)
+        if not batch:
+            batch = (asyncio.get_event_loop().create_future(), repo_name)
+            self.batches[key] = batch
+            asyncio.ensure_future(self.flush(key))
+        await asyncio.shield(batch[0])
+
+    async def flush(self, key):
+        deadline = time.monotonic() + self.window
+        while self.adding and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        # republishes of the same publish point must not overlap
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            # requests arriving from now on need another republish
+            future, repo_name = self.batches.pop(key)
+            publish_name, dist = key
+            self.stats["republishes"] += 1
+            try:
+                await self.aptly.republish(dist, repo_name, publish_name)
+            except Exception as exc:
+                logger.exception(exc)
+                future.set_exception(exc)
+                return
+            future.set_result(True)
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        metrics["pending"] = len(self.batches)
+        return metrics
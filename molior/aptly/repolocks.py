@@ -0,0 +1,78 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+
+
+class RepoLocks:
+    """
+    Orders the aptly operations on the repositories of a publish point.
+
+    Adding and removing packages, and the republishes, share the
+    publish point, while creating, snapshotting, dropping and deleting
+    it, or deleting builds, needs exclusive access. Waiting exclusive
+    operations are preferred over new shared ones.
+    """
+
+    def __init__(self):
+        self.shared_count = {}  # publish_name: number of shared holders
+        self.exclusive_held = set()  # publish_name
+        self.exclusive_waiting = {}  # publish_name: number of waiting exclusive holders
+        self.condition = None
+        self.stats = {"shared": 0, "exclusive": 0}
+
+    def _condition(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def _can_share(self, name):
+        return name not in self.exclusive_held and not self.exclusive_waiting.get(name)
+
+    def _can_lock(self, names):
+        return all(name not in self.exclusive_held and not self.shared_count.get(name) for name in names)
+
+    @asynccontextmanager
+    async def shared(self, name):
+        condition = self._condition()
+        async with condition:
+            await condition.wait_for(lambda: self._can_share(name))
+            self.shared_count[name] = self.shared_count.get(name, 0) + 1
+            self.stats["shared"] += 1
+        try:
+            yield
+        finally:
+            async with condition:
+                self.shared_count[name] -= 1
+                if not self.shared_count[name]:
+                    del self.shared_count[name]
+                condition.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self, *names):
+        names = set(names)
+        condition = self._condition()
+        async with condition:
+            for name in names:
+                self.exclusive_waiting[name] = self.exclusive_waiting.get(name, 0) + 1
+            try:
+                await condition.wait_for(lambda: self._can_lock(names))
+            finally:
+                for name in names:
+                    self.exclusive_waiting[name] -= 1
+                    if not self.exclusive_waiting[name]:
+                        del self.exclusive_waiting[name]
+                condition.notify_all()
+            self.exclusive_held.update(names)
+            self.stats["exclusive"] += 1
+        try:
+            yield
+        finally:
+            async with condition:
+                self.exclusive_held.difference_update(names)
+                condition.notify_all()
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        metrics["locked"] = len(self.exclusive_held)
+        metrics["waiting"] = sum(self.exclusive_waiting.values())
+        return metrics
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from ..app import logger
+from .taskstate import TaskState
+
+
+class TaskTracker:
+    """
+    Tracks the completion of aptly tasks.
+
+    All outstanding tasks are polled with a single /tasks request.
+    The poll interval starts short and backs off while nothing
+    completes, and is reset whenever a new task is waited for.
+    Waiters are resolved as soon as their task is done.
+
+    If querying the tasks fails, it is retried after the ERROR_INTERVALS,
+    and the waiters fail only if all retries failed.
+    """
+
+    INTERVALS = (0.1, 0.2, 0.5, 1, 2)
+    ERROR_INTERVALS = (1, 2, 5, 10, 30, 60)
+
+    def __init__(self, aptly, intervals=INTERVALS, error_intervals=ERROR_INTERVALS):
+        self.aptly = aptly
+        self.intervals = intervals
+        self.error_intervals = error_intervals
+        self.waiters = {}  # task_id: (future, start time)
+        self.step = 0
+        self.errors = 0  # consecutive errors querying the tasks
+        self.poller = None
+        self.stats = {"tasks": 0, "failed": 0, "polls": 0, "errors": 0, "wait_total": 0.0, "wait_max": 0.0}
+        self.states = {}  # task_id: task info of the last state query
+        self.states_updated = None
+        self.states_lock = asyncio.Lock()
+
+    async def wait(self, task_id):
+        """
+        Waits for the aptly task to finish.
+
+        Returns:
+            bool: True if task was succesful, otherwise False.
+        """
+        if task_id not in self.waiters:
+            self.waiters[task_id] = (asyncio.get_event_loop().create_future(), time.monotonic())
+        future, _ = self.waiters[task_id]
+        self.step = 0
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.ensure_future(self.poll())
+        return await asyncio.shield(future)
+
+    def _resolve(self, task_id, result):
+        future, start = self.waiters.pop(task_id)
+        elapsed = time.monotonic() - start
+        self.stats["tasks"] += 1
+        self.stats["wait_total"] += elapsed
+        self.stats["wait_max"] = max(self.stats["wait_max"], elapsed)
+        if not result:
+            self.stats["failed"] += 1
+        if not future.done():
+            future.set_result(result)
+
+    async def poll(self):
+        while self.waiters:
+            if self.errors:
+                await asyncio.sleep(self.error_intervals[self.errors - 1])
+            else:
+                await asyncio.sleep(self.intervals[min(self.step, len(self.intervals) - 1)])
+            self.step += 1
+            self.stats["polls"] += 1
+            try:
+                tasks = await self.aptly.get_tasks()
+            except Exception as exc:
+                self.errors += 1
+                self.stats["errors"] += 1
+                if self.errors <= len(self.error_intervals):
+                    logger.warning("error querying aptly tasks (%d. attempt): %s", self.errors, str(exc))
+                    continue
+                logger.exception(exc)
+                self.errors = 0
+                for task_id in list(self.waiters):
+                    self._resolve(task_id, False)
+                return
+            self.errors = 0
+
+            states = {task.get("ID"): task.get("State") for task in tasks}
+            for task_id in list(self.waiters):
+                state = states.get(task_id)
+                if state is None:
+                    logger.error("aptly task %d not found" % task_id)
+                    self._resolve(task_id, False)
+                    continue
+
+                if state not in (TaskState.SUCCESSFUL.value, TaskState.FAILED.value):
+                    continue
+
+                if state == TaskState.FAILED.value:
+                    logger.error("aptly task %d failed" % task_id)
+                try:
+                    await self.aptly.delete_task(task_id)
+                except Exception as exc:
+                    logger.exception(exc)
+                self._resolve(task_id, state == TaskState.SUCCESSFUL.value)
+                self.step = 0
+
+    async def get_state(self, task_id, max_age=1):
+        """
+        Returns the task info of a running or finished aptly task.
+        The states of all tasks are queried at most once per max_age
+        seconds and shared by all callers.
+
+        Returns:
+            dict: The task info, or None if the task does not exist.
+        """
+        async with self.states_lock:
+            if self.states_updated is None or time.monotonic() - self.states_updated > max_age:
+                tasks = await self.aptly.get_tasks()
+                self.states = {task.get("ID"): task for task in tasks}
+                self.states_updated = time.monotonic()
+                self.stats["polls"] += 1
+        return self.states.get(task_id)
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        metrics["waiting"] = len(self.waiters)
+        metrics["wait_avg"] = self.stats["wait_total"] / self.stats["tasks"] if self.stats["tasks"] else 0.0
+        return metrics
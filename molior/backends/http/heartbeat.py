@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from ...app import logger
+
+
+class HeartbeatManager:
+    """
+    Pings all connected build nodes from a single task.
+
+    Nodes are kept by node id. The ping deadlines are kept in a timer
+    wheel with one slot per second, so every tick only handles the
+    nodes which are due in that second. A node which did not answer
+    the previous ping when it is due again is reported as timed out.
+    """
+
+    def __init__(self, timeout, on_timeout):
+        self.timeout = max(int(timeout), 1)
+        self.on_timeout = on_timeout
+        self.nodes = {}  # node_id: NodeState
+        self.wheel = [set() for _ in range(self.timeout + 1)]
+        self.slots = {}  # node_id: wheel slot
+        self.cursor = 0
+        self.pending = {}  # node_id: time the unanswered ping was sent
+        self.missed = {}  # node_id: number of missed pongs
+        self.stats = {"pings": 0, "pongs": 0, "missed_pongs": 0}
+        self.rtt_total = 0.0
+
+    def _schedule(self, node_id, delay):
+        slot = (self.cursor + delay) % len(self.wheel)
+        self.wheel[slot].add(node_id)
+        self.slots[node_id] = slot
+
+    def add(self, node_id, node):
+        """
+        Starts pinging the node, replacing an older connection of the same node.
+        """
+        if node_id in self.nodes:
+            self.remove(node_id)
+        self.nodes[node_id] = node
+        self._schedule(node_id, 1)
+
+    def remove(self, node_id, node=None):
+        """
+        Stops pinging the node. If node is given, the node is only
+        removed if it was not replaced by a newer connection.
+        """
+        if node is not None and self.nodes.get(node_id) is not node:
+            return
+        self.nodes.pop(node_id, None)
+        slot = self.slots.pop(node_id, None)
+        if slot is not None:
+            self.wheel[slot].discard(node_id)
+        self.pending.pop(node_id, None)
+
+    def pong(self, node_id):
+        sent = self.pending.pop(node_id, None)
+        if sent is None:
+            return
+        self.stats["pongs"] += 1
+        self.rtt_total += time.monotonic() - sent
+
+    async def tick(self):
+        self.cursor = (self.cursor + 1) % len(self.wheel)
+        due = self.wheel[self.cursor]
+        self.wheel[self.cursor] = set()
+
+        for node_id in due:
+            self.slots.pop(node_id, None)
+            node = self.nodes.get(node_id)
+            if node is None:
+                continue
+
+            if node_id in self.pending:
+                self.stats["missed_pongs"] += 1
+                self.missed[node_id] = self.missed.get(node_id, 0) + 1
+                logger.warning("backend: ping timeout after %ds on %s/%s", self.timeout, node.node_class, node.name)
+                self.remove(node_id)
+                try:
+                    await self.on_timeout(node)
+                except Exception as exc:
+                    logger.exception(exc)
+                continue
+
+            self.pending[node_id] = time.monotonic()
+            self.stats["pings"] += 1
+            self._schedule(node_id, self.timeout)
+            try:
+                await node.send({"ping": 1})
+            except Exception as exc:
+                logger.exception(exc)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self.tick()
+            except Exception as exc:
+                logger.exception(exc)
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        metrics["nodes"] = len(self.nodes)
+        metrics["pending"] = len(self.pending)
+        metrics["avg_rtt"] = self.rtt_total / self.stats["pongs"] if self.stats["pongs"] else 0.0
+        metrics["missed_pongs_by_node"] = dict(self.missed)
+        return metrics
@@ -1,14 +1,21 @@
 import asyncio
 import json
+import time
+
+from collections import OrderedDict
 
 from ...app import app, logger
 from ...molior.configuration import Configuration
-from ...molior.queues import enqueue_backend, enqueue_buildtask, dequeue_buildtask
-from ...molior.notifier import Subject, Event, notify
+from ...molior.queues import (
+    enqueue_backend, enqueue_buildtask, dequeue_buildtask, requeue_buildtask, buildtask_done, get_project_shares,
+    remove_buildtask)
+from ...molior.notifier import Subject, Event, node_subscribers
+from .heartbeat import HeartbeatManager
+from .nodes import NodeState, NodeRegistry
 
 
-registry = {"amd64": [], "arm64": []}
-running_nodes = {"amd64": [], "arm64": []}
+# connected build nodes
+registry = NodeRegistry()
 
 cfg = Configuration()
 pt = cfg.backend_http.get("ping_timeout")
@@ -17,36 +24,138 @@ if pt:
 else:
     PING_TIMEOUT = 5
 
+# node classes (build queues) and the build architectures they handle,
+# optionally restricted to certain source packages
+DEFAULT_NODE_CLASSES = {
+    "amd64": {"architectures": ["amd64", "i386"]},
+    "arm64": {"architectures": ["arm64", "armhf"]},
+}
+NODE_CLASSES = cfg.backend_http.get("node_classes") or DEFAULT_NODE_CLASSES
 
-async def watchdog(ws_client):
-    try:
-        arch = ws_client.molior_node_arch
-        while True:
-            # stop if disconnected
-            if ws_client not in registry[arch] and ws_client not in running_nodes[arch]:
-                break
 
-            # was pong recieved ?
-            if hasattr(ws_client, "molior_pong_pending") and ws_client.molior_pong_pending == 1:
-                logger.warning("backend: ping timeout after %ds on %s/%s",
-                               PING_TIMEOUT, ws_client.molior_node_arch, ws_client.molior_node_name)
-                await deregister_node(ws_client)
-                # await ws_client.close()
+def get_node_class(arch, sourcename):
+    """
+    Returns the node class to build the given architecture on.
+    Node classes dedicated to the source package are preferred,
+    unless no node of the dedicated class is registered.
+    """
+    fallback = None
+    dedicated = None
+    for node_class, settings in NODE_CLASSES.items():
+        if arch not in settings.get("architectures", []):
+            continue
+        sourcenames = settings.get("sourcenames")
+        if not sourcenames:
+            if not fallback:
+                fallback = node_class
+            continue
+        if sourcename in sourcenames and not dedicated:
+            dedicated = node_class
+    if not dedicated:
+        return fallback
+    if fallback and not any(node.node_class == dedicated for node in registry.nodes.values()):
+        logger.warning("backend: no %s node registered, building %s on %s", dedicated, sourcename, fallback)
+        return fallback
+    return dedicated
+
+
+# seconds a build is kept for a disconnected node to reconnect
+RECONNECT_GRACE = int(cfg.backend_http.get("reconnect_grace", 60))
+
+# busy nodes which lost their connection, by node key
+lost_nodes = {}
+reconnect_stats = {"lost": 0, "resumed": 0, "expired": 0}
+
+lcs = cfg.backend_http.get("locality_cache_size")
+if lcs:
+    LOCALITY_CACHE_SIZE = int(lcs)
+else:
+    LOCALITY_CACHE_SIZE = 16
+
+# recently built sources and used chroots per node name, most recent last
+node_locality = {}
+locality_stats = {"dispatched": 0, "sourcename_hits": 0, "chroot_hits": 0, "misses": 0}
+
+
+def get_locality_keys(task):
+    """
+    Returns the cache keys a build task would warm up on a node:
+    the source package (ccache, apt cache) and the chroot.
+    """
+    return (("source", task.get("repository_name")),
+            ("chroot", task.get("distrelease"), task.get("distversion"), task.get("architecture")))
+
+
+def get_locality_score(node, task):
+    """
+    Returns 2 if the node recently built the same source package,
+    1 if it recently used the same chroot, otherwise 0.
+    """
+    recent = node_locality.get(node.name)
+    if not recent:
+        return 0
+    source_key, chroot_key = get_locality_keys(task)
+    if source_key in recent:
+        return 2
+    if chroot_key in recent:
+        return 1
+    return 0
+
+
+def remember_locality(node, task):
+    recent = node_locality.get(node.name)
+    if recent is None:
+        recent = OrderedDict()
+        node_locality[node.name] = recent
+    for key in get_locality_keys(task):
+        recent.pop(key, None)
+        recent[key] = True
+    while len(recent) > LOCALITY_CACHE_SIZE:
+        recent.popitem(last=False)
+
+
+def select_node(node_class, task):
+    """
+    Selects an idle node of the given class for the task.
+
+    The node which was idle the longest is used, unless another idle
+    node has warm caches for the task (same source package or chroot).
+
+    Returns:
+        The NodeState of the selected node, or None if no node is idle.
+    """
+    best = None
+    best_score = -1
+    for node in registry.get_nodes("idle", node_class):
+        score = get_locality_score(node, task)
+        if score > best_score:
+            best = node
+            best_score = score
+            if best_score == 2:
                 break
 
-            # send ping
-            ws_client.molior_pong_pending = 1
-            if asyncio.iscoroutinefunction(ws_client.send_str):
-                await ws_client.send_str(json.dumps({"ping": 1}))
-            else:
-                ws_client.send_str(json.dumps({"ping": 1}))
+    if not best:
+        return None
 
-            # wait for pong
-            await asyncio.sleep(PING_TIMEOUT)
+    locality_stats["dispatched"] += 1
+    if best_score == 2:
+        locality_stats["sourcename_hits"] += 1
+    elif best_score == 1:
+        locality_stats["chroot_hits"] += 1
+    else:
+        locality_stats["misses"] += 1
 
-    except Exception as exc:
-        logger.exception(exc)
-        # await ws_client.close()
+    remember_locality(best, task)
+    return best
+
+
+def get_locality_metrics():
+    dispatched = locality_stats["dispatched"]
+    hits = locality_stats["sourcename_hits"] + locality_stats["chroot_hits"]
+    metrics = dict(locality_stats)
+    metrics["hit_rate"] = hits / dispatched if dispatched else 0.0
+    metrics["sourcename_hit_rate"] = locality_stats["sourcename_hits"] / dispatched if dispatched else 0.0
+    return metrics
 
 
 @app.websocket_connect(group="registry")
@@ -54,82 +163,64 @@ async def node_register(ws_client):
     node = ws_client.cirrina.request.match_info["node"]
     arch = ws_client.cirrina.request.match_info["arch"]
 
-    if arch not in registry:
-        logger.error("backend: invalid architecture received: '%s'", arch)
+    if arch not in NODE_CLASSES:
+        logger.error("backend: invalid node class received: '%s'", arch)
         # await ws_client.close()
         return ws_client
 
-    # initialize
-    ws_client.molior_node_name = node
-    ws_client.molior_node_arch = arch
-    ws_client.molior_cpu_cores = 0
-    ws_client.molior_load = 0
-    ws_client.molior_ram_total = 0
-    ws_client.molior_disk_total = 0
-    ws_client.molior_nodeid = ""
-    ws_client.molior_ip = ""
-    ws_client.molior_client_ver = ""
-    ws_client.molior_ram_used = 0
-    ws_client.molior_disk_used = 0
-    ws_client.molior_sourcename = ""
-    ws_client.molior_sourceversion = ""
-    ws_client.molior_sourcearch = ""
-    ws_client.molior_uptime_seconds = 0
-
-    registry[arch].insert(0, ws_client)
-    logger.info("backend: %s node registered: %s", arch, node)
-    asyncio.ensure_future(watchdog(ws_client))
-    await enqueue_backend({"node_registered": 1})
+    # the node is added to the registry with its register message
+    ws_client.molior_node = NodeState(ws_client, node, arch)
 
 
 @app.websocket_message("/internal/registry/{arch}/{node}",
                        group="registry", authenticated=False)
 async def node_message(ws_client, msg):
     try:
+        node = getattr(ws_client, "molior_node", None)
+        if not node:
+            return
+
         status = json.loads(msg)
         if "register" in status:
-            ws_client.molior_cpu_cores = status["register"].get("cpu_cores")
-            ws_client.molior_ram_total = status["register"].get("ram_total")
-            ws_client.molior_disk_total = status["register"].get("disk_total")
-            ws_client.molior_nodeid = status["register"].get("id")
-            ws_client.molior_ip = status["register"].get("ip")
-            ws_client.molior_client_ver = status["register"].get("client_ver")
+            node.update(cpu_cores=status["register"].get("cpu_cores"),
+                        ram_total=status["register"].get("ram_total"),
+                        disk_total=status["register"].get("disk_total"),
+                        node_id=status["register"].get("id") or "",
+                        ip=status["register"].get("ip"),
+                        client_ver=status["register"].get("client_ver"))
+            old_node = registry.get(node.key)
+            if old_node:
+                logger.warning("backend: node %s/%s registered again", node.node_class, node.name)
+                await deregister_node(old_node)
+            registry.add(node)
+            heartbeat.add(node.key, node)
+            logger.info("backend: %s node registered: %s", node.node_class, node.name)
+            if await resume_build(node, status["register"].get("build_id")):
+                return
+            await enqueue_backend({"node_registered": 1})
             return
 
         if "pong" in status:
-            ws_client.molior_pong_pending = 0
-            ws_client.molior_uptime_seconds = status["pong"]["uptime_seconds"]
-            ws_client.molior_load = status["pong"]["load"]
-            ws_client.molior_ram_used = status["pong"].get("ram_used")
-            ws_client.molior_disk_used = status["pong"].get("disk_used")
+            heartbeat.pong(node.key)
+            node.update(uptime_seconds=status["pong"]["uptime_seconds"],
+                        load=status["pong"]["load"],
+                        ram_used=status["pong"].get("ram_used"),
+                        disk_used=status["pong"].get("disk_used"))
             return
 
-        arch = ws_client.molior_node_arch
-        build_id = ws_client.molior_build_id
+        build_id = node.build_id
 
         if status["status"] == "building":
             await enqueue_backend({"started": build_id})
 
         elif status["status"] == "failed":
             await enqueue_backend({"failed": build_id})
-            if ws_client in running_nodes[arch]:
-                running_nodes[arch].remove(ws_client)
-                registry[arch].insert(0, ws_client)
-            ws_client.molior_build_id = None
-            ws_client.molior_sourcename = ""
-            ws_client.molior_sourceversion = ""
-            ws_client.molior_sourcearch = ""
+            finish_build(node)
 
         elif status["status"] == "success":
             logger.debug("node: finished build {}".format(build_id))
             await enqueue_backend({"succeeded": build_id})
-            if ws_client in running_nodes[arch]:
-                running_nodes[arch].remove(ws_client)
-                registry[arch].insert(0, ws_client)
-            ws_client.molior_build_id = None
-            ws_client.molior_sourcename = ""
-            ws_client.molior_sourceversion = ""
-            ws_client.molior_sourcearch = ""
+            finish_build(node)
 
         else:
             logger.error("backend: invalid message received: '%s'", status["status"])
@@ -140,25 +231,179 @@ async def node_message(ws_client, msg):
 
 @app.websocket_disconnect(group="registry")
 async def node_disconnected(ws_client):
-    await deregister_node(ws_client)
+    node = getattr(ws_client, "molior_node", None)
+    if node:
+        await deregister_node(node)
 
 
-async def deregister_node(ws_client):
-    node = ws_client.molior_node_name
-    arch = ws_client.molior_node_arch
+def finish_build(node):
+    """
+    Frees the node after its build finished, also if the build
+    finished on a connection which was already considered lost.
+    """
+    if node.state != "busy":
+        return
+    buildtask_done(node.project)
+    if lost_nodes.get(node.key) is node:
+        del lost_nodes[node.key]
+        node.update(state="idle", build_id=None)
+    elif registry.get(node.key) is node:
+        registry.set_idle(node)
 
-    if ws_client in registry[arch]:
-        registry[arch].remove(ws_client)
-        logger.warning("backend: node disconnected: %s/%s", arch, node)
 
-    elif ws_client in running_nodes[arch]:
-        running_nodes[arch].remove(ws_client)
-        build_id = ws_client.molior_build_id
-        logger.error("backend: lost build_%d on %s/%s", build_id, arch, node)
-        await enqueue_backend({"failed": build_id})
+async def deregister_node(node):
+    heartbeat.remove(node.key, node)
+    if not registry.remove(node):
+        logger.warning("backend: unknown node disconnect: %s/%s", node.node_class, node.name)
+        return
 
-    else:
-        logger.warning("backend: unknown node disconnect: %s/%s", arch, node)
+    if node.state != "busy":
+        logger.warning("backend: node disconnected: %s/%s", node.node_class, node.name)
+        return
+
+    if not RECONNECT_GRACE:
+        await fail_lost_build(node)
+        return
+
+    logger.warning("backend: node %s/%s disconnected while building build_%d, waiting %ds for reconnect",
+                   node.node_class, node.name, node.build_id, RECONNECT_GRACE)
+    reconnect_stats["lost"] += 1
+    lost_nodes[node.key] = node
+    asyncio.ensure_future(expire_lost_node(node))
+
+
+async def fail_lost_build(node):
+    logger.error("backend: lost build_%d on %s/%s", node.build_id, node.node_class, node.name)
+    buildtask_done(node.project)
+    await enqueue_backend({"failed": node.build_id})
+
+
+async def expire_lost_node(node):
+    await asyncio.sleep(RECONNECT_GRACE)
+    if lost_nodes.get(node.key) is not node:
+        return
+    del lost_nodes[node.key]
+    reconnect_stats["expired"] += 1
+    await fail_lost_build(node)
+
+
+async def resume_build(node, build_id):
+    """
+    Reattaches the build of a node which reconnected within the grace period.
+
+    Returns:
+        bool: True if the build was reattached.
+    """
+    lost_node = lost_nodes.pop(node.key, None)
+    if not lost_node:
+        return False
+
+    if build_id != lost_node.build_id:
+        await fail_lost_build(lost_node)
+        return False
+
+    registry.set_busy(node, build_id,
+                      sourcename=lost_node.sourcename,
+                      sourceversion=lost_node.sourceversion,
+                      sourcearch=lost_node.sourcearch,
+                      project=lost_node.project)
+    reconnect_stats["resumed"] += 1
+    logger.info("backend: resumed build_%d on %s/%s", build_id, node.node_class, node.name)
+    return True
+
+
+heartbeat = HeartbeatManager(PING_TIMEOUT, deregister_node)
+
+NODE_STATUS_FIELDS = ["state", "uptime_seconds", "load", "ram_used", "disk_used",
+                      "sourcename", "sourceversion", "sourcearch"]
+NODE_STATUS_INTERVAL = cfg.backend_http.get("node_status_interval") or 4
+
+# node status last sent to each subscribed websocket client
+# ws: {"sent": timestamp, "nodes": {node_id: {field: value}}}
+node_status_clients = {}
+
+
+def get_node_status_delta(known, current):
+    """
+    Returns the changed fields per node and the ids of removed nodes,
+    compared to the node status known by a client.
+    """
+    changed = []
+    for node_id, status in current.items():
+        old = known.get(node_id)
+        if old is None:
+            delta = dict(status)
+        else:
+            delta = {field: value for field, value in status.items() if old.get(field) != value}
+            if not delta:
+                continue
+        delta["id"] = node_id
+        changed.append(delta)
+    removed = [{"id": node_id} for node_id in known if node_id not in current]
+    return changed, removed
+
+
+def get_node_status():
+    current = {}
+    for node in registry.nodes.values():
+        info = node.info()
+        current[info["id"]] = {field: info[field] for field in NODE_STATUS_FIELDS}
+    return current
+
+
+async def subscribe_node_status(ws):
+    """
+    Subscribes a websocket client to node status updates.
+
+    The client gets the status of all nodes first, the
+    following updates contain the changed fields only.
+    """
+    current = get_node_status()
+    # registered before sending, so the notifier does not send the snapshot again
+    node_status_clients[ws] = {"sent": time.monotonic(), "nodes": current}
+    node_subscribers.add(ws)
+    snapshot, _ = get_node_status_delta({}, current)
+    try:
+        await ws.send_str(json.dumps({"subject": Subject.node.value, "event": Event.changed.value,
+                                      "data": snapshot}))
+    except Exception:
+        node_subscribers.discard(ws)
+        node_status_clients.pop(ws, None)
+
+
+async def send_node_status():
+    current = get_node_status()
+
+    for ws in list(node_status_clients):
+        if ws not in node_subscribers:
+            del node_status_clients[ws]
+
+    now = time.monotonic()
+    for ws in list(node_subscribers):
+        client = node_status_clients.get(ws)
+        if not client:
+            continue
+        if now - client["sent"] < NODE_STATUS_INTERVAL:
+            continue
+
+        changed, removed = get_node_status_delta(client["nodes"], current)
+        if not changed and not removed:
+            continue
+
+        try:
+            if changed:
+                await ws.send_str(json.dumps({"subject": Subject.node.value, "event": Event.changed.value,
+                                              "data": changed}))
+            if removed:
+                await ws.send_str(json.dumps({"subject": Subject.node.value, "event": Event.removed.value,
+                                              "data": removed}))
+        except Exception:
+            node_subscribers.discard(ws)
+            del node_status_clients[ws]
+            continue
+
+        client["sent"] = now
+        client["nodes"] = current
 
 
 class HTTPBackend:
@@ -168,22 +413,28 @@ class HTTPBackend:
 
     def __init__(self, loop):
         self.loop = loop
-        asyncio.ensure_future(self.scheduler("amd64"), loop=self.loop)
-        asyncio.ensure_future(self.scheduler("arm64"), loop=self.loop)
+        self.schedulers = {}
+        for node_class in NODE_CLASSES:
+            self.start_scheduler(node_class)
         asyncio.ensure_future(self.notifier(), loop=self.loop)
+        asyncio.ensure_future(heartbeat.run(), loop=self.loop)
+
+    def start_scheduler(self, node_class):
+        if node_class in self.schedulers:
+            return
+        self.schedulers[node_class] = asyncio.ensure_future(self.scheduler(node_class), loop=self.loop)
 
     async def build(self, build_id, token, build_version, apt_server, arch, arch_any_only, distrelease_name, distrelease_version,
-                    project_dist, sourcename, project_name, project_version, apt_urls, apt_keys, run_lintian=True):
+                    project_dist, sourcename, project_name, project_version, apt_urls, apt_keys, run_lintian=True,
+                    estimated_duration=None, builddeps_key=None, chroot=None):
         task_id = "build_%d" % build_id
-        if arch == "i386" or arch == "amd64":
-            queue_arch = "amd64"
-        elif arch == "armhf" or arch == "arm64":
-            queue_arch = "arm64"
-        else:
-            logger.error("backend: invalid build architecture '%s'", arch)
+        node_class = get_node_class(arch, sourcename)
+        if not node_class:
+            logger.error("backend: no node class for build architecture '%s'", arch)
             return False
 
-        await enqueue_buildtask(queue_arch, {"build_id": build_id,
+        self.start_scheduler(node_class)
+        await enqueue_buildtask(node_class, {"build_id": build_id,
                                              "token": token,
                                              "version": build_version,
                                              "apt_server": apt_server,
@@ -198,107 +449,123 @@ class HTTPBackend:
                                              "apt_urls": apt_urls,
                                              "apt_keys": apt_keys,
                                              "task_id": task_id,
-                                             "run_lintian": run_lintian})
+                                             "run_lintian": run_lintian,
+                                             "estimated_duration": estimated_duration,
+                                             "builddeps_key": builddeps_key,
+                                             "chroot": chroot})
+
+    async def prefetch_chroot(self, arch, chroot):
+        """
+        Asks all nodes building the given architecture to download
+        a new chroot version in parallel.
+        """
+        node_classes = [node_class for node_class, settings in NODE_CLASSES.items()
+                        if arch in settings.get("architectures", [])]
+        nodes = [node for node in registry.nodes.values() if node.node_class in node_classes]
+        logger.info("backend: prefetching chroot %s on %d nodes", chroot.get("name"), len(nodes))
+        results = await asyncio.gather(*[node.send({"prefetch_chroot": chroot}) for node in nodes],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("backend: error sending chroot prefetch: %s", result)
 
     def get_nodes_info(self):
-        # FIXME: lock both dicts on every access
-        build_nodes = []
-        for arch in registry:
-            for node in registry[arch]:
-                build_nodes.append({
-                    "name": node.molior_node_name,
-                    "arch": arch,
-                    "state": "idle",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "cpu_cores": node.molior_cpu_cores,
-                    "ram_used": node.molior_ram_used,
-                    "ram_total": node.molior_ram_total,
-                    "disk_used": node.molior_disk_used,
-                    "disk_total": node.molior_disk_total,
-                    "id": node.molior_nodeid,
-                    "ip": node.molior_ip,
-                    "client_ver": node.molior_client_ver,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                })
-        for arch in running_nodes:
-            for node in running_nodes[arch]:
-                build_nodes.append({
-                    "name": node.molior_node_name,
-                    "arch": arch,
-                    "state": "busy",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "cpu_cores": node.molior_cpu_cores,
-                    "ram_used": node.molior_ram_used,
-                    "ram_total": node.molior_ram_total,
-                    "disk_used": node.molior_disk_used,
-                    "disk_total": node.molior_disk_total,
-                    "id": node.molior_nodeid,
-                    "ip": node.molior_ip,
-                    "client_ver": node.molior_client_ver,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                })
-        return build_nodes
-
-    async def scheduler(self, arch):
+        return [node.info() for node in registry.nodes.values()]
+
+    async def subscribe_node_status(self, ws):
+        await subscribe_node_status(ws)
+
+    def get_node_info(self, node_id):
+        node = registry.get(node_id)
+        if not node:
+            return None
+        return node.info()
+
+    async def cancel(self, build_id, abort_running=False):
+        """
+        Cancels a queued build task. If the build is already running,
+        it is aborted on the build node if abort_running is set.
+
+        Returns:
+            str: "dequeued" if the build task was removed from the queue,
+                 "aborted" if the build was aborted on a build node,
+                 otherwise None.
+        """
+        node = registry.get_by_build(build_id)
+        if not node:
+            for lost_node in list(lost_nodes.values()):
+                if lost_node.build_id != build_id:
+                    continue
+                if not abort_running:
+                    return None
+                # do not wait for the node to reconnect
+                del lost_nodes[lost_node.key]
+                await fail_lost_build(lost_node)
+                return "aborted"
+        if node:
+            if not abort_running:
+                return None
+            logger.info("build-%d: aborting on %s/%s", build_id, node.node_class, node.name)
+            await node.send({"abort": build_id})
+            return "aborted"
+
+        if remove_buildtask(build_id):
+            logger.info("build-%d: cancelled", build_id)
+            return "dequeued"
+        return None
+
+    def get_metrics(self):
+        return {
+            "locality": get_locality_metrics(),
+            "projects": get_project_shares(),
+            "heartbeat": heartbeat.get_metrics(),
+            "nodes": registry.get_counts(),
+            "reconnect": dict(reconnect_stats, waiting=len(lost_nodes))
+        }
+
+    async def scheduler(self, node_class):
         while True:
             try:
-                task = await dequeue_buildtask(arch)
+                # wait for an idle node, so the fair share is decided when dispatching
+                while not registry.count("idle", node_class):
+                    await asyncio.sleep(1)
+
+                task = await dequeue_buildtask(node_class)
                 if task is None:
                     logger.error("backend: got emtpy task, aborting...")
                     break
 
                 build_id = task["build_id"]
 
-                while True:
-                    try:
-                        node = registry[arch].pop()
-                    except IndexError:
-                        # FIXME: put task to top of the queue / pending queue
-                        await asyncio.sleep(1)
-                        continue
-                    break
-                running_nodes[arch].append(node)
-                logger.info("build-%d: building for %s on %s ", build_id, arch, node.molior_node_name)
-                node.molior_build_id = build_id
-                node.molior_sourcename = task.get("repository_name")
-                node.molior_sourceversion = task.get("version")
-                node.molior_sourcearch = task.get("architecture")
-                if asyncio.iscoroutinefunction(node.send_str):
-                    await node.send_str(json.dumps({"task": task}))
-                else:
-                    node.send_str(json.dumps({"task": task}))
+                node = select_node(node_class, task)
+                if not node:
+                    # node disconnected meanwhile
+                    requeue_buildtask(node_class, task)
+                    continue
+
+                logger.info("build-%d: building for %s on %s ", build_id, node_class, node.name)
+                registry.set_busy(node, build_id,
+                                  sourcename=task.get("repository_name"),
+                                  sourceversion=task.get("version"),
+                                  sourcearch=task.get("architecture"),
+                                  project=task.get("project"))
+                await node.send({"task": task})
 
             except Exception as exc:
                 logger.exception(exc)
-
-            await asyncio.sleep(1)
+                await asyncio.sleep(1)
 
     async def notifier(self):
+        """
+        Sends the changed node fields to the subscribed websocket clients,
+        at most once per node_status_interval per client.
+        """
         while True:
-            nodes = []
-            for arch in registry:
-                nodes.extend(registry[arch])
-            for arch in running_nodes:
-                nodes.extend(running_nodes[arch])
-
-            data = []
-            for node in nodes:
-                data.append({
-                    "id": node.molior_nodeid,
-                    "state": "busy" if node in running_nodes["amd64"] or node in running_nodes["arm64"] else "idle",
-                    "uptime_seconds": node.molior_uptime_seconds,
-                    "load": node.molior_load,
-                    "ram_used": node.molior_ram_used,
-                    "disk_used": node.molior_disk_used,
-                    "sourcename": node.molior_sourcename,
-                    "sourceversion": node.molior_sourceversion,
-                    "sourcearch": node.molior_sourcearch
-                    })
-            await notify(Subject.node.value, Event.changed.value, data)
-            await asyncio.sleep(4)
+            await asyncio.sleep(1)
+            try:
+                if not node_subscribers:
+                    node_status_clients.clear()
+                    continue
+                await send_node_status()
+            except Exception as exc:
+                logger.exception(exc)
@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+from collections import OrderedDict
+
+
+class NodeState:
+    """
+    State of a connected build node.
+    """
+
+    __slots__ = ("ws", "name", "node_class", "node_id", "state", "cpu_cores", "ram_total", "disk_total",
+                 "ip", "client_ver", "uptime_seconds", "load", "ram_used", "disk_used",
+                 "build_id", "sourcename", "sourceversion", "sourcearch", "project", "_info")
+
+    def __init__(self, ws, name, node_class):
+        self.ws = ws
+        self.name = name
+        self.node_class = node_class
+        self.node_id = ""
+        self.state = "idle"
+        self.cpu_cores = 0
+        self.ram_total = 0
+        self.disk_total = 0
+        self.ip = ""
+        self.client_ver = ""
+        self.uptime_seconds = 0
+        self.load = 0
+        self.ram_used = 0
+        self.disk_used = 0
+        self.build_id = None
+        self.sourcename = ""
+        self.sourceversion = ""
+        self.sourcearch = ""
+        self.project = None
+        self._info = None
+
+    @property
+    def key(self):
+        if self.node_id:
+            return self.node_id
+        return "%s/%s" % (self.node_class, self.name)
+
+    def update(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+        self._info = None
+
+    def info(self):
+        """
+        Returns the node info dict, which is cached until the node changes.
+        """
+        if self._info is None:
+            self._info = {
+                "name": self.name,
+                "arch": self.node_class,
+                "state": self.state,
+                "uptime_seconds": self.uptime_seconds,
+                "load": self.load,
+                "cpu_cores": self.cpu_cores,
+                "ram_used": self.ram_used,
+                "ram_total": self.ram_total,
+                "disk_used": self.disk_used,
+                "disk_total": self.disk_total,
+                "id": self.node_id,
+                "ip": self.ip,
+                "client_ver": self.client_ver,
+                "sourcename": self.sourcename,
+                "sourceversion": self.sourceversion,
+                "sourcearch": self.sourcearch
+            }
+        return self._info
+
+    async def send(self, msg):
+        if asyncio.iscoroutinefunction(self.ws.send_str):
+            await self.ws.send_str(json.dumps(msg))
+        else:
+            self.ws.send_str(json.dumps(msg))
+
+
+class NodeRegistry:
+    """
+    Connected build nodes, indexed by node id, by state and node class,
+    and by the build running on them.
+
+    Nodes of the same state and class are kept in the order they entered
+    the state, i.e. the first idle node is the one idle the longest.
+    """
+
+    def __init__(self):
+        self.nodes = {}  # key: NodeState
+        self.index = {}  # (state, node_class): OrderedDict(key: NodeState)
+        self.builds = {}  # build_id: NodeState
+
+    def _index(self, node):
+        return self.index.setdefault((node.state, node.node_class), OrderedDict())
+
+    def add(self, node):
+        self.nodes[node.key] = node
+        self._index(node)[node.key] = node
+        if node.build_id is not None:
+            self.builds[node.build_id] = node
+
+    def remove(self, node):
+        """
+        Removes the node, if it is still registered with this state object.
+        """
+        if self.nodes.get(node.key) is not node:
+            return False
+        del self.nodes[node.key]
+        self._index(node).pop(node.key, None)
+        if node.build_id is not None and self.builds.get(node.build_id) is node:
+            del self.builds[node.build_id]
+        return True
+
+    def get(self, key):
+        return self.nodes.get(key)
+
+    def get_by_build(self, build_id):
+        return self.builds.get(build_id)
+
+    def get_nodes(self, state, node_class):
+        """
+        Returns the nodes in the given state and class, longest in that state first.
+        """
+        nodes = self.index.get((state, node_class))
+        if not nodes:
+            return []
+        return list(nodes.values())
+
+    def count(self, state, node_class):
+        return len(self.index.get((state, node_class), ()))
+
+    def set_busy(self, node, build_id, **kwargs):
+        self._index(node).pop(node.key, None)
+        node.update(state="busy", build_id=build_id, **kwargs)
+        self._index(node)[node.key] = node
+        self.builds[build_id] = node
+
+    def set_idle(self, node):
+        self._index(node).pop(node.key, None)
+        if node.build_id is not None and self.builds.get(node.build_id) is node:
+            del self.builds[node.build_id]
+        node.update(state="idle", build_id=None, sourcename="", sourceversion="", sourcearch="", project=None)
+        self._index(node)[node.key] = node
+
+    def get_counts(self):
+        counts = {}
+        for (state, node_class), nodes in self.index.items():
+            counts.setdefault(node_class, {})[state] = len(nodes)
+        return counts
@@ -58,6 +58,7 @@ class Build(Base):
     children = relationship("Build", backref=backref("parent", remote_side=[id]), remote_side=[parent_id])
     is_ci = Column(Boolean, default=False)
     builddeps = Column(String)
+    builddeps_hash = Column(String)
     buildtask = relationship(BuildTask, uselist=False)
     architecture = Column(String)
     debianpackages = relationship(Debianpackage, secondary=BuildDebianpackage)
@@ -1,8 +1,11 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, event
 from sqlalchemy.orm import relationship
 
 from .database import Base
 
+# task_id: build_id of existing build tasks
+build_ids = {}
+
 
 class BuildTask(Base):
     __tablename__ = "buildtask"
@@ -11,3 +14,23 @@ class BuildTask(Base):
     build_id = Column(ForeignKey("build.id"))
     build = relationship("Build")
     task_id = Column(String)
+
+
+def get_build_id(task_id, session):
+    """
+    Returns the build id for the given build task token,
+    cached for the lifetime of the build task.
+    """
+    build_id = build_ids.get(task_id)
+    if build_id:
+        return build_id
+    buildtask = session.query(BuildTask).filter(BuildTask.task_id == task_id).first()
+    if not buildtask or not buildtask.build_id:
+        return None
+    build_ids[task_id] = buildtask.build_id
+    return buildtask.build_id
+
+
+@event.listens_for(BuildTask, "after_delete")
+def forget_build_id(mapper, connection, target):
+    build_ids.pop(target.task_id, None)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Enum, Boolean, func, select
+from sqlalchemy import Column, ForeignKey, Integer, String, Enum, Boolean, DateTime, func, select
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -51,6 +51,9 @@ class ProjectVersion(Base):
     mirror_with_sources = Column(Boolean, default=False)
     mirror_with_installer = Column(Boolean, default=False)
     mirror_keys = relationship("MirrorKey", back_populates="mirrors")
+    mirror_update_interval = Column(Integer)  # minutes between scheduled update checks
+    mirror_release_hash = Column(String)  # sha256 of the last seen upstream (In)Release file
+    mirror_last_check = Column(DateTime(timezone=True), nullable=True)
     is_locked = Column(Boolean, default=False)
     ci_builds_enabled = Column(Boolean, default=False)
     is_deleted = Column(Boolean, default=False)
@@ -1,11 +1,17 @@
 import re
+import os
+import time
+import asyncio
+import aiohttp
+import hashlib
 
-from sqlalchemy import func
+from sqlalchemy import func, or_
 
 from ..app import logger
 from ..tools import get_changelog_attr, db2array
 from .configuration import Configuration
 
+from ..model.build import Build
 from ..model.project import Project
 from ..model.sourepprover import SouRepProVer
 from ..model.projectversion import ProjectVersion
@@ -14,6 +20,18 @@ from ..model.projectversion import get_projectversion_deps
 
 TARGET_ARCH_ORDER = ["amd64", "i386", "arm64", "armhf"]
 
+# number of recent builds used for the build duration estimate
+BUILD_DURATION_HISTORY = 5
+# seconds a build duration estimate is cached
+BUILD_DURATION_CACHE_TTL = 600
+
+# (sourcename, architecture, projectversion_id): (timestamp, duration)
+build_durations = {}
+
+# directory of the published chroot tarballs
+CHROOT_DIR = "/var/lib/schroot/chroots"
+BUILDDEPS_FIELDS = ("Build-Depends", "Build-Depends-Arch", "Build-Depends-Indep")
+
 
 def get_projectversion(path):
     """
@@ -293,3 +311,250 @@ def get_buildorder(path):
         return []
 
     return build_after
+
+
+def get_builddeps_hash(path):
+    """
+    Returns a hash of the build dependencies in debian/control.
+
+    Args:
+        path (pathlib.Path): Path to git repository
+
+    Returns:
+        str: sha256 hex digest, or None if debian/control was not found.
+    """
+    control = path / "debian" / "control"
+    if not control.exists():
+        logger.warning("%s: does not exist", str(control))
+        return None
+
+    fields = {}
+    field = None
+    with open(str(control), "r", errors="replace") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            if not line.strip():
+                # the source package paragraph ends here
+                if fields:
+                    break
+                continue
+            if line[0] in " \t":
+                if field:
+                    fields[field] += " " + line.strip()
+                continue
+            name, _, value = line.partition(":")
+            field = name.strip() if name.strip() in BUILDDEPS_FIELDS else None
+            if field:
+                fields[field] = value.strip()
+
+    builddeps = []
+    for name in BUILDDEPS_FIELDS:
+        deps = [" ".join(dep.split()) for dep in fields.get(name, "").split(",") if dep.strip()]
+        builddeps.append("%s: %s" % (name, ", ".join(sorted(deps))))
+    return hashlib.sha256("\n".join(builddeps).encode()).hexdigest()
+
+
+def get_chroot_version(name, version, arch):
+    """
+    Returns the active version of the chroot tarball.
+
+    Returns:
+        str: The tarball name the chroot symlink points to, or "" if unversioned.
+    """
+    tarball = os.path.join(CHROOT_DIR, "%s-%s-%s.tar.xz" % (name, version, arch))
+    try:
+        return os.path.basename(os.readlink(tarball))
+    except OSError:
+        return ""
+
+
+def get_chroot_artifact(name, version, arch):
+    """
+    Returns the content hash of the active chroot tarball, and the hash
+    of the previous version, if the build nodes can fetch a delta from it.
+
+    Returns:
+        dict: {"name": ..., "hash": ..., "base": ...}, or None if the chroot has no hash.
+    """
+    chroot_name = "%s-%s-%s" % (name, version, arch)
+    tarball = os.path.realpath(os.path.join(CHROOT_DIR, chroot_name + ".tar.xz"))
+    try:
+        with open(tarball + ".sha256") as f:
+            chroot_hash = f.read().strip()
+    except OSError:
+        return None
+
+    base = None
+    try:
+        with open(tarball + ".base") as f:
+            base = f.read().strip()
+    except OSError:
+        pass
+    return {"name": chroot_name, "hash": chroot_hash, "base": base}
+
+
+async def get_release_hash(mirror_url, mirror_distribution):
+    """
+    Returns the sha256 of the InRelease (or Release) file of an apt
+    repository, i.e. an upstream mirror, or None if it cannot be downloaded.
+    """
+    if mirror_distribution.endswith("/"):  # flat repository
+        base_url = "{}/{}".format(mirror_url.rstrip("/"), mirror_distribution.rstrip("/"))
+    else:
+        base_url = "{}/dists/{}".format(mirror_url.rstrip("/"), mirror_distribution)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as http:
+        for filename in ["InRelease", "Release"]:
+            try:
+                async with http.get("{}/{}".format(base_url, filename)) as resp:
+                    if resp.status == 200:
+                        return hashlib.sha256(await resp.read()).hexdigest()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                logger.warning("error downloading %s/%s: %s", base_url, filename, str(exc))
+    return None
+
+
+async def get_apt_sources_state(apt_urls):
+    """
+    Returns a hash of the Release files of the given apt sources,
+    which changes whenever packages are published to one of them.
+
+    Args:
+        apt_urls (list): apt sources lines, i.e. "deb <url> <dist> <components>"
+
+    Returns:
+        str: sha256 hex digest, or None if a Release file cannot be downloaded.
+    """
+    hashes = await asyncio.gather(*[get_release_hash(*apt_url.split()[1:3]) for apt_url in sorted(apt_urls)])
+    if not all(hashes):
+        return None
+    return hashlib.sha256("\n".join(hashes).encode()).hexdigest()
+
+
+def get_builddeps_key(builddeps_hash, chroot_version, arch, apt_urls, apt_state):
+    """
+    Returns the key of the build dependency overlay cache on the build nodes.
+    The overlay depends on the build dependencies, the chroot version and
+    the apt sources used for resolving the build dependencies, including
+    the packages published to them.
+
+    Returns:
+        str: sha256 hex digest, or None if the build dependencies
+             or the state of the apt sources are unknown.
+    """
+    if not builddeps_hash or not apt_state:
+        return None
+    data = "\n".join([builddeps_hash, chroot_version, arch, apt_state] + sorted(apt_urls))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _get_build_durations(query):
+    durations = []
+    for startstamp, buildendstamp in query.order_by(Build.id.desc()).limit(BUILD_DURATION_HISTORY):
+        duration = (buildendstamp - startstamp).total_seconds()
+        if duration > 0:
+            durations.append(duration)
+    return durations
+
+
+def get_build_duration(sourcename, architecture, projectversion_id, session):
+    """
+    Returns the estimated duration of a deb build, based on the recent
+    builds of the same source package and architecture.
+
+    Builds in the same projectversion are preferred, builds in other
+    projectversions are used if there is no history yet.
+
+    Args:
+        sourcename (str): The source package name.
+        architecture (str): The build architecture.
+        projectversion_id (int): The projectversion id.
+        session: The database session.
+
+    Returns:
+        float: Estimated duration in seconds, or None if unknown.
+    """
+    key = (sourcename, architecture, projectversion_id)
+    cached = build_durations.get(key)
+    now = time.monotonic()
+    if cached and now - cached[0] < BUILD_DURATION_CACHE_TTL:
+        return cached[1]
+
+    query = session.query(Build.startstamp, Build.buildendstamp).filter(
+            Build.buildtype == "deb",
+            Build.sourcename == sourcename,
+            Build.architecture == architecture,
+            Build.buildstate.in_(["needs_publish", "publishing", "publish_failed", "successful"]),
+            Build.startstamp.isnot(None),
+            Build.buildendstamp.isnot(None))
+
+    durations = _get_build_durations(query.filter(Build.projectversion_id == projectversion_id))
+    if not durations:
+        durations = _get_build_durations(query)
+
+    duration = None
+    if durations:
+        duration = sum(durations) / len(durations)
+
+    build_durations[key] = (now, duration)
+    return duration
+
+
+def get_build_durations(keys, session):
+    """
+    Returns the estimated durations of several deb builds, like
+    get_build_duration, with a single query for all keys not cached.
+
+    Args:
+        keys (list): List of (sourcename, architecture, projectversion_id).
+        session: The database session.
+
+    Returns:
+        dict: {(sourcename, architecture, projectversion_id): duration or None}
+    """
+    now = time.monotonic()
+    result = {}
+    missing = set()
+    for key in set(keys):
+        cached = build_durations.get(key)
+        if cached and now - cached[0] < BUILD_DURATION_CACHE_TTL:
+            result[key] = cached[1]
+        else:
+            missing.add(key)
+    if not missing:
+        return result
+
+    # the recent builds per projectversion, and per source package and architecture
+    recent = session.query(
+            Build.sourcename, Build.architecture, Build.projectversion_id, Build.startstamp, Build.buildendstamp,
+            func.row_number().over(partition_by=(Build.sourcename, Build.architecture, Build.projectversion_id),
+                                   order_by=Build.id.desc()).label("projectversion_rank"),
+            func.row_number().over(partition_by=(Build.sourcename, Build.architecture),
+                                   order_by=Build.id.desc()).label("rank")).filter(
+            Build.buildtype == "deb",
+            Build.sourcename.in_({key[0] for key in missing}),
+            Build.architecture.in_({key[1] for key in missing}),
+            Build.buildstate.in_(["needs_publish", "publishing", "publish_failed", "successful"]),
+            Build.startstamp.isnot(None),
+            Build.buildendstamp.isnot(None)).subquery()
+    rows = session.query(recent).filter(or_(recent.c.projectversion_rank <= BUILD_DURATION_HISTORY,
+                                            recent.c.rank <= BUILD_DURATION_HISTORY)).all()
+
+    by_projectversion = {}
+    by_source = {}
+    for row in rows:
+        duration = (row.buildendstamp - row.startstamp).total_seconds()
+        if duration <= 0:
+            continue
+        if row.projectversion_rank <= BUILD_DURATION_HISTORY:
+            by_projectversion.setdefault((row.sourcename, row.architecture, row.projectversion_id), []).append(duration)
+        if row.rank <= BUILD_DURATION_HISTORY:
+            by_source.setdefault((row.sourcename, row.architecture), []).append(duration)
+
+    for key in missing:
+        durations = by_projectversion.get(key) or by_source.get(key[:2])
+        duration = sum(durations) / len(durations) if durations else None
+        build_durations[key] = (now, duration)
+        result[key] = duration
+    return result
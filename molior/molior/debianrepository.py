@@ -1,3 +1,4 @@
+import re
 import asyncio
 
 from datetime import datetime, timedelta
@@ -16,6 +17,8 @@ class DebianRepository:
     # Time to live for ci packages in days
     CI_PACKAGES_TTL = 7
     DATETIME_FORMAT = "%Y%m%d%H%M%S"
+    # CI package versions contain the build time: 1.0.0+git20171128085843-57121d3
+    CI_VERSION_TIMESTAMP = re.compile(r"\+git(\d{14})")
 
     def __init__(self, basemirror_name, basemirror_version, project_name, project_version, archs):
         self.basemirror_name = basemirror_name
@@ -59,41 +62,37 @@ class DebianRepository:
         if they don't already exist.
         """
         logger.debug("init repository called for '%s'", self.name)
-        snapshots = await self.aptly.snapshot_get()
-        repos = await self.aptly.repo_get()
-
-        for dist in self.DISTS:
-            repo_name = self.name + "-%s" % dist
-            for repo in repos:
-                if repo.get("Name") == repo_name:
+        async with self.aptly.repo_locks.exclusive(self.publish_name):
+            for dist in self.DISTS:
+                repo_name = self.name + "-%s" % dist
+                if await self.aptly.objects.exists("repos", repo_name):
                     logger.error("aptly repo '%s' already exists", repo_name)
                     return False
-            snapshot_name = get_snapshot_name(self.publish_name, dist)
-            for snapshot in snapshots:
-                if snapshot.get("Name") == snapshot_name:
+                snapshot_name = get_snapshot_name(self.publish_name, dist)
+                if await self.aptly.objects.exists("snapshots", snapshot_name):
                     logger.error("publish point for '%s' already exists", snapshot_name)
                     return False
 
-        for dist in self.DISTS:
-            repo_name = self.name + "-%s" % dist
-            logger.info("creating repository '%s'", repo_name)
-            await self.aptly.repo_create(repo_name)  # not a background task
+            for dist in self.DISTS:
+                repo_name = self.name + "-%s" % dist
+                logger.info("creating repository '%s'", repo_name)
+                await self.aptly.repo_create(repo_name)  # not a background task
 
-            snapshot_name = get_snapshot_name(self.publish_name, dist)
+                snapshot_name = get_snapshot_name(self.publish_name, dist)
 
-            logger.debug("creating empty snapshot: '%s'", snapshot_name)
+                logger.debug("creating empty snapshot: '%s'", snapshot_name)
 
-            # package_refs = await self.__get_packages(dist == "unstable")
-            task_id = await self.aptly.snapshot_create(repo_name, snapshot_name)
-            await self.aptly.wait_task(task_id)
+                # package_refs = await self.__get_packages(dist == "unstable")
+                task_id = await self.aptly.snapshot_create(repo_name, snapshot_name)
+                await self.aptly.wait_task(task_id)
 
-            # Add source and all archs per default
-            archs = self.archs + ["source", "all"]
+                # Add source and all archs per default
+                archs = self.archs + ["source", "all"]
 
-            logger.debug("publishing snapshot: '%s' archs: '%s'", snapshot_name, str(archs))
-            task_id = await self.aptly.snapshot_publish(snapshot_name, "main", archs, dist, self.publish_name)
-            await self.aptly.wait_task(task_id)
-        return True
+                logger.debug("publishing snapshot: '%s' archs: '%s'", snapshot_name, str(archs))
+                task_id = await self.aptly.snapshot_publish(snapshot_name, "main", archs, dist, self.publish_name)
+                await self.aptly.wait_task(task_id)
+            return True
 
     async def snapshot(self, snapshot_version, packages):
         """
@@ -107,57 +106,55 @@ class DebianRepository:
 
         logger.info("creating release snapshot: '%s'", snapshot_name)
 
-        package_refs = []
-        for package in packages:
-            pkgs = await self.aptly.repo_packages_get(repo_name, "%s (= %s) {%s}" % (package[0],   # package name
-                                                                                     package[1],   # version
-                                                                                     package[2]))  # arch or "source"
-            package_refs += pkgs
+        async with self.aptly.repo_locks.exclusive(self.publish_name):
+            # packages: (name, version, arch or "source")
+            package_refs = await self.aptly.repo_packages_find(repo_name, packages)
 
-        task_id = await self.aptly.snapshot_create(repo_name, snapshot_name, package_refs)
-        await self.aptly.wait_task(task_id)
+            task_id = await self.aptly.snapshot_create(repo_name, snapshot_name, package_refs)
+            await self.aptly.wait_task(task_id)
 
-        archs = self.archs.extend(["source", "all"])
-        task_id = await self.aptly.snapshot_publish(snapshot_name, "main", archs, dist, publish_name)
-        await self.aptly.wait_task(task_id)
+            archs = self.archs.extend(["source", "all"])
+            task_id = await self.aptly.snapshot_publish(snapshot_name, "main", archs, dist, publish_name)
+            await self.aptly.wait_task(task_id)
 
     async def delete(self):
         """
         Delete a repository including publish point amd snapshots
         """
-        for dist in self.DISTS:
-            repo_name = self.name + "-%s" % dist
-            try:
-                # FIXME: should this aptly task run in background?
-                await self.aptly.publish_drop(self.basemirror_name,
-                                              self.basemirror_version,
-                                              self.project_name,
-                                              self.project_version, dist)
-            except Exception:
-                logger.warning("Error deleting publish point of repo '%s'" % repo_name)
-            await asyncio.sleep(2)
-
-            # FIXME: delete also old timestamped snapshots
-            snapshot_name = get_snapshot_name(self.publish_name, dist)
-            try:
-                task_id = await self.aptly.snapshot_delete(snapshot_name)
-                await self.aptly.wait_task(task_id)
-            except Exception:
-                logger.warning("Error deleting snapshot '%s'" % snapshot_name)
-
-            # delete leftover tmp snapshot
-            snapshot_name = get_snapshot_name(self.publish_name, dist, temporary=True)
-            try:
-                task_id = await self.aptly.snapshot_delete(snapshot_name)
-                await self.aptly.wait_task(task_id)
-            except Exception:
-                pass
-
-            try:
-                # FIXME: should this aptly task run in background?
-                await self.aptly.repo_delete(repo_name)
-            except Exception:
-                logger.warning("Error deleting repo '%s'" % repo_name)
+        async with self.aptly.repo_locks.exclusive(self.publish_name):
+            for dist in self.DISTS:
+                repo_name = self.name + "-%s" % dist
+                try:
+                    # FIXME: should this aptly task run in background?
+                    await self.aptly.publish_drop(self.basemirror_name,
+                                                  self.basemirror_version,
+                                                  self.project_name,
+                                                  self.project_version, dist)
+                except Exception:
+                    logger.warning("Error deleting publish point of repo '%s'" % repo_name)
+                await asyncio.sleep(2)
+
+                # FIXME: delete also old timestamped snapshots
+                snapshot_name = get_snapshot_name(self.publish_name, dist)
+                try:
+                    task_id = await self.aptly.snapshot_delete(snapshot_name)
+                    await self.aptly.wait_task(task_id)
+                except Exception:
+                    logger.warning("Error deleting snapshot '%s'" % snapshot_name)
+
+                # delete leftover tmp snapshot
+                snapshot_name = get_snapshot_name(self.publish_name, dist, temporary=True)
+                try:
+                    task_id = await self.aptly.snapshot_delete(snapshot_name)
+                    await self.aptly.wait_task(task_id)
+                except Exception:
+                    pass
+
+                try:
+                    # FIXME: should this aptly task run in background?
+                    await self.aptly.repo_delete(repo_name)
+                except Exception:
+                    logger.warning("Error deleting repo '%s'" % repo_name)
 
     async def __remove_old_packages(self, packages):
         """
@@ -169,21 +166,18 @@ class DebianRepository:
                 e.g. ['Pi386 hooks-test 1.0.3+git20171128085843-57121d3 c36ac']
 
         Returns:
-            list: List of packages.
+            list: List of remaining packages, all packages if
+                  deleting the old packages failed.
         """
         now = datetime.now()
         delete_date = now - timedelta(days=self.__ci_packages_ttl)
 
         old_packages = []
         for pkg in packages:
-            if "+git" not in pkg:
+            match = self.CI_VERSION_TIMESTAMP.search(pkg)
+            if not match:
                 continue
-            gitpart = pkg.split("+git")[1]
-            if "-" in gitpart:
-                dt_str = gitpart.split("-")[0]
-            else:
-                dt_str = gitpart.split(".")[0]
-            timestamp = datetime.strptime(dt_str, self.DATETIME_FORMAT)
+            timestamp = datetime.strptime(match.group(1), self.DATETIME_FORMAT)
             if timestamp < delete_date:
                 old_packages.append(pkg)
 
@@ -192,18 +186,38 @@ class DebianRepository:
 
         repo_name = self.name + "-unstable"
         try:
-            for old_package in old_packages[:1]:
-                logger.info("removing old package from aptly: '%s'", old_package)
-                task_id = await self.aptly.repo_packages_delete(repo_name, [old_package])
-                ret = await self.aptly.wait_task(task_id)
-                if not ret:
-                    logger.error("Error deleting package: %s (task %d)", old_package, task_id)
+            logger.info("removing %d old packages from aptly repo '%s'", len(old_packages), repo_name)
+            task_id = await self.aptly.repo_packages_delete(repo_name, old_packages)
+            ret = await self.aptly.wait_task(task_id)
+            if not ret:
+                logger.error("Error deleting %d packages from %s (task %d)", len(old_packages), repo_name, task_id)
+                return packages
         except Exception as exc:
             logger.exception(exc)
+            return packages
 
         return list(set(packages) - set(old_packages))
 
-    async def add_packages(self, files, ci_build=False):
+    async def expire_ci_packages(self):
+        """
+        Removes all expired CI packages from the unstable repository
+        and republishes it, if packages were removed.
+
+        Returns:
+            int: Number of removed packages.
+        """
+        async with self.aptly.repo_locks.shared(self.publish_name):
+            repo_name = self.name + "-unstable"
+            packages = await self.aptly.repo_packages_get(repo_name)
+            if not packages:
+                return 0
+            remaining = await self.__remove_old_packages(packages)
+            removed = len(packages) - len(remaining)
+            if removed:
+                await self.aptly.publisher.republish("unstable", repo_name, self.publish_name)
+            return removed
+
+    async def add_packages(self, files, ci_build=False, upload_dir=None):
         """
         Adds the given files/packages to the debian repository,
         creates a new snapshot and publishes the snapshot.
@@ -212,18 +226,28 @@ class DebianRepository:
             files (list): List of filepaths to the package files.
             ci_build (bool): Packages will be pushed to the unstable
                 publish point if set to True.
+            upload_dir (str): Aptly upload directory already containing
+                the files, which is kept for adding them to other repositories.
         """
         dist = "unstable" if ci_build else "stable"
         repo_name = self.name + "-%s" % dist
-        task_id, upload_dir = await self.aptly.repo_add(repo_name, files)
+        async with self.aptly.repo_locks.shared(self.publish_name):
+            async with self.aptly.publisher.add():
+                if upload_dir:
+                    task_id = await self.aptly.repo_add_uploaded(repo_name, upload_dir, keep_files=True)
+                    await self.aptly.wait_task(task_id)
+                else:
+                    task_id, upload_dir = await self.aptly.repo_add(repo_name, files)
+
+                    logger.debug("repo add returned aptly task id '%s' and upload dir '%s'", task_id, upload_dir)
+                    logger.debug("waiting for repo add task with id '%s' to finish", task_id)
 
-        logger.debug("repo add returned aptly task id '%s' and upload dir '%s'", task_id, upload_dir)
-        logger.debug("waiting for repo add task with id '%s' to finish", task_id)
+                    await self.aptly.wait_task(task_id)
 
-        await self.aptly.wait_task(task_id)
+                    logger.debug("repo add task with id '%s' has finished", task_id)
+                    logger.debug("deleting temporary upload dir: '%s'", upload_dir)
 
-        logger.debug("repo add task with id '%s' has finished", task_id)
-        logger.debug("deleting temporary upload dir: '%s'", upload_dir)
+                    await self.aptly.delete_directory(upload_dir)
 
-        await self.aptly.delete_directory(upload_dir)
-        await self.aptly.republish(dist, repo_name, self.publish_name)
+            # republish together with other packages added meanwhile
+            await self.aptly.publisher.republish(dist, repo_name, self.publish_name)
@@ -10,6 +10,9 @@ from .emailer import send_mail
 from .configuration import Configuration
 from .queues import enqueue_notification
 
+# websocket clients subscribed to build node status updates
+node_subscribers = set()
+
 
 class Subject(Enum):
     """Provides the molior subject types"""
@@ -1,4 +1,6 @@
+import time
 import asyncio
+import heapq
 
 from datetime import datetime
 from aiofile import AIOFile, Writer
@@ -17,8 +19,235 @@ backend_queue = asyncio.Queue()
 # build log queues
 buildlogs = {}
 
-# buildtask queues
-buildtasks = {"amd64": asyncio.Queue(), "arm64": asyncio.Queue()}
+BUILD_SCHEDULING_POLICIES = ["fifo", "shortest_first", "longest_first"]
+# seconds after which a queued build is dequeued first, regardless of its priority
+BUILD_MAX_WAIT = 3600
+
+
+def get_build_priority(task, policies):
+    """
+    Returns the queue priority of a build task according to the
+    scheduling policy of its kind (ci or release build).
+
+    Builds without a duration estimate are treated as short builds.
+    """
+    policy = policies["ci"] if task.get("project_dist") == "unstable" else policies["release"]
+    duration = task.get("estimated_duration") or 0
+    if policy == "shortest_first":
+        return duration
+    if policy == "longest_first":
+        return -duration
+    return 0
+
+
+def get_project_weight(project, weights=None):
+    if weights is None:
+        weights = Configuration().build_scheduling.get("project_weights") or {}
+    weight = weights.get(project, 1)
+    return weight if weight > 0 else 1
+
+
+class BuildQueue:
+    """
+    Build task queue with weighted fair sharing of the build nodes
+    between projects.
+
+    The next task is taken from the project with the lowest number of
+    running builds relative to its weight, projects at their maximum of
+    running builds are skipped. Within a project, tasks are ordered by
+    the configured scheduling policies:
+
+    build_scheduling:
+        ci: shortest_first
+        release: longest_first
+        project_weights:
+            myproject: 2
+        project_max_running:
+            myproject: 4
+        max_wait: 3600
+
+    Tasks with the same priority are dequeued in fifo order. A task
+    queued for longer than max_wait seconds is dequeued before the
+    other tasks of its project, so long builds are not starved by
+    short builds.
+    """
+
+    # running and dispatched builds per project, shared by all queues
+    running = {}
+    dispatched = {}
+    instances = []
+
+    def __init__(self):
+        self._projects = {}  # project: heap of (priority, seq, queued, task)
+        self._seq = 0
+        self._size = 0
+        self._policies = None
+        self._weights = {}
+        self._max_running = {}
+        self._max_wait = BUILD_MAX_WAIT
+        self._changed = asyncio.Event()
+        BuildQueue.instances.append(self)
+
+    def _load_config(self):
+        cfg = Configuration().build_scheduling
+        self._policies = {}
+        for kind in ["ci", "release"]:
+            policy = cfg.get(kind, "fifo")
+            if policy not in BUILD_SCHEDULING_POLICIES:
+                logger.error("invalid build_scheduling policy for %s: '%s', using fifo", kind, policy)
+                policy = "fifo"
+            self._policies[kind] = policy
+        self._weights = cfg.get("project_weights") or {}
+        self._max_running = cfg.get("project_max_running") or {}
+        self._max_wait = cfg.get("max_wait", BUILD_MAX_WAIT)
+
+    def get_weight(self, project):
+        if self._policies is None:
+            self._load_config()
+        return get_project_weight(project, self._weights)
+
+    def _select_project(self):
+        selected = None
+        selected_key = None
+        for project, heap in self._projects.items():
+            running = BuildQueue.running.get(project, 0)
+            max_running = self._max_running.get(project)
+            if max_running and running >= max_running:
+                continue
+            weight = self.get_weight(project)
+            key = (running / weight, BuildQueue.dispatched.get(project, 0) / weight, heap[0][1])
+            if selected_key is None or key < selected_key:
+                selected = project
+                selected_key = key
+        if selected_key is None:
+            raise asyncio.QueueEmpty()
+        return selected
+
+    def qsize(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def queued(self):
+        """
+        Returns the number of queued tasks per project.
+        """
+        return {project: len(heap) for project, heap in self._projects.items()}
+
+    def remove(self, build_id):
+        """
+        Removes the queued task of the given build.
+
+        Returns:
+            bool: True if the task was queued.
+        """
+        for project, heap in self._projects.items():
+            for entry in heap:
+                if entry[3].get("build_id") == build_id:
+                    heap.remove(entry)
+                    heapq.heapify(heap)
+                    if not heap:
+                        del self._projects[project]
+                    self._size -= 1
+                    return True
+        return False
+
+    def put_nowait(self, task):
+        if self._policies is None:
+            self._load_config()
+        project = task.get("project")
+        # requeued tasks keep their position
+        if "queue_seq" not in task:
+            self._seq += 1
+            task["queue_seq"] = self._seq
+            task["queue_time"] = time.monotonic()
+        heapq.heappush(self._projects.setdefault(project, []),
+                       (get_build_priority(task, self._policies), task["queue_seq"], task["queue_time"], task))
+        self._size += 1
+        self._changed.set()
+
+    async def put(self, task):
+        self.put_nowait(task)
+
+    def get_nowait(self):
+        project = self._select_project()
+        heap = self._projects[project]
+        oldest = min(heap, key=lambda entry: entry[1])
+        if time.monotonic() - oldest[2] >= self._max_wait:
+            heap.remove(oldest)
+            heapq.heapify(heap)
+            task = oldest[3]
+        else:
+            task = heapq.heappop(heap)[3]
+        if not heap:
+            del self._projects[project]
+        self._size -= 1
+        BuildQueue.running[project] = BuildQueue.running.get(project, 0) + 1
+        BuildQueue.dispatched[project] = BuildQueue.dispatched.get(project, 0) + 1
+        return task
+
+    def requeue_nowait(self, task):
+        """
+        Puts a dequeued task back at its original position,
+        undoing its accounting as running and dispatched build.
+        """
+        project = task.get("project")
+        if BuildQueue.running.get(project, 0) > 0:
+            BuildQueue.running[project] -= 1
+        if BuildQueue.dispatched.get(project, 0) > 0:
+            BuildQueue.dispatched[project] -= 1
+        self.put_nowait(task)
+
+    async def get(self):
+        while True:
+            try:
+                return self.get_nowait()
+            except asyncio.QueueEmpty:
+                self._changed.clear()
+                await self._changed.wait()
+
+    def task_done(self):
+        pass
+
+
+def buildtask_done(project):
+    """
+    Marks a dequeued build task of the given project as finished,
+    so that the project's share of the build nodes is freed.
+    """
+    if BuildQueue.running.get(project, 0) > 0:
+        BuildQueue.running[project] -= 1
+    for queue in BuildQueue.instances:
+        queue._changed.set()
+
+
+def get_project_shares():
+    """
+    Returns the running, queued and dispatched builds per project
+    and the share of dispatched builds each project received.
+    """
+    queued = {}
+    for queue in buildtasks.values():
+        for project, count in queue.queued().items():
+            queued[project] = queued.get(project, 0) + count
+
+    total = sum(BuildQueue.dispatched.values())
+    shares = {}
+    for project in set(queued) | set(BuildQueue.running) | set(BuildQueue.dispatched):
+        dispatched = BuildQueue.dispatched.get(project, 0)
+        shares[str(project)] = {
+            "weight": get_project_weight(project),
+            "running": BuildQueue.running.get(project, 0),
+            "queued": queued.get(project, 0),
+            "dispatched": dispatched,
+            "share": dispatched / total if total else 0.0
+        }
+    return shares
+
+
+# buildtask queues per node class, created on demand
+buildtasks = {}
 
 
 async def enqueue(queue, item):
@@ -47,6 +276,74 @@ async def dequeue_aptly():
     return await dequeue(aptly_queue)
 
 
+class AptlyLane:
+    """
+    Queue of aptly worker tasks of one kind, processed by its own
+    workers, so that long running tasks of one lane do not delay
+    the tasks of other lanes.
+    """
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = max(int(concurrency), 1)
+        self.queue = asyncio.Queue()
+        self.running = 0
+        self.stats = {"done": 0, "failed": 0, "max_queued": 0, "wait_total": 0.0}
+
+    async def put(self, handler, args):
+        await self.queue.put((handler, args, time.monotonic()))
+        self.stats["max_queued"] = max(self.stats["max_queued"], self.queue.qsize())
+
+    async def worker(self):
+        while True:
+            handler, args, queued = await self.queue.get()
+            self.stats["wait_total"] += time.monotonic() - queued
+            self.running += 1
+            try:
+                await handler(args)
+            except Exception as exc:
+                logger.exception(exc)
+                self.stats["failed"] += 1
+            finally:
+                self.running -= 1
+                self.stats["done"] += 1
+                self.queue.task_done()
+
+    def start(self):
+        for _ in range(self.concurrency):
+            asyncio.ensure_future(self.worker())
+
+    def get_metrics(self):
+        metrics = dict(self.stats)
+        metrics["queued"] = self.queue.qsize()
+        metrics["running"] = self.running
+        metrics["concurrency"] = self.concurrency
+        done = self.stats["done"] + self.running
+        metrics["wait_avg"] = self.stats["wait_total"] / done if done else 0.0
+        return metrics
+
+
+APTLY_LANES = {"mirror": 2, "publish": 8, "cleanup": 1}
+aptly_lanes = {}  # name: AptlyLane
+
+
+def get_aptly_lane(name):
+    """
+    Returns the aptly lane with the given name, its concurrency
+    is configured in aptly.lanes.
+    """
+    lane = aptly_lanes.get(name)
+    if not lane:
+        cfg = Configuration().aptly.get("lanes") or {}
+        lane = AptlyLane(name, cfg.get(name, APTLY_LANES.get(name, 1)))
+        aptly_lanes[name] = lane
+    return lane
+
+
+def get_aptly_lane_metrics():
+    return {name: lane.get_metrics() for name, lane in aptly_lanes.items()}
+
+
 async def enqueue_notification(msg):
     await notification_queue.put(msg)
 
@@ -140,11 +437,23 @@ async def buildlogtitle(build_id, title, no_footer_newline=False, no_header_newl
     await buildlog(build_id, msg)
 
 
-async def enqueue_buildtask(arch, task):
-    if arch not in buildtasks:
-        return
-    await enqueue(buildtasks[arch], task)
+def get_buildtask_queue(node_class):
+    if node_class not in buildtasks:
+        buildtasks[node_class] = BuildQueue()
+    return buildtasks[node_class]
+
+
+async def enqueue_buildtask(node_class, task):
+    await enqueue(get_buildtask_queue(node_class), task)
+
+
+async def dequeue_buildtask(node_class):
+    return await get_buildtask_queue(node_class).get()
+
+
+def requeue_buildtask(node_class, task):
+    get_buildtask_queue(node_class).requeue_nowait(task)
 
 
-async def dequeue_buildtask(arch):
-    return await dequeue(buildtasks[arch])
+def remove_buildtask(build_id):
+    return any(queue.remove(build_id) for queue in buildtasks.values())
@@ -12,6 +12,7 @@ from ..app import app, logger
 from ..version import MOLIOR_VERSION
 from ..model.database import database
 from ..auth import Auth
+from ..aptly import close_aptly_connection
 from .configuration import Configuration
 
 from .worker import Worker
@@ -52,6 +53,10 @@ async def cleanup_task():
     await enqueue_aptly({"cleanup": []})
 
 
+async def ci_expiry_task():
+    await enqueue_aptly({"expire_ci_packages": []})
+
+
 async def main():
     worker = Worker()
     asyncio.ensure_future(worker.run())
@@ -72,6 +77,12 @@ async def main():
     cleanup_sched = Scheduler(locale="en_US")
     cleanup_job = CronJob(name='cleanup').every().day.at(daily_cleanup).go(cleanup_task)
     cleanup_sched.add_job(cleanup_job)
+
+    ci_expiry = cfg.ci_builds.get("packages_expiry")
+    if not ci_expiry:
+        ci_expiry = "03:00"
+    ci_expiry_job = CronJob(name='ci_expiry').every().day.at(ci_expiry).go(ci_expiry_task)
+    cleanup_sched.add_job(ci_expiry_job)
     asyncio.ensure_future(cleanup_sched.start())
 
 
@@ -124,6 +135,7 @@ def mainloop(host, port, debug, coverage):
     asyncio.ensure_future(main())
     app.set_context_functions(create_cirrina_context, destroy_cirrina_context)
     app.run(host, port, logger=logger, debug=debug)
+    loop.run_until_complete(close_aptly_connection())
     logger.info("terminated")
 
     if coverage:
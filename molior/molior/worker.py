@@ -5,7 +5,7 @@ from shutil import rmtree
 
 from ..app import logger
 from ..ops import GitClone, GitChangeUrl, get_latest_tag
-from ..ops import BuildProcess, BuildSourcePackage, ScheduleBuilds, CreateBuildEnv
+from ..ops import BuildProcess, BuildSourcePackage, ScheduleBuilds, CreateBuildEnv, RefreshBuildEnv
 from ..molior.configuration import Configuration
 from ..molior.queues import enqueue_task, dequeue_task, enqueue_aptly
 
@@ -84,6 +84,7 @@ class Worker:
 
     def __init__(self):
         self.chroot_build_count = 0
+        self.chroot_refreshes = set()
 
     async def _clone(self, args, session):
         logger.debug("worker: got clone task")
@@ -329,6 +330,44 @@ class Worker:
                              name, version, arch, components, repo_url, mirror_keys)
         self.chroot_build_count -= 1
 
+    async def _refresh_buildenv(self, args, session):
+        chroot_id = args[0]
+        if chroot_id in self.chroot_refreshes:
+            logger.info("worker: chroot %d is being refreshed already", chroot_id)
+            return
+
+        cfg = Configuration()
+        max_parallel_chroots = cfg.max_parallel_chroots
+        if max_parallel_chroots and type(max_parallel_chroots) is int and max_parallel_chroots > 0:
+            if self.chroot_build_count >= max_parallel_chroots:
+                await enqueue_task({"refresh_buildenv": args})
+                logger.info("worker: building %d chroots already, requeueing...", self.chroot_build_count)
+                await asyncio.sleep(2)
+                return
+
+        chroot = session.query(Chroot).filter(Chroot.id == chroot_id).first()
+        if not chroot:
+            logger.error("refresh: chroot %d not found", chroot_id)
+            return
+        if not chroot.ready:
+            logger.info("refresh: chroot %d is not ready", chroot_id)
+            return
+
+        self.chroot_build_count += 1
+        self.chroot_refreshes.add(chroot_id)
+        asyncio.ensure_future(self.refresh_build_env(chroot_id,
+                                                     chroot.basemirror.mirror_distribution,
+                                                     chroot.basemirror.project.name,
+                                                     chroot.basemirror.name,
+                                                     chroot.architecture))
+
+    async def refresh_build_env(self, chroot_id, dist, name, version, arch):
+        try:
+            await RefreshBuildEnv(dist, name, version, arch)
+        finally:
+            self.chroot_refreshes.discard(chroot_id)
+            self.chroot_build_count -= 1
+
     async def _merge_duplicate_repo(self, args, session):
         repository_id = args[0]
         duplicate_id = args[1]
@@ -509,6 +548,12 @@ class Worker:
                             handled = True
                             await self._buildenv(args)
 
+                    if not handled:
+                        args = task.get("refresh_buildenv")
+                        if args:
+                            handled = True
+                            await self._refresh_buildenv(args, session)
+
                     if not handled:
                         args = task.get("merge_duplicate_repo")
                         if args:
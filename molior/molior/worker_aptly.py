@@ -1,19 +1,23 @@
+import time
 import asyncio
 import operator
 
+from datetime import datetime, timedelta
 from os import mkdir
 from shutil import rmtree
 from sqlalchemy import func, or_
 from shutil import copy2
 
 from ..app import logger
-from ..tools import db2array, array2db
+from ..tools import db2array, array2db, get_local_tz
 from ..ops import DebSrcPublish, DebPublish, DeleteBuildEnv
 from ..aptly import get_aptly_connection
 from ..aptly.errors import AptlyError, NotFoundError
+from .core import get_release_hash
 from .debianrepository import DebianRepository
 from .notifier import Subject, Event, notify, send_mail_notification
 from ..molior.queues import enqueue_task, enqueue_aptly, dequeue_aptly, buildlog, buildlogtitle, buildlogdone
+from ..molior.queues import APTLY_LANES, get_aptly_lane
 from ..molior.configuration import Configuration
 
 from ..model.database import Session
@@ -24,6 +28,17 @@ from ..model.chroot import Chroot
 from ..model.mirrorkey import MirrorKey
 
 
+# Seconds between checks for mirrors due for a scheduled update
+MIRROR_SCHEDULER_INTERVAL = 60
+# mirror ids with an update check in progress
+mirror_checks = set()
+
+# Number of consecutive errors fetching the progress after which mirroring fails
+MIRROR_PROGRESS_ERRORS = 20
+# Minimum change of the mirror progress in percent to be notified
+MIRROR_PROGRESS_STEP = 1.0
+
+
 async def startup_migration():
     """
     Migrate old aptly repos
@@ -38,15 +53,12 @@ async def startup_migration():
         if not query.count():
             return
 
-        aptly_repos = await aptly.repo_get()
-        aptly_snapshots = await aptly.snapshot_get()
         projectversions = query.all()
         for projectversion in projectversions:
             repo_name = "%s-%s-%s-%s" % (projectversion.basemirror.project.name, projectversion.basemirror.name,
                                          projectversion.project.name, projectversion.name)
 
-            for aptly_snapshot in aptly_snapshots:
-                aptly_snapshot_name = aptly_snapshot.get("Name")
+            for aptly_snapshot_name in list(await aptly.objects.get("snapshots")):
                 publish_name = "{}_{}_repos_{}_{}".format(projectversion.basemirror.project.name,
                                                           projectversion.basemirror.name,
                                                           projectversion.project.name,
@@ -56,12 +68,7 @@ async def startup_migration():
                     if aptly_snapshot_name.startswith(snapshot_name):
                         await aptly.snapshot_rename(aptly_snapshot_name, "{}-{}".format(publish_name, dist))
 
-            found = False
-            for a in aptly_repos:
-                if a.get("Name") == repo_name:
-                    found = True
-                    break
-            if not found:
+            if not await aptly.objects.exists("repos", repo_name):
                 continue
             try:
                 task_id = await aptly.repo_rename(repo_name, repo_name + "-stable")
@@ -189,6 +196,137 @@ async def update_mirror(build_id, base_mirror, base_mirror_version, mirror, vers
                                      mirror, version, components, task_ids))
 
 
+async def schedule_mirror_updates():
+    """
+    Enqueues an update check for every mirror
+    whose update interval has passed.
+    """
+    while True:
+        await asyncio.sleep(MIRROR_SCHEDULER_INTERVAL)
+        try:
+            now = get_local_tz().localize(datetime.now(), is_dst=None)
+            due = []
+            with Session() as session:
+                mirrors = session.query(ProjectVersion).join(Project).filter(
+                        Project.is_mirror.is_(True),
+                        ProjectVersion.is_deleted.is_(False),
+                        ProjectVersion.external_repo.is_(False),
+                        ProjectVersion.mirror_state == "ready",
+                        ProjectVersion.mirror_update_interval > 0).all()
+                for mirror in mirrors:
+                    if mirror.id in mirror_checks:
+                        continue
+                    if mirror.mirror_last_check and \
+                       mirror.mirror_last_check + timedelta(minutes=mirror.mirror_update_interval) > now:
+                        continue
+                    due.append(mirror.id)
+
+            for mirror_id in due:
+                mirror_checks.add(mirror_id)
+                await enqueue_aptly({"check_mirror": [mirror_id]})
+        except Exception as exc:
+            logger.exception(exc)
+
+
+async def check_mirror(mirror_id):
+    """
+    Updates a ready mirror, if its upstream Release file changed
+    since the last check, and publishes the new snapshots.
+    """
+    with Session() as session:
+        mirror = session.query(ProjectVersion).filter(ProjectVersion.id == mirror_id).first()
+        if not mirror:
+            logger.error("mirror check: mirror with id %d not found", mirror_id)
+            return
+        mirror_name = mirror.fullname
+        mirror_url = mirror.mirror_url
+        mirror_distribution = mirror.mirror_distribution
+        components = mirror.mirror_components.split(",")
+        base_mirror = mirror.basemirror.project.name if mirror.basemirror else ""
+        base_mirror_version = mirror.basemirror.name if mirror.basemirror else ""
+        project_name = mirror.project.name
+        version = mirror.name
+        last_hash = mirror.mirror_release_hash
+        is_basemirror = mirror.project.is_basemirror
+
+    release_hash = await get_release_hash(mirror_url, mirror_distribution)
+
+    with Session() as session:
+        mirror = session.query(ProjectVersion).filter(ProjectVersion.id == mirror_id).first()
+        if mirror:
+            mirror.mirror_last_check = get_local_tz().localize(datetime.now(), is_dst=None)
+            session.commit()
+
+    if not release_hash:
+        logger.warning("mirror check: no Release file found for %s", mirror_name)
+        return
+    if release_hash == last_hash:
+        logger.info("mirror check: %s is up to date", mirror_name)
+        return
+
+    # do not race a manual mirror update started meanwhile
+    with Session() as session:
+        started = session.query(ProjectVersion).filter(
+                ProjectVersion.id == mirror_id,
+                ProjectVersion.mirror_state == "ready").update({"mirror_state": "updating"}, synchronize_session=False)
+        session.commit()
+    if not started:
+        logger.info("mirror check: %s is not ready, skipping update", mirror_name)
+        return
+
+    logger.info("mirror check: updating %s", mirror_name)
+    start = time.monotonic()
+    aptly = get_aptly_connection()
+    updated = False
+    try:
+        task_ids = await aptly.mirror_update(base_mirror, base_mirror_version, project_name, version, components)
+        results = await asyncio.gather(*[aptly.wait_task(task_id) for task_id in task_ids])
+        if not all(results):
+            logger.error("mirror check: error updating %s", mirror_name)
+        elif not await aptly.mirror_republish(base_mirror, base_mirror_version, project_name, version,
+                                              mirror_distribution, components):
+            logger.error("mirror check: error publishing %s", mirror_name)
+        else:
+            updated = True
+    except Exception as exc:
+        logger.exception(exc)
+
+    with Session() as session:
+        mirror = session.query(ProjectVersion).filter(ProjectVersion.id == mirror_id).first()
+        if mirror:
+            # the published snapshots are unchanged if the update failed, check again later
+            mirror.mirror_state = "ready"
+            if updated:
+                mirror.mirror_release_hash = release_hash
+            session.commit()
+        if not updated:
+            return
+        chroots = []
+        if is_basemirror:
+            chroots = session.query(Chroot).filter(Chroot.basemirror_id == mirror_id).all()
+            chroots = [chroot.id for chroot in chroots if chroot.ready]
+    logger.info("mirror check: updated %s in %.1fs", mirror_name, time.monotonic() - start)
+
+    # upgrade the build environments to the updated basemirror
+    for chroot_id in chroots:
+        await enqueue_task({"refresh_buildenv": [chroot_id]})
+
+
+async def notify_mirror_progress(build_id, mirror_id, percent, notified):
+    """
+    Notifies the mirror progress, if it changed by at least
+    MIRROR_PROGRESS_STEP percent since the last notification.
+
+    Returns:
+        float: the last notified progress
+    """
+    if notified is not None and abs(percent - notified) < MIRROR_PROGRESS_STEP:
+        return notified
+    await notify(Subject.build.value, Event.changed.value, {"id": build_id, "progress": percent})
+    await notify(Subject.mirror.value, Event.changed.value, {"id": mirror_id, "progress": percent})
+    return percent
+
+
 async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                           mirror_project, mirror_version, components, task_ids):
     try:
@@ -224,15 +362,24 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
             fields = ["TotalNumberOfPackages", "RemainingNumberOfPackages",
                       "TotalDownloadSize", "RemainingDownloadSize"]
 
+            errors = {task_id: 0 for task_id in task_ids}
+
+            async def update_progress(task_id):
+                try:
+                    progress[task_id].update(await aptly.mirror_get_progress(task_id))
+                    errors[task_id] = 0
+                except Exception as exc:
+                    errors[task_id] += 1
+                    logger.warning("error fetching mirror progress of task %d: %s", task_id, str(exc))
+                    if errors[task_id] >= MIRROR_PROGRESS_ERRORS:
+                        progress[task_id]["State"] = 3  # mark failed
+
+            notified = None
             if mirror.mirror_state == "updating":
                 while True:
-                    for task_id in task_ids:
-                        if progress[task_id]["State"] == 1:  # task is running
-                            upd_progress = await aptly.mirror_get_progress(task_id)
-                            if upd_progress:
-                                progress[task_id].update(upd_progress)
-                            else:
-                                progress[task_id]["State"] = 3  # mark failed
+                    # poll all running component tasks at once
+                    await asyncio.gather(*[update_progress(task_id) for task_id in task_ids
+                                           if progress[task_id]["State"] == 1])
 
                     # check if at least 1 is running
                     # 0: init, 1: running, 2: success, 3: failed
@@ -291,10 +438,7 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                                     total_progress["PercentSize"],
                                     )
 
-                        await notify(Subject.build.value, Event.changed.value,
-                                     {"id": build.id, "progress": total_progress["PercentSize"]})
-                        await notify(Subject.mirror.value, Event.changed.value,
-                                     {"id": mirror.id, "progress": total_progress["PercentSize"]})
+                        notified = await notify_mirror_progress(build.id, mirror.id, total_progress["PercentSize"], notified)
                     await asyncio.sleep(5)
 
                 await build.log("I: creating snapshot\n")
@@ -314,31 +458,18 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                     session.commit()
                     return
 
-                while True:
-                    running = False
-                    failed = False
-                    for task_id in task_ids:
-                        try:
-                            task_state = await aptly.get_task_state(task_id)
-                        except Exception:
-                            failed = True
-
-                        # 0: init, 1: running, 2: success, 3: failed
-                        if task_state["State"] == 1:
-                            running = True
-                        if task_state["State"] == 3:
-                            failed = True
-
-                    if not running and failed:
-                        logger.error("creating mirror %s snapshot failed", mirrorname)
-                        mirror.mirror_state = "error"
-                        await build.set_publish_failed()
-                        session.commit()
-                        return
-                    if not running and not failed:
-                        break
+                try:
+                    results = await asyncio.gather(*[aptly.wait_task(task_id) for task_id in task_ids])
+                except Exception as exc:
+                    logger.exception(exc)
+                    results = [False]
 
-                    await asyncio.sleep(2)
+                if not all(results):
+                    logger.error("creating mirror %s snapshot failed", mirrorname)
+                    mirror.mirror_state = "error"
+                    await build.set_publish_failed()
+                    session.commit()
+                    return
 
                 # FIXME: delete all tasksk
                 # await aptly.delete_task(task_id)
@@ -362,11 +493,19 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                     return
 
             if mirror.mirror_state == "publishing":
+                notified = None
+                errors = 0
                 while True:
                     upd_progress = None
                     try:
                         upd_progress = await aptly.mirror_get_progress(task_id)
+                        errors = 0
                     except Exception as exc:
+                        errors += 1
+                        if errors < MIRROR_PROGRESS_ERRORS:
+                            logger.warning("error fetching mirror publish progress of %s: %s", mirrorname, str(exc))
+                            await asyncio.sleep(5)
+                            continue
                         logger.error("error publishing mirror %s: %s", mirrorname, str(exc))
 
                         mirror.mirror_state = "error"
@@ -406,10 +545,7 @@ async def finalize_mirror(build_id, base_mirror, base_mirror_version,
                                 upd_progress["TotalNumberOfPackages"] - upd_progress["RemainingNumberOfPackages"],
                                 upd_progress["TotalNumberOfPackages"], upd_progress["PercentPackages"])
 
-                    await notify(Subject.build.value, Event.changed.value,
-                                 {"id": build.id, "progress": upd_progress["PercentPackages"]})
-                    await notify(Subject.mirror.value, Event.changed.value,
-                                 {"id": mirror.id, "progress": upd_progress["PercentPackages"]})
+                    notified = await notify_mirror_progress(build.id, mirror.id, upd_progress["PercentPackages"], notified)
                     await asyncio.sleep(5)
 
             if mirror.project.is_basemirror:
@@ -486,6 +622,9 @@ class AptlyWorker:
 
     """
 
+    def __init__(self):
+        self.lanes = {name: get_aptly_lane(name) for name in APTLY_LANES}
+
     async def _create_mirror(self, args):
         (
             mirror_name,
@@ -741,6 +880,13 @@ class AptlyWorker:
                 await build.logtitle("Done", no_footer_newline=True)
                 await build.logdone()
 
+    async def _check_mirror(self, args):
+        mirror_id = args[0]
+        try:
+            await check_mirror(mirror_id)
+        finally:
+            mirror_checks.discard(mirror_id)
+
     async def _src_publish(self, args):
         build_id = args[0]
 
@@ -798,6 +944,8 @@ class AptlyWorker:
 
             for child in childs:
                 found_childs = True
+                if child.buildstate == "nothing_done":  # superseded by a newer CI build
+                    continue
                 await child.set_needs_build()
                 session.commit()
 
@@ -878,7 +1026,9 @@ class AptlyWorker:
         dist = args[4]
 
         aptly = get_aptly_connection()
-        await aptly.publish_drop(base_mirror_name, base_mirror_version, projectname, projectversion, dist)
+        _, publish_name = aptly.get_aptly_names(base_mirror_name, base_mirror_version, projectname, projectversion)
+        async with aptly.repo_locks.exclusive(publish_name):
+            await aptly.publish_drop(base_mirror_name, base_mirror_version, projectname, projectversion, dist)
 
     async def _init_repository(self, args):
         basemirror_name = args[0]
@@ -1010,6 +1160,35 @@ class AptlyWorker:
         aptly = get_aptly_connection()
         await aptly.cleanup()
 
+    async def _expire_ci_packages(self, args):
+        logger.info("aptly worker: expiring CI packages")
+        start = time.monotonic()
+        repos = []
+        with Session() as session:
+            projectversions = session.query(ProjectVersion).join(Project).filter(
+                    Project.is_mirror.is_(False),
+                    ProjectVersion.is_deleted.is_(False),
+                    ProjectVersion.basemirror_id.isnot(None)).all()
+            for projectversion in projectversions:
+                repos.append((projectversion.basemirror.project.name, projectversion.basemirror.name,
+                              projectversion.project.name, projectversion.name,
+                              db2array(projectversion.mirror_architectures)))
+
+        removed = 0
+        republished = 0
+        for repo in repos:
+            try:
+                count = await DebianRepository(*repo).expire_ci_packages()
+            except Exception as exc:
+                logger.exception(exc)
+                continue
+            if count:
+                removed += count
+                republished += 1
+
+        logger.info("aptly worker: expired %d CI packages in %d repos (%d checked) in %.1fs",
+                    removed, republished, len(repos), time.monotonic() - start)
+
     async def _delete_mirror(self, args):
         mirror_id = args[0]
         aptly = get_aptly_connection()
@@ -1138,6 +1317,11 @@ class AptlyWorker:
             for deb in debpkgs:
                 for f in deb.debianpackages:
                     projectversion = deb.projectversion
+                    publish_name = "{}_{}_repos_{}_{}".format(projectversion.basemirror.project.name,
+                                                              projectversion.basemirror.name, projectversion.project.name,
+                                                              projectversion.name)
+                    if publish_name not in publish_names:
+                        publish_names.append(publish_name)
                     repo_name = "%s-%s-%s-%s-%s" % (projectversion.basemirror.project.name, projectversion.basemirror.name,
                                                     projectversion.project.name, projectversion.name, dist)
                     if repo_name not in to_delete:
@@ -1145,23 +1329,20 @@ class AptlyWorker:
                     to_delete[repo_name].append((f.name, deb.version, f.suffix))
 
         aptly = get_aptly_connection()
-        aptly_delete = {}
-        for repo_name in to_delete:
-            for package in to_delete[repo_name]:
-                # logger.error("delete %s %s" % (repo_name, pkgname))
-                pkgs = await aptly.repo_packages_get(repo_name, "%s (= %s) {%s}" % (package[0],   # package name
-                                                                                    package[1],   # version
-                                                                                    package[2]))  # arch
-                if repo_name not in aptly_delete:
-                    aptly_delete[repo_name] = []
-                aptly_delete[repo_name].extend(pkgs)
-
-        for repo_name in aptly_delete:
-            task_id = await aptly.repo_packages_delete(repo_name, aptly_delete[repo_name])
-            await aptly.wait_task(task_id)
-
-        for pv in projectversions:
-            await aptly.republish(dist, projectversions[pv][0], projectversions[pv][1])
+        # no other repository operations on the affected publish points meanwhile
+        async with aptly.repo_locks.exclusive(*publish_names):
+            aptly_delete = {}
+            for repo_name in to_delete:
+                # packages: (name, version, arch)
+                aptly_delete[repo_name] = await aptly.repo_packages_find(repo_name, to_delete[repo_name])
+
+            for repo_name in aptly_delete:
+                task_id = await aptly.repo_packages_delete(repo_name, aptly_delete[repo_name])
+                await aptly.wait_task(task_id)
+
+            # republish together with other packages added meanwhile, never concurrently
+            for pv in projectversions:
+                await aptly.publisher.republish(dist, projectversions[pv][0], projectversions[pv][1])
 
         for bid in build_ids:
             buildout = "/var/lib/molior/buildout/%d" % bid
@@ -1199,6 +1380,11 @@ class AptlyWorker:
 
         await startup_mirror()
         await startup_migration()
+        asyncio.ensure_future(schedule_mirror_updates())
+
+        # mirror operations, package publishing and cleanup do not block each other
+        for lane in self.lanes.values():
+            lane.start()
 
         while True:
             try:
@@ -1212,73 +1398,85 @@ class AptlyWorker:
                     args = task.get("src_publish")
                     if args:
                         handled = True
-                        await self._src_publish(args)
+                        await self.lanes["publish"].put(self._src_publish, args)
 
                 if not handled:
                     args = task.get("publish")
                     if args:
                         handled = True
-                        await self._publish(args)
+                        await self.lanes["publish"].put(self._publish, args)
 
                 if not handled:
                     args = task.get("create_mirror")
                     if args:
                         handled = True
-                        await self._create_mirror(args)
+                        await self.lanes["mirror"].put(self._create_mirror, args)
 
                 if not handled:
                     args = task.get("init_mirror")
                     if args:
                         handled = True
-                        await self._init_mirror(args)
+                        await self.lanes["mirror"].put(self._init_mirror, args)
 
                 if not handled:
                     args = task.get("update_mirror")
                     if args:
                         handled = True
-                        await self._update_mirror(args)
+                        await self.lanes["mirror"].put(self._update_mirror, args)
+
+                if not handled:
+                    args = task.get("check_mirror")
+                    if args:
+                        handled = True
+                        await self.lanes["mirror"].put(self._check_mirror, args)
 
                 if not handled:
                     args = task.get("drop_publish")
                     if args:
                         handled = True
-                        await self._drop_publish(args)
+                        await self.lanes["publish"].put(self._drop_publish, args)
 
                 if not handled:
                     args = task.get("init_repository")
                     if args:
                         handled = True
-                        await self._init_repository(args)
+                        await self.lanes["publish"].put(self._init_repository, args)
 
                 if not handled:
                     args = task.get("snapshot_repository")
                     if args:
                         handled = True
-                        await self._snapshot_repository(args)
+                        await self.lanes["publish"].put(self._snapshot_repository, args)
 
                 if not handled:
                     args = task.get("delete_repository")
                     if args:
                         handled = True
-                        await self._delete_repository(args)
+                        await self.lanes["publish"].put(self._delete_repository, args)
 
                 if not handled:
                     args = task.get("delete_mirror")
                     if args:
                         handled = True
-                        await self._delete_mirror(args)
+                        await self.lanes["mirror"].put(self._delete_mirror, args)
 
                 if not handled:
                     args = task.get("delete_build")
                     if args:
                         handled = True
-                        await self._delete_build(args)
+                        await self.lanes["publish"].put(self._delete_build, args)
+
+                if not handled:
+                    args = task.get("expire_ci_packages")
+                    if args is not None:
+                        handled = True
+                        await self.lanes["cleanup"].put(self._expire_ci_packages, args)
 
                 if not handled:
                     args = task.get("cleanup")
                     # FIXME: check args is []
                     handled = True
-                    await self._cleanup(args)
+                    await self.lanes["cleanup"].put(self._cleanup, args)
 
                 if not handled:
                     logger.error("aptly worker got unknown task %s", str(task))
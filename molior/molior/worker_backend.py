@@ -2,6 +2,7 @@ from ..app import logger
 from .backend import Backend
 from .notifier import send_mail_notification
 from ..molior.queues import enqueue_task, enqueue_aptly, dequeue_backend, enqueue_backend, buildlogdone
+from ..ops import SupersedeBuild
 
 from ..model.database import Session
 from ..model.build import Build
@@ -16,13 +17,34 @@ class BackendWorker:
 
     def __init__(self):
         self.logging_done = []
+        self.log_connections = {}  # build_id: open log connections
         self.build_outcome = {}  # build_id: outcome
+        self.cancelled = []
 
     async def _schedule(self, job):
         b = Backend()
         backend = b.get_backend()
         await backend.build(*job)
 
+    async def _cancel(self, job):
+        build_id, abort_running, superseded_by = job
+        b = Backend()
+        backend = b.get_backend()
+        result = await backend.cancel(build_id, abort_running)
+        if not result:
+            logger.info("build-%d: not cancelled, already sent to a build node", build_id)
+            return
+        if result == "aborted":
+            # build is aborted on the node, ignore the outcome
+            self.cancelled.append(build_id)
+        await SupersedeBuild(build_id, superseded_by, result == "dequeued")
+
+    async def _prefetch_chroot(self, job):
+        arch, chroot = job
+        b = Backend()
+        backend = b.get_backend()
+        await backend.prefetch_chroot(arch, chroot)
+
     async def _started(self, build_id):
         with Session() as session:
             build = session.query(Build).filter(Build.id == build_id).first()
@@ -43,7 +65,22 @@ class BackendWorker:
         if build_id in self.logging_done:
             await enqueue_backend({"terminate": build_id})
 
+    async def _logging_started(self, build_id):
+        self.log_connections[build_id] = self.log_connections.get(build_id, 0) + 1
+        if build_id in self.logging_done and build_id not in self.build_outcome:
+            # log connection was lost and reconnected, wait for the end of the log again
+            self.logging_done.remove(build_id)
+
     async def _logging_done(self,  build_id):
+        connections = self.log_connections.get(build_id, 1) - 1
+        if connections > 0:
+            # the node reconnected its log before the lost connection was closed
+            self.log_connections[build_id] = connections
+            return
+        self.log_connections.pop(build_id, None)
+        if build_id in self.logging_done:
+            # log connection of a resumed build closed again
+            return
         self.logging_done.append(build_id)
         if build_id in self.build_outcome:
             await enqueue_backend({"terminate": build_id})
@@ -59,6 +96,16 @@ class BackendWorker:
                 logger.error("build_failed: no build found for %d", build_id)
                 return
 
+            if build_id in self.cancelled:
+                self.cancelled.remove(build_id)
+                logger.info("build-%d: aborted", build_id)
+                await buildlogdone(build.id)
+                buildtask = session.query(BuildTask).filter(BuildTask.build == build).first()
+                if buildtask:
+                    session.delete(buildtask)
+                    session.commit()
+                return
+
             if outcome:  # build successful
                 await build.set_needs_publish()
                 await enqueue_aptly({"publish": [build_id]})
@@ -94,6 +141,14 @@ class BackendWorker:
                 if job:
                     handled = True
                     await self._schedule(job)
+                job = task.get("cancel")
+                if job:
+                    handled = True
+                    await self._cancel(job)
+                job = task.get("prefetch_chroot")
+                if job:
+                    handled = True
+                    await self._prefetch_chroot(job)
                 build_id = task.get("started")
                 if build_id:
                     handled = True
@@ -110,6 +165,10 @@ class BackendWorker:
                 if build_id:
                     handled = True
                     await self._terminate(build_id)
+                build_id = task.get("logging_started")
+                if build_id:
+                    handled = True
+                    await self._logging_started(build_id)
                 build_id = task.get("logging_done")
                 if build_id:
                     handled = True
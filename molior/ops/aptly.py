@@ -1,6 +1,7 @@
 import os
 import shlex
 import re
+import asyncio
 
 from launchy import Launchy
 from pathlib import Path
@@ -8,6 +9,7 @@ from aiofile import AIOFile
 
 from ..app import logger
 from ..tools import strip_epoch_version, db2array
+from ..aptly import get_aptly_connection
 from ..molior.debianrepository import DebianRepository
 from ..molior.configuration import Configuration
 from ..molior.queues import buildlog, buildlogtitle
@@ -19,6 +21,9 @@ from ..model.buildtask import BuildTask
 from ..model.projectversion import ProjectVersion
 from ..model.debianpackage import Debianpackage
 
+# Maximum number of projectversions a source package is published to concurrently
+MAX_PARALLEL_SRC_PUBLISH = 4
+
 
 async def debchanges_get_files(sourcepath, sourcename, version, arch="source"):
     v = strip_epoch_version(version)
@@ -75,33 +80,52 @@ async def DebSrcPublish(build_id, repo_id, sourcename, version, projectversions,
     build_logstate(build_id, buildtype, sourcename, version,
                    "publishing {} for projectversion ids {}".format(sourcename, str(projectversions)))
 
-    ret = False
-    for projectversion_id in projectversions:
-        fullname = None
-        with Session() as session:
-            projectversion = session.query(ProjectVersion) .filter(ProjectVersion.id == projectversion_id) .first()
-            if projectversion:
-                fullname = projectversion.fullname
-                basemirror_name = projectversion.basemirror.project.name
-                basemirror_version = projectversion.basemirror.name
-                project_name = projectversion.project.name
-                project_version = projectversion.name
-                archs = db2array(projectversion.mirror_architectures)
-
-        if not fullname:
-            logger.error("publisher: error finding projectversion {}".format(projectversion_id))
-            await buildlog(build_id, "E: error finding projectversion {}\n".format(projectversion_id))
-            continue
-
-        await buildlog(build_id, "I: publishing for %s\n" % fullname)
-
-        debian_repo = DebianRepository(basemirror_name, basemirror_version, project_name, project_version, archs)
-        try:
-            await debian_repo.add_packages(publish_files, ci_build=is_ci)
-            ret = True
-        except Exception as exc:
-            await buildlog(build_id, "E: error adding files to projectversion {}\n".format(projectversion.fullname))
-            logger.exception(exc)
+    repos = []
+    with Session() as session:
+        for projectversion_id in projectversions:
+            projectversion = session.query(ProjectVersion).filter(ProjectVersion.id == projectversion_id).first()
+            if not projectversion:
+                logger.error("publisher: error finding projectversion {}".format(projectversion_id))
+                await buildlog(build_id, "E: error finding projectversion {}\n".format(projectversion_id))
+                continue
+            repos.append((projectversion.fullname,
+                          (projectversion.basemirror.project.name, projectversion.basemirror.name,
+                           projectversion.project.name, projectversion.name,
+                           db2array(projectversion.mirror_architectures))))
+
+    if not repos:
+        return False
+
+    aptly = get_aptly_connection()
+    try:
+        # upload once for all projectversions
+        upload_dir = await aptly.files_upload(publish_files)
+    except Exception as exc:
+        await buildlog(build_id, "E: error uploading source package\n")
+        logger.exception(exc)
+        return False
+
+    publish_slots = asyncio.Semaphore(MAX_PARALLEL_SRC_PUBLISH)
+
+    async def publish(fullname, repo):
+        async with publish_slots:
+            await buildlog(build_id, "I: publishing for %s\n" % fullname)
+            debian_repo = DebianRepository(*repo)
+            try:
+                await debian_repo.add_packages(publish_files, ci_build=is_ci, upload_dir=upload_dir)
+                return True
+            except Exception as exc:
+                await buildlog(build_id, "E: error adding files to projectversion {}\n".format(fullname))
+                logger.exception(exc)
+        return False
+
+    results = await asyncio.gather(*[publish(fullname, repo) for fullname, repo in repos])
+    ret = any(results)
+
+    try:
+        await aptly.delete_directory(upload_dir)
+    except Exception as exc:
+        logger.exception(exc)
 
     await buildlog(build_id, "\n")
 
@@ -4,7 +4,17 @@ from ..app import logger
 from ..model.database import Session
 from ..model.build import Build
 from ..model.chroot import Chroot
-from ..molior.queues import enqueue_task
+from ..molior.core import get_chroot_artifact, get_chroot_version
+from ..molior.queues import enqueue_task, enqueue_backend
+
+
+async def prefetch_build_env(name, version, arch):
+    """
+    Lets the build nodes download the published chroot right away.
+    """
+    chroot = get_chroot_artifact(name, version, arch)
+    if chroot:
+        await enqueue_backend({"prefetch_chroot": [arch, chroot]})
 
 
 async def CreateBuildEnv(chroot_id, build_id, dist,
@@ -84,6 +94,8 @@ async def CreateBuildEnv(chroot_id, build_id, dist,
         chroot.ready = True
         session.commit()
 
+        await prefetch_build_env(name, version, arch)
+
         # Schedule builds
         args = {"schedule": []}
         await enqueue_task(args)
@@ -91,6 +103,41 @@ async def CreateBuildEnv(chroot_id, build_id, dist,
         return True
 
 
+async def RefreshBuildEnv(dist, name, version, arch):
+    """
+    Upgrades the packages of an existing sbuild chroot and
+    publishes it as a new version, if packages were upgraded.
+
+    Args:
+        dist (str): The distrelease
+        version (str): The version
+        arch (str): The architecture
+
+    Returns:
+        bool: True on success
+    """
+
+    logger.info("refreshing build environments for %s-%s-%s", dist, version, arch)
+    chroot_version = get_chroot_version(name, version, arch)
+
+    async def outh(line):
+        logger.debug("refresh %s-%s-%s: %s", name, version, arch, line)
+
+    process = Launchy(["sudo", "run-parts", "-a", "refresh", "-a", dist, "-a", name,
+                       "-a", version, "-a", arch,
+                       "/etc/molior/mirror-hooks.d"], outh, outh)
+    await process.launch()
+    ret = await process.wait()
+
+    if not ret == 0:
+        logger.error("error refreshing build env %s-%s-%s", name, version, arch)
+        return False
+
+    if get_chroot_version(name, version, arch) != chroot_version:
+        await prefetch_build_env(name, version, arch)
+    return True
+
+
 async def DeleteBuildEnv(dist, name, version, arch):
     """
     Delete sbuild chroot and other build environments.
@@ -20,7 +20,8 @@ from ..model.buildtask import BuildTask
 from ..model.maintainer import Maintainer
 from ..model.chroot import Chroot
 from ..model.projectversion import ProjectVersion
-from ..molior.core import get_target_arch, get_targets, get_buildorder, get_apt_repos, get_apt_keys
+from ..molior.core import get_target_arch, get_targets, get_buildorder, get_apt_repos, get_apt_keys, get_build_duration
+from ..molior.core import get_builddeps_hash, get_builddeps_key, get_chroot_version, get_chroot_artifact, get_apt_sources_state
 from ..molior.configuration import Configuration
 from ..molior.queues import enqueue_task, enqueue_aptly, enqueue_backend, buildlog, buildlogtitle, buildlogdone
 
@@ -317,6 +318,8 @@ async def BuildProcess(parent_build_id, repo_id, git_ref, ci_branch, custom_targ
             build.builddeps = "{" + ",".join(build_after) + "}"
             session.commit()
 
+        builddeps_hash = get_builddeps_hash(repo.src_path)
+
         projectversion_ids = []
         found = False
         for target in targets:
@@ -356,6 +359,7 @@ async def BuildProcess(parent_build_id, repo_id, git_ref, ci_branch, custom_targ
                 if deb_build:
                     if deb_build.buildstate != "successful":
                         deb_build.buildstate = "needs_build"
+                        deb_build.builddeps_hash = builddeps_hash
                         session.commit()
                         found = True
                         continue
@@ -382,7 +386,8 @@ async def BuildProcess(parent_build_id, repo_id, git_ref, ci_branch, custom_targ
                     sourcerepository=repo,
                     maintainer=maintainer,
                     projectversion_id=projectversion.id,
-                    architecture=architecture
+                    architecture=architecture,
+                    builddeps_hash=builddeps_hash
                 )
 
                 session.add(deb_build)
@@ -402,11 +407,102 @@ async def BuildProcess(parent_build_id, repo_id, git_ref, ci_branch, custom_targ
         build.projectversions = array2db([str(p) for p in projectversion_ids])
         session.commit()
 
+        if is_ci and ci_branch:
+            await supersede_ci_builds(build, session)
+
         build_id = build.id
 
     await enqueue_task({"src_build": [build_id]})
 
 
+async def finish_superseded(src_build, superseded_by):
+    """
+    Finishes the build chain of the given source build,
+    if all its deb builds were superseded.
+    """
+    if any(child.buildstate != "nothing_done" for child in src_build.children):
+        return
+    top_build = src_build.parent
+    if top_build and top_build.buildstate not in ("build_failed", "successful", "nothing_done"):
+        await top_build.log("I: superseded by build %d\n" % superseded_by)
+        await top_build.logtitle("Done", no_footer_newline=True, no_header_newline=False)
+        await top_build.logdone()
+        await top_build.set_nothing_done()
+
+
+async def supersede_ci_builds(build, session):
+    """
+    Cancels deb builds of older CI builds for the same source repository
+    and branch, which did not start building yet. If configured in
+    ci_builds.abort_running, running builds are aborted on the build node.
+
+    Scheduled builds may have been sent to a build node already, so the
+    backend cancels them, and only supersedes them if it removed them
+    from the build queue or aborted them.
+
+    Args:
+        build (molior.model.build.Build): The new source build.
+    """
+    ci_cfg = Configuration().ci_builds
+    if not ci_cfg.get("supersede", True):
+        return
+
+    states = ["new", "needs_build", "scheduled"]
+    abort_running = ci_cfg.get("abort_running", False)
+    if abort_running:
+        states.append("building")
+
+    old_builds = session.query(Build).filter(Build.buildtype == "deb",
+                                             Build.is_ci.is_(True),
+                                             Build.sourcerepository_id == build.sourcerepository_id,
+                                             Build.ci_branch == build.ci_branch,
+                                             Build.id < build.id,
+                                             Build.buildstate.in_(states)).all()
+    if not old_builds:
+        return
+
+    src_builds = {}
+    for old_build in old_builds:
+        if old_build.buildstate in ("scheduled", "building"):
+            await enqueue_backend({"cancel": [old_build.id, abort_running, build.parent_id]})
+            continue
+        logger.info("build-%d: superseded by build %d", old_build.id, build.parent_id)
+        await old_build.set_nothing_done()
+        src_builds[old_build.parent_id] = old_build.parent
+    session.commit()
+
+    # finish the old build chains if all their deb builds were superseded
+    for src_build in src_builds.values():
+        await finish_superseded(src_build, build.parent_id)
+    session.commit()
+
+
+async def SupersedeBuild(build_id, superseded_by, dequeued):
+    """
+    Supersedes a deb build, which the backend cancelled.
+
+    Args:
+        build_id (int): The cancelled deb build.
+        superseded_by (int): The new source build.
+        dequeued (bool): True if the build was removed from the build
+            queue, False if it was aborted on the build node.
+    """
+    with Session() as session:
+        build = session.query(Build).filter(Build.id == build_id).first()
+        if not build:
+            logger.error("supersede: build %d not found", build_id)
+            return
+        logger.info("build-%d: superseded by build %d", build_id, superseded_by)
+        # aborted builds keep their buildtask until the node reports the outcome
+        if dequeued and build.buildtask:
+            session.delete(build.buildtask)
+        await build.set_nothing_done()
+        session.commit()
+
+        await finish_superseded(build.parent, superseded_by)
+        session.commit()
+
+
 async def BuildSourcePackage(build_id):
     with Session() as session:
         build = session.query(Build).filter(Build.id == build_id).first()
@@ -544,6 +640,15 @@ async def schedule_build(build, session):
     if build.is_ci:
         run_lintian = False
 
+    estimated_duration = get_build_duration(build.sourcename, arch, build.projectversion_id, session)
+
+    # nodes cache the installed build dependencies by this key
+    chroot_version = get_chroot_version(distrelease_name, distrelease_version, arch)
+    apt_state = await get_apt_sources_state(apt_urls)
+    builddeps_key = get_builddeps_key(build.builddeps_hash, chroot_version, arch, apt_urls, apt_state)
+    # nodes fetch the chroot by content hash, unless cached already
+    chroot = get_chroot_artifact(distrelease_name, distrelease_version, arch)
+
     await build.set_scheduled()
     session.commit()
 
@@ -564,7 +669,10 @@ async def schedule_build(build, session):
                 project_version.name,
                 apt_urls,
                 apt_keys,
-                run_lintian
+                run_lintian,
+                estimated_duration,
+                builddeps_key,
+                chroot
             ]
         }
     )
@@ -2,7 +2,7 @@
 
 usage()
 {
-  echo "Usage: $0 build|publish|remove <distrelease> <name> <version> <architecture> components <mirror url> keys" 1>&2
+  echo "Usage: $0 build|publish|refresh|remove <distrelease> <name> <version> <architecture> components <mirror url> keys" 1>&2
   echo "       $0 info" 1>&2
   exit 1
 }
@@ -27,6 +27,10 @@ KEYS="$8"  # separated by space
 CHROOT_D=/var/lib/schroot/chroots/chroot.d
 CHROOT_NAME="${DIST_NAME}-$DIST_VERSION-${ARCH}"
 target="/var/lib/schroot/chroots/${CHROOT_NAME}"
+# Number of chroot tarball versions to keep
+CHROOT_KEEP=${CHROOT_KEEP:-3}
+# Chroot tarballs and deltas by content hash, fetched by the build nodes
+BY_HASH=/var/lib/schroot/chroots/by-hash
 
 set -e
 
@@ -145,19 +149,136 @@ EOM
   echo I: schroot $target created
 }
 
-publish_chroot()
+# Switches $target.tar.xz to the given tarball version and
+# removes old versions. Downloads of the previous version
+# are not interrupted by the switch.
+activate_chroot()
 {
-  rm -f $target.tar.xz
+  tarball=$1
+
+  ln -sfn `basename $tarball` $target.tar.xz.new
+  mv -T $target.tar.xz.new $target.tar.xz
+
+  for old in `ls -1t ${target}_*.tar.xz 2>/dev/null | tail -n +$((CHROOT_KEEP + 1))`
+  do
+    rm -f $old $old.sha256 $old.base
+  done
 
-  echo I: Creating schroot tar
-  cd $target
-  XZ_OPT="--threads=`nproc --ignore=1`" tar -cJf ../$CHROOT_NAME.tar.xz .
+  prune_by_hash
+  echo I: Activated `basename $tarball`
+}
+
+# Removes tarballs not linked to a chroot version anymore, and the deltas to them
+prune_by_hash()
+{
+  if [ ! -d $BY_HASH ]; then
+    return
+  fi
+  find $BY_HASH -name '*.tar.xz' ! -name '*.delta.tar.xz' -links 1 -delete
+  for delta in `find $BY_HASH -name '*.delta.tar.xz'`
+  do
+    hash=`basename $delta .delta.tar.xz | cut -d_ -f2`
+    if [ ! -e $BY_HASH/$hash.tar.xz ]; then
+      rm -f $delta $delta.sha256
+    fi
+  done
+}
+
+# Creates a new tarball version of the schroot directory $1.
+# If a delta tarball $2 to the version with hash $3 is given,
+# it is published along with the new version.
+pack_chroot()
+{
+  dir=$1
+  delta=$2
+  base=$3
+  tarball=${target}_`date +%Y%m%d%H%M%S`.tar.xz
+
+  echo I: Creating schroot tar `basename $tarball`
+  cd $dir
+  XZ_OPT="--threads=`nproc --ignore=1`" tar -cJf $tarball.tmp .
   cd - > /dev/null
+  mv $tarball.tmp $tarball
+
+  hash=`sha256sum $tarball | cut -d' ' -f1`
+  echo $hash > $tarball.sha256
+  mkdir -p $BY_HASH
+  ln -f $tarball $BY_HASH/$hash.tar.xz
+  if [ -n "$delta" ]; then
+    sha256sum $delta | cut -d' ' -f1 > $BY_HASH/${base}_$hash.delta.tar.xz.sha256
+    mv $delta $BY_HASH/${base}_$hash.delta.tar.xz
+    echo $base > $tarball.base
+    echo I: Created delta from $base
+  fi
+
+  activate_chroot $tarball
+}
+
+publish_chroot()
+{
+  pack_chroot $target
   rm -rf $target
 
   echo I: schroot $target is ready
 }
 
+refresh_chroot()
+{
+  if [ ! -e $target.tar.xz ]; then
+    echo I: schroot $CHROOT_NAME does not exist, nothing to refresh
+    return
+  fi
+
+  workdir=$target.refresh
+  rm -rf $workdir
+  mkdir -p $workdir
+
+  echo I: Refreshing schroot $CHROOT_NAME
+  cd $workdir
+  XZ_OPT="--threads=`nproc --ignore=1`" tar -xJf $target.tar.xz
+  cd - > /dev/null
+
+  export DEBIAN_FRONTEND=noninteractive
+  chroot $workdir apt-get update
+  upgrades=`chroot $workdir apt-get -s dist-upgrade | grep -c ^Inst || true`
+  if [ "$upgrades" -eq 0 ]; then
+    echo I: schroot $CHROOT_NAME is up to date
+    rm -rf $workdir
+    return
+  fi
+
+  base=""
+  current=`readlink -f $target.tar.xz`
+  if [ -f $current.sha256 ]; then
+    base=`cat $current.sha256`
+  fi
+  (cd $workdir && find . | sort) > $workdir.before
+  sleep 1
+  touch $workdir.stamp
+
+  echo I: Upgrading $upgrades packages
+  chroot $workdir apt-get -y dist-upgrade
+  chroot $workdir apt-get clean
+  rm -f $workdir/var/lib/apt/lists/*Packages* $workdir/var/lib/apt/lists/*Release*
+
+  delta=""
+  if [ -n "$base" ]; then
+    # changed files and the list of removed files, applied by the nodes
+    # on top of the previous version
+    echo I: Creating delta tar
+    delta=$workdir.delta.tar.xz
+    (cd $workdir && find . | sort) > $workdir.after
+    comm -23 $workdir.before $workdir.after > $workdir/.molior-removed
+    (cd $workdir && find . -cnewer $workdir.stamp -print0 | tar --null --no-recursion -cJf $delta -T -)
+    rm -f $workdir/.molior-removed
+  fi
+
+  pack_chroot $workdir $delta $base
+  rm -rf $workdir $workdir.before $workdir.after $workdir.stamp
+
+  echo I: schroot $target is refreshed
+}
+
 case "$ACTION" in
   info)
     echo "schroot build environment"
@@ -168,9 +289,13 @@ case "$ACTION" in
   publish)
     publish_chroot
     ;;
+  refresh)
+    refresh_chroot
+    ;;
   remove)
     rm -f $CHROOT_D/sbuild-$CHROOT_NAME
-    rm -rf $target $target.tar.xz
+    rm -rf $target $target.tar.xz $target.refresh ${target}_*.tar.xz*
+    prune_by_hash
     ;;
   *)
     echo "Unknown action $ACTION"
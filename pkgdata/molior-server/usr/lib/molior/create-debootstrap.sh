@@ -143,6 +143,9 @@ case "$ACTION" in
   publish)
     publish_debootstrap
     ;;
+  refresh)
+    # debootstrap rootfs are not upgraded
+    ;;
   remove)
     rm -rf $DEBOOTSTRAP $DEBOOTSTRAP.tar.xz
     ;;
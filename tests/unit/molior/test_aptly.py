@@ -1,6 +1,11 @@
 """
 Provides test molior core class.
 """
+import asyncio
+import os
+
+from mock import patch, MagicMock, AsyncMock
+
 from molior.aptly import AptlyApi
 
 
@@ -76,3 +81,255 @@ def test_get_aptly_names_basemirror():
 
     assert name == "jessie-8.10"
     assert publish_name == "jessie_8.10"
+
+
+def mock_aptly_session():
+    response = MagicMock()
+    response.status = 200
+    response.text = AsyncMock(return_value='{"ID": 42}')
+    http = MagicMock()
+    http.closed = False
+    http.post.return_value.__aenter__ = AsyncMock(return_value=response)
+    http.post.return_value.__aexit__ = AsyncMock(return_value=False)
+    session = MagicMock(return_value=http)
+    return session, http
+
+
+def test_repo_add_upload(tmp_path):
+    """
+    Test repo add uploads all files over one session
+    """
+    debs = []
+    for i in range(6):
+        deb = tmp_path / "foo{}_1.0_amd64.deb".format(i)
+        deb.write_bytes(b"debian package")
+        debs.append(str(deb))
+
+    api = AptlyApi("http://foo.bar/api", "a@b.c", upload_concurrency=2)
+    session, http = mock_aptly_session()
+    with patch("molior.aptly.api.aiohttp.ClientSession", session):
+        loop = asyncio.get_event_loop()
+        task_id, directory = loop.run_until_complete(api.repo_add("foo-repo", debs))
+
+    assert task_id == 42
+    assert session.call_count == 1
+    assert http.post.call_count == 7
+    assert http.post.call_args_list[-1][0][0] == "http://foo.bar/api/repos/foo-repo/file/" + directory
+
+
+def test_repo_add_local_upload_dir(tmp_path):
+    """
+    Test repo add links files into a local aptly upload dir
+    """
+    upload_dir = tmp_path / "upload"
+    upload_dir.mkdir()
+    deb = tmp_path / "foo_1.0_amd64.deb"
+    deb.write_bytes(b"debian package")
+
+    api = AptlyApi("http://foo.bar/api", "a@b.c", upload_dir=str(upload_dir))
+    session, http = mock_aptly_session()
+    with patch("molior.aptly.api.aiohttp.ClientSession", session):
+        loop = asyncio.get_event_loop()
+        task_id, directory = loop.run_until_complete(api.repo_add("foo-repo", [str(deb)]))
+
+    assert task_id == 42
+    linked = upload_dir / directory / deb.name
+    assert linked.read_bytes() == b"debian package"
+    assert os.stat(str(linked)).st_ino == os.stat(str(deb)).st_ino
+    # only the repo add request, no file upload
+    assert http.post.call_count == 1
+
+
+def test_shared_session():
+    """
+    Test the aptly api reuses its http session until closed
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    session, http = mock_aptly_session()
+    http.close = AsyncMock()
+
+    async def requests():
+        async with api.http() as http1:
+            pass
+        async with api.http() as http2:
+            pass
+        assert http1 is http2
+        await api.close()
+
+    with patch("molior.aptly.api.aiohttp.ClientSession", session):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(requests())
+
+    assert session.call_count == 1
+    http.close.assert_called_once()
+    assert api.session is None
+
+
+def test_wait_task():
+    """
+    Test waiting for aptly tasks polls all tasks at once
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    api.tasks.intervals = (0.01,)
+    polls = [
+        [{"ID": 1, "State": 1}, {"ID": 2, "State": 1}],
+        [{"ID": 1, "State": 2}, {"ID": 2, "State": 3}],
+    ]
+    api.get_tasks = AsyncMock(side_effect=polls)
+    api.delete_task = AsyncMock()
+
+    async def wait():
+        return await asyncio.gather(api.wait_task(1), api.wait_task(2))
+
+    loop = asyncio.get_event_loop()
+    res = loop.run_until_complete(wait())
+
+    assert res == [True, False]
+    assert api.get_tasks.call_count == 2
+    assert api.delete_task.call_count == 2
+    assert api.tasks.get_metrics()["failed"] == 1
+
+
+def test_wait_task_errors():
+    """
+    Test waiting for aptly tasks retries failed task queries
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    api.tasks.intervals = (0.01,)
+    api.tasks.error_intervals = (0.01, 0.01)
+    api.get_tasks = AsyncMock(side_effect=[Exception("timeout"), Exception("timeout"), [{"ID": 1, "State": 2}]])
+    api.delete_task = AsyncMock()
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(api.wait_task(1)) is True
+    assert api.tasks.get_metrics()["errors"] == 2
+
+    # give up after all retries failed
+    api.get_tasks = AsyncMock(side_effect=Exception("down"))
+    assert loop.run_until_complete(api.wait_task(2)) is False
+    assert api.get_tasks.call_count == 3
+
+
+def test_publish_coalescing():
+    """
+    Test concurrent republishes of a publish point are coalesced
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c", publish_window=0.05)
+    api.republish = AsyncMock()
+
+    async def publish():
+        await asyncio.gather(*[api.publisher.republish("stable", "repo", "publish") for _ in range(5)])
+        await api.publisher.republish("stable", "repo", "publish")
+        await api.publisher.republish("unstable", "repo", "publish")
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(publish())
+
+    assert api.republish.call_count == 3
+    assert api.publisher.get_metrics() == {"requests": 7, "republishes": 3, "pending": 0}
+
+
+def test_repo_locks():
+    """
+    Test exclusive repository operations wait for shared ones and vice versa
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    events = []
+
+    async def shared(name, tag, delay):
+        async with api.repo_locks.shared(name):
+            events.append(tag + "+")
+            await asyncio.sleep(delay)
+            events.append(tag + "-")
+
+    async def exclusive(tag, *names):
+        async with api.repo_locks.exclusive(*names):
+            events.append(tag + "+")
+            await asyncio.sleep(0.01)
+            events.append(tag + "-")
+
+    async def run():
+        add1 = asyncio.ensure_future(shared("repo1", "add1", 0.02))
+        other = asyncio.ensure_future(shared("repo2", "other", 0.01))
+        await asyncio.sleep(0)
+        delete = asyncio.ensure_future(exclusive("delete", "repo1"))
+        await asyncio.sleep(0)
+        # waits for the delete, which was requested before
+        add2 = asyncio.ensure_future(shared("repo1", "add2", 0.01))
+        await asyncio.gather(add1, other, delete, add2)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run())
+
+    assert events.index("add1-") < events.index("delete+")
+    assert events.index("other+") < events.index("delete+")
+    assert events.index("delete-") < events.index("add2+")
+    assert api.repo_locks.get_metrics() == {"shared": 3, "exclusive": 1, "locked": 0, "waiting": 0}
+
+
+def test_repo_packages_find():
+    """
+    Test package lookups are batched into OR-queries
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    api.MAX_QUERY_LENGTH = 100
+    api.repo_packages_get = AsyncMock(side_effect=lambda repo, q: ["P" + q[1:5]])
+    packages = [("pkg%d" % i, "1.0", "amd64") for i in range(10)]
+
+    loop = asyncio.get_event_loop()
+    refs = loop.run_until_complete(api.repo_packages_find("repo", packages))
+
+    queries = [call[0][1] for call in api.repo_packages_get.call_args_list]
+    assert len(queries) == 3
+    assert all(len(q) <= 100 for q in queries)
+    assert queries[2] == "(pkg8 (= 1.0) {amd64}) | (pkg9 (= 1.0) {amd64})"
+    assert " | ".join(queries).count("{amd64}") == 10
+    assert refs == ["Ppkg0", "Ppkg4", "Ppkg8"]
+
+
+def test_object_cache():
+    """
+    Test aptly objects are cached and updated on changes
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    api.repo_get = AsyncMock(return_value=[{"Name": "repo1"}, {"Name": "repo2"}])
+
+    async def check():
+        assert await api.objects.exists("repos", "repo1")
+        assert not await api.objects.exists("repos", "repo3")
+        api.objects.add("repos", "repo3")
+        api.objects.rename("repos", "repo1", "repo1-stable")
+        api.objects.remove("repos", "repo2")
+        return sorted(await api.objects.get("repos"))
+
+    loop = asyncio.get_event_loop()
+    assert loop.run_until_complete(check()) == ["repo1-stable", "repo3"]
+    assert api.repo_get.call_count == 1
+
+    api.objects.invalidate()
+    assert loop.run_until_complete(api.objects.exists("repos", "repo2"))
+    assert api.repo_get.call_count == 2
+
+
+def test_mirror_get_progress():
+    """
+    Test mirror progress of several tasks shares one task state query
+    """
+    api = AptlyApi("http://foo.bar/api", "a@b.c")
+    api.get_tasks = AsyncMock(return_value=[{"ID": 1, "State": 1}, {"ID": 2, "State": 2}])
+    session, http = mock_aptly_session()
+    response = http.post.return_value.__aenter__.return_value
+    response.text = AsyncMock(return_value='{"TotalNumberOfPackages": 10, "RemainingNumberOfPackages": 5}')
+    http.get.return_value = http.post.return_value
+
+    async def progress():
+        return await asyncio.gather(api.mirror_get_progress(1), api.mirror_get_progress(2))
+
+    with patch("molior.aptly.api.aiohttp.ClientSession", session):
+        loop = asyncio.get_event_loop()
+        res = loop.run_until_complete(progress())
+
+    assert api.get_tasks.call_count == 1
+    assert res[0]["State"] == 1
+    assert res[1]["State"] == 2
+    assert res[0]["RemainingNumberOfPackages"] == 5
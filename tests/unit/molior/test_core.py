@@ -6,6 +6,7 @@ from mock import patch, MagicMock
 
 from molior.molior.core import get_projectversion, get_target_config
 from molior.molior.core import get_maintainer, get_target_arch
+from molior.molior.core import get_builddeps_hash, get_builddeps_key, get_chroot_artifact, get_apt_sources_state
 from molior.tools import is_name_valid, validate_version_format
 
 
@@ -188,6 +189,75 @@ def test_get_target_arch():
     assert ret == "i386"
 
 
+def test_get_builddeps_hash(tmp_path):
+    """
+    Test the build dependency hash ignores formatting and other fields
+    """
+    def builddeps_hash(control):
+        (tmp_path / "debian").mkdir(exist_ok=True)
+        (tmp_path / "debian" / "control").write_text(control)
+        return get_builddeps_hash(tmp_path)
+
+    reference = builddeps_hash("Source: foo\nBuild-Depends: debhelper (>= 11), qtbase5-dev\n\n"
+                               "Package: foo\nDepends: libc6\n")
+    assert reference == builddeps_hash("Source: foo\nMaintainer: Foo <foo@example.com>\n"
+                                       "Build-Depends: qtbase5-dev,\n  debhelper  (>= 11),\n\n"
+                                       "Package: foo\nDepends: libc6, bar\n")
+    assert reference != builddeps_hash("Source: foo\nBuild-Depends: debhelper (>= 12), qtbase5-dev\n")
+    assert reference != builddeps_hash("Source: foo\nBuild-Depends: debhelper (>= 11), qtbase5-dev\n"
+                                       "Build-Depends-Indep: doxygen\n")
+
+
+def test_get_builddeps_key():
+    """
+    Test the build dependency cache key depends on the chroot version and the apt sources state
+    """
+    apt_urls = ["deb http://a 10 main"]
+    key = get_builddeps_key("abc", "debian-10-amd64_20210101000000.tar.xz", "amd64", apt_urls, "s1")
+    assert key == get_builddeps_key("abc", "debian-10-amd64_20210101000000.tar.xz", "amd64", apt_urls, "s1")
+    assert key != get_builddeps_key("abc", "debian-10-amd64_20210201000000.tar.xz", "amd64", apt_urls, "s1")
+    assert key != get_builddeps_key("abc", "debian-10-amd64_20210101000000.tar.xz", "amd64", apt_urls, "s2")
+    assert get_builddeps_key(None, "", "amd64", [], "s1") is None
+    assert get_builddeps_key("abc", "", "amd64", apt_urls, None) is None
+
+
+def test_get_apt_sources_state():
+    """
+    Test the apt sources state changes with the published Release files
+    """
+    release_hashes = {("http://a", "stable"): "1", ("http://b", "buster"): "2"}
+
+    async def get_release_hash(url, dist):
+        return release_hashes.get((url, dist))
+
+    apt_urls = ["deb http://a stable main", "deb http://b buster main contrib"]
+    loop = asyncio.get_event_loop()
+    with patch("molior.molior.core.get_release_hash", side_effect=get_release_hash):
+        state = loop.run_until_complete(get_apt_sources_state(apt_urls))
+        assert state == loop.run_until_complete(get_apt_sources_state(list(reversed(apt_urls))))
+
+        release_hashes[("http://a", "stable")] = "3"
+        assert state != loop.run_until_complete(get_apt_sources_state(apt_urls))
+
+        del release_hashes[("http://b", "buster")]
+        assert loop.run_until_complete(get_apt_sources_state(apt_urls)) is None
+
+
+def test_get_chroot_artifact(tmp_path):
+    """
+    Test the content hash of the active chroot version is found
+    """
+    tarball = tmp_path / "debian-10-amd64_20210201000000.tar.xz"
+    tarball.write_text("")
+    (tmp_path / "debian-10-amd64_20210201000000.tar.xz.sha256").write_text("def\n")
+    (tmp_path / "debian-10-amd64_20210201000000.tar.xz.base").write_text("abc\n")
+    (tmp_path / "debian-10-amd64.tar.xz").symlink_to(tarball.name)
+
+    with patch("molior.molior.core.CHROOT_DIR", str(tmp_path)):
+        assert get_chroot_artifact("debian", "10", "amd64") == {"name": "debian-10-amd64", "hash": "def", "base": "abc"}
+        assert get_chroot_artifact("debian", "10", "arm64") is None
+
+
 @pytest.mark.parametrize(
     "test_input,expected",
     [
@@ -0,0 +1,74 @@
+"""
+Provides tests of the deb build scheduling.
+"""
+import asyncio
+
+from mock import patch, MagicMock, AsyncMock
+
+from molior.ops import deb_build
+
+
+def test_schedule_build_chroot_arch():
+    """
+    Test builds are scheduled with the chroot of their architecture
+    """
+    build = MagicMock()
+    build.id = 1
+    build.architecture = "arm64"
+    build.is_ci = False
+    build.builddeps_hash = "abc"
+    build.projectversion.basemirror.project.name = "debian"
+    build.projectversion.basemirror.name = "10"
+    build.set_scheduled = AsyncMock()
+    chroot = {"name": "debian-10-arm64", "hash": "123", "base": None}
+    enqueue_backend = AsyncMock()
+
+    with patch.object(deb_build, "chroot_ready", return_value=True), \
+            patch.object(deb_build, "BuildTask"), \
+            patch.object(deb_build, "Configuration"), \
+            patch.object(deb_build, "get_apt_repos", return_value=["deb http://apt/debian/10 stable main"]), \
+            patch.object(deb_build, "get_apt_keys", return_value=[]), \
+            patch.object(deb_build, "get_target_arch", return_value="amd64"), \
+            patch.object(deb_build, "get_build_duration", return_value=None), \
+            patch.object(deb_build, "get_apt_sources_state", AsyncMock(return_value="s1")), \
+            patch.object(deb_build, "get_chroot_version", return_value="debian-10-arm64_1.tar.xz") as get_chroot_version, \
+            patch.object(deb_build, "get_chroot_artifact", return_value=chroot) as get_chroot_artifact, \
+            patch.object(deb_build, "enqueue_backend", enqueue_backend):
+        loop = asyncio.get_event_loop()
+        assert loop.run_until_complete(deb_build.schedule_build(build, MagicMock()))
+
+    get_chroot_version.assert_called_once_with("debian", "10", "arm64")
+    get_chroot_artifact.assert_called_once_with("debian", "10", "arm64")
+    args = enqueue_backend.call_args[0][0]["schedule"]
+    assert args[4] == "arm64"
+    assert args[5] is True
+    assert args[16] == deb_build.get_builddeps_key("abc", "debian-10-arm64_1.tar.xz", "arm64",
+                                                   ["deb http://apt/debian/10 stable main"], "s1")
+    assert args[17] == chroot
+
+
+def test_supersede_ci_builds():
+    """
+    Test scheduled builds are superseded by the backend
+    """
+    build = MagicMock(id=20, parent_id=19)
+    queued = MagicMock(id=5, buildstate="needs_build")
+    queued.set_nothing_done = AsyncMock()
+    queued.parent.children = [queued]
+    queued.parent.parent = None
+    scheduled = MagicMock(id=6, buildstate="scheduled")
+    scheduled.set_nothing_done = AsyncMock()
+    session = MagicMock()
+    session.query.return_value.filter.return_value.all.return_value = [queued, scheduled]
+    enqueue_backend = AsyncMock()
+
+    with patch.object(deb_build, "Configuration") as cfg, \
+            patch.object(deb_build, "enqueue_backend", enqueue_backend):
+        cfg.return_value.ci_builds = {}
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(deb_build.supersede_ci_builds(build, session))
+
+    queued.set_nothing_done.assert_called_once()
+    scheduled.set_nothing_done.assert_not_called()
+    session.delete.assert_not_called()
+    enqueue_backend.assert_called_once_with({"cancel": [6, False, 19]})
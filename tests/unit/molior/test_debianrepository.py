@@ -4,10 +4,11 @@ Provides test molior configuration class.
 import asyncio
 from datetime import datetime
 
-from mock import patch, Mock, MagicMock, PropertyMock
+from mock import patch, Mock, MagicMock, PropertyMock, AsyncMock
 
 from molior.molior.debianrepository import DebianRepository
 from molior.aptly.api import get_snapshot_name
+from molior.aptly.repolocks import RepoLocks
 
 
 def test_publish_name():
@@ -243,6 +244,8 @@ def test_add_packages():
         aptly_connection.snapshot_rename = Mock(side_effect=asyncio.coroutine(lambda a, b: 1341))
         aptly_connection.wait_task = Mock(side_effect=asyncio.coroutine(lambda a: 1342))
         aptly_connection.republish = Mock(side_effect=asyncio.coroutine(lambda a, b, c: None))
+        aptly_connection.publisher.republish = AsyncMock()
+        aptly_connection.repo_locks = RepoLocks()
 
         basemirror_name = "jessie"
         basemirror_version = "8.8"
@@ -253,11 +256,13 @@ def test_add_packages():
 
         loop = asyncio.get_event_loop()
         loop.run_until_complete(repo.add_packages(files))
-        aptly_connection.republish.assert_called_with(
+        aptly_connection.publisher.republish.assert_called_with(
             "stable",
             "jessie-8.8-test-1-stable",
             "jessie_8.8_repos_test_1",
         )
+        aptly_connection.republish.assert_not_called()
+        aptly_connection.snapshot_publish_update.assert_not_called()
 
 
 def test_init():
@@ -287,7 +292,8 @@ def test_init():
         aptly_connection.snapshot_publish = Mock(
             side_effect=asyncio.coroutine(lambda a, b, c, d, e: 38)
         )
-        aptly_connection.repo_get = Mock(side_effect=asyncio.coroutine(lambda: []))
+        aptly_connection.objects.exists = AsyncMock(return_value=False)
+        aptly_connection.repo_locks = RepoLocks()
         aptly_connection.repo_create = Mock(
             side_effect=asyncio.coroutine(lambda a: None)
         )
@@ -308,8 +314,9 @@ def test_init():
         )
         repo.DISTS = ["stable"]
 
-        loop.run_until_complete(repo.init())
+        assert loop.run_until_complete(repo.init())
 
+        aptly_connection.objects.exists.assert_any_call("repos", "stretch-9.2-test-2-stable")
         aptly_connection.repo_create.assert_called_with("stretch-9.2-test-2-stable")
         aptly_connection.snapshot_publish.assert_called_with(
             "stretch_9.2_repos_test_2-stable",
@@ -341,14 +348,9 @@ def test_init_exists():
 
         aptly_connection = MagicMock()
         get_aptly_connection.return_value = aptly_connection
-        aptly_connection.snapshot_get = Mock(
-            side_effect=asyncio.coroutine(
-                lambda: [{"Name": "stretch_9.2_test_2-stable"}]
-            )
-        )
-        aptly_connection.repo_get = Mock(
-            side_effect=asyncio.coroutine(lambda: [{"Name": "stretch-9.2-test-2-stable"}])
-        )
+        existing = {("repos", "stretch-9.2-test-2-stable"), ("snapshots", "stretch_9.2_repos_test_2-stable")}
+        aptly_connection.objects.exists = AsyncMock(side_effect=lambda kind, name: (kind, name) in existing)
+        aptly_connection.repo_locks = RepoLocks()
         aptly_connection.repo_create = Mock(
             side_effect=asyncio.coroutine(lambda a: None)
         )
@@ -370,7 +372,75 @@ def test_init_exists():
         )
         repo.DISTS = ["stable"]
 
-        loop.run_until_complete(repo.init())
+        assert not loop.run_until_complete(repo.init())
 
         aptly_connection.repo_create.assert_not_called()
         aptly_connection.snapshot_publish.assert_not_called()
+
+
+def test_expire_ci_packages():
+    """
+    Test expiring CI packages deletes all expired packages at once
+    """
+    now = datetime.strftime(datetime.now(), "%Y%m%d%H%M%S")
+    new_package = "Pi386 test 1.0.0+git{}.57121d3 c36ac".format(now)
+    old_packages = [
+        "Pi386 test 1.0.0+git20170101120000.57121d3 c36ac",
+        "Pamd64 test 1.0.0+git20170102120000-57121d3 c36ad",
+    ]
+
+    with patch(
+            "molior.molior.debianrepository.Configuration") as cfg_mock, patch(
+            "molior.molior.debianrepository.get_aptly_connection") as get_aptly_connection:
+
+        cfg_mock.return_value.ci_builds = {"packages_ttl": 1}
+
+        aptly_connection = MagicMock()
+        get_aptly_connection.return_value = aptly_connection
+        aptly_connection.repo_packages_get = AsyncMock(return_value=old_packages + [new_package])
+        aptly_connection.repo_packages_delete = AsyncMock(return_value=1337)
+        aptly_connection.wait_task = AsyncMock(return_value=True)
+        aptly_connection.publisher.republish = AsyncMock()
+
+        repo = DebianRepository("stretch", "9.2", "testproject", "1", [])
+
+        loop = asyncio.get_event_loop()
+        res = loop.run_until_complete(repo.expire_ci_packages())
+
+        assert res == 2
+        aptly_connection.repo_packages_delete.assert_called_once_with("stretch-9.2-testproject-1-unstable", old_packages)
+        aptly_connection.publisher.republish.assert_called_once_with("unstable", "stretch-9.2-testproject-1-unstable",
+                                                                     "stretch_9.2_repos_testproject_1")
+
+
+def test_expire_ci_packages_delete_failed():
+    """
+    Test failing to delete expired CI packages does not republish
+    """
+    old_packages = [
+        "Pi386 test 1.0.0+git20170101120000.57121d3 c36ac",
+        "Pamd64 test 1.0.0+git20170102120000-57121d3 c36ad",
+    ]
+
+    with patch(
+            "molior.molior.debianrepository.Configuration") as cfg_mock, patch(
+            "molior.molior.debianrepository.get_aptly_connection") as get_aptly_connection:
+
+        cfg_mock.return_value.ci_builds = {"packages_ttl": 1}
+
+        aptly_connection = MagicMock()
+        get_aptly_connection.return_value = aptly_connection
+        aptly_connection.repo_packages_get = AsyncMock(return_value=old_packages)
+        aptly_connection.repo_packages_delete = AsyncMock(return_value=1337)
+        aptly_connection.wait_task = AsyncMock(return_value=False)
+        aptly_connection.publisher.republish = AsyncMock()
+
+        repo = DebianRepository("stretch", "9.2", "testproject", "1", [])
+
+        loop = asyncio.get_event_loop()
+        assert loop.run_until_complete(repo.expire_ci_packages()) == 0
+
+        aptly_connection.repo_packages_delete = AsyncMock(side_effect=Exception("aptly error"))
+        assert loop.run_until_complete(repo.expire_ci_packages()) == 0
+
+        aptly_connection.publisher.republish.assert_not_called()
@@ -0,0 +1,62 @@
+"""
+Provides tests for the build node heartbeat manager.
+"""
+import asyncio
+
+from mock import MagicMock
+
+from molior.backends.http.heartbeat import HeartbeatManager
+from molior.backends.http.nodes import NodeState
+
+
+def test_heartbeat_timeout():
+    """
+    Test that nodes not answering pings time out
+    """
+    timed_out = []
+
+    async def on_timeout(ws_client):
+        timed_out.append(ws_client)
+
+    async def run():
+        heartbeat = HeartbeatManager(2, on_timeout)
+        node1 = NodeState(MagicMock(), "node1", "amd64")
+        node2 = NodeState(MagicMock(), "node2", "amd64")
+        heartbeat.add("node1", node1)
+        heartbeat.add("node2", node2)
+
+        await heartbeat.tick()
+        node1.ws.send_str.assert_called_with('{"ping": 1}')
+        node2.ws.send_str.assert_called_with('{"ping": 1}')
+
+        heartbeat.pong("node1")
+        await heartbeat.tick()
+        await heartbeat.tick()
+        assert timed_out == [node2]
+        assert node1.ws.send_str.call_count == 2
+
+        metrics = heartbeat.get_metrics()
+        assert metrics["nodes"] == 1
+        assert metrics["pings"] == 3
+        assert metrics["pongs"] == 1
+        assert metrics["missed_pongs"] == 1
+        assert metrics["missed_pongs_by_node"] == {"node2": 1}
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run())
+
+
+def test_heartbeat_reconnect():
+    """
+    Test that an old connection does not remove a reconnected node
+    """
+    async def on_timeout(ws_client):
+        pass
+
+    heartbeat = HeartbeatManager(5, on_timeout)
+    old = NodeState(MagicMock(), "node1", "amd64")
+    new = NodeState(MagicMock(), "node1", "amd64")
+    heartbeat.add("node1", old)
+    heartbeat.add("node1", new)
+    heartbeat.remove("node1", old)
+    assert heartbeat.nodes == {"node1": new}
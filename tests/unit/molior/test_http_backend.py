@@ -0,0 +1,183 @@
+"""
+Provides tests for the http build backend scheduling.
+"""
+import asyncio
+import json
+
+from mock import MagicMock, AsyncMock, patch
+
+from molior.backends.http import http
+from molior.backends.http.nodes import NodeState, NodeRegistry
+
+
+def make_node(name):
+    return NodeState(MagicMock(), name, "amd64")
+
+
+def make_task(sourcename, dist="buster", arch="amd64"):
+    return {"repository_name": sourcename, "distrelease": "debian", "distversion": dist, "architecture": arch}
+
+
+def test_select_node_prefers_warm_cache():
+    """
+    Test that a node which built the same source is preferred
+    """
+    http.node_locality.clear()
+    node1 = make_node("node1")
+    node2 = make_node("node2")
+    http.remember_locality(node1, make_task("pkg-a"))
+    http.remember_locality(node2, make_task("pkg-b"))
+
+    # node2 was idle the longest, but node1 has the source cached
+    with patch.object(http, "registry", NodeRegistry()) as registry:
+        registry.add(node2)
+        registry.add(node1)
+        assert http.select_node("amd64", make_task("pkg-a")) is node1
+
+
+def test_select_node_longest_idle():
+    """
+    Test that the longest idle node is used without cache hits
+    """
+    http.node_locality.clear()
+    node1 = make_node("node1")
+    node2 = make_node("node2")
+    with patch.object(http, "registry", NodeRegistry()) as registry:
+        registry.add(node2)
+        registry.add(node1)
+        assert http.select_node("amd64", make_task("pkg-c", dist="bullseye")) is node2
+        registry.set_busy(node2, 1)
+        assert http.select_node("amd64", make_task("pkg-c")) is node1
+        registry.set_busy(node1, 2)
+        assert http.select_node("amd64", make_task("pkg-c")) is None
+
+        # node2 becomes idle again and is now the most recently idle node
+        registry.set_idle(node2)
+        assert registry.get_nodes("idle", "amd64") == [node2]
+        assert registry.get_by_build(2) is node1
+        assert registry.get_by_build(1) is None
+
+
+def test_cancel():
+    """
+    Test cancelling queued and running builds
+    """
+    backend = http.HTTPBackend.__new__(http.HTTPBackend)
+    node = make_node("node1")
+    with patch.object(http, "registry", NodeRegistry()) as registry:
+        registry.add(node)
+        registry.set_busy(node, 42)
+
+        loop = asyncio.get_event_loop()
+        assert loop.run_until_complete(backend.cancel(42)) is None
+        node.ws.send_str.assert_not_called()
+
+        assert loop.run_until_complete(backend.cancel(42, abort_running=True)) == "aborted"
+        node.ws.send_str.assert_called_with('{"abort": 42}')
+
+        with patch.object(http, "remove_buildtask", return_value=True) as remove_buildtask:
+            assert loop.run_until_complete(backend.cancel(43)) == "dequeued"
+        remove_buildtask.assert_called_once_with(43)
+
+        # dispatched or finished builds are not cancelled
+        with patch.object(http, "remove_buildtask", return_value=False):
+            assert loop.run_until_complete(backend.cancel(44)) is None
+
+
+def test_get_node_class():
+    """
+    Test routing builds to node classes
+    """
+    node_classes = {
+        "amd64": {"architectures": ["amd64", "i386"]},
+        "big": {"architectures": ["amd64"], "sourcenames": ["linux"]},
+        "riscv64": {"architectures": ["riscv64"]},
+    }
+    with patch.object(http, "NODE_CLASSES", node_classes), \
+            patch.object(http, "registry", NodeRegistry()) as registry:
+        # no dedicated node registered
+        assert http.get_node_class("amd64", "linux") == "amd64"
+
+        registry.add(NodeState(MagicMock(), "node1", "big"))
+        assert http.get_node_class("i386", "linux") == "amd64"
+        assert http.get_node_class("amd64", "linux") == "big"
+        assert http.get_node_class("amd64", "bash") == "amd64"
+        assert http.get_node_class("riscv64", "bash") == "riscv64"
+        assert http.get_node_class("armhf", "bash") is None
+
+
+def test_node_status_delta():
+    """
+    Test that only changed node fields are sent
+    """
+    known = {"n1": {"state": "idle", "load": 1}, "n2": {"state": "idle", "load": 1}}
+    current = {"n1": {"state": "busy", "load": 1}, "n3": {"state": "idle", "load": 0}}
+    changed, removed = http.get_node_status_delta(known, current)
+    assert changed == [{"id": "n1", "state": "busy"}, {"id": "n3", "state": "idle", "load": 0}]
+    assert removed == [{"id": "n2"}]
+    assert http.get_node_status_delta(current, current) == ([], [])
+
+
+def test_subscribe_node_status():
+    """
+    Test that subscribers get all nodes first, and then the changed fields only
+    """
+    node = make_node("node1")
+    ws = MagicMock()
+    ws.send_str = AsyncMock()
+    loop = asyncio.get_event_loop()
+    with patch.object(http, "registry", NodeRegistry()) as registry, \
+            patch.object(http, "node_subscribers", set()) as node_subscribers, \
+            patch.object(http, "node_status_clients", {}) as node_status_clients, \
+            patch.object(http, "NODE_STATUS_INTERVAL", 0):
+        registry.add(node)
+
+        # clients are not subscribed without asking for it
+        loop.run_until_complete(http.send_node_status())
+        ws.send_str.assert_not_called()
+
+        loop.run_until_complete(http.subscribe_node_status(ws))
+        assert ws in node_subscribers
+        message = json.loads(ws.send_str.call_args[0][0])
+        assert message["event"] == http.Event.changed.value
+        assert message["data"] == [dict(node_status_clients[ws]["nodes"][node.info()["id"]], id=node.info()["id"])]
+
+        # nothing changed since the snapshot
+        ws.send_str.reset_mock()
+        loop.run_until_complete(http.send_node_status())
+        ws.send_str.assert_not_called()
+
+        registry.set_busy(node, 42, sourcename="pkg")
+        loop.run_until_complete(http.send_node_status())
+        message = json.loads(ws.send_str.call_args[0][0])
+        assert message["data"][0]["sourcename"] == "pkg"
+        assert "uptime_seconds" not in message["data"][0]
+
+
+def test_resume_build():
+    """
+    Test that a build is reattached when its node reconnects
+    """
+    async def run():
+        old = make_node("node1")
+        new = make_node("node1")
+        with patch.object(http, "registry", NodeRegistry()) as registry, \
+                patch.object(http, "RECONNECT_GRACE", 60), \
+                patch.object(http, "enqueue_backend") as enqueue_backend, \
+                patch.object(http, "buildtask_done"), \
+                patch.object(http, "expire_lost_node", new=MagicMock()), \
+                patch("asyncio.ensure_future"):
+            registry.add(old)
+            registry.set_busy(old, 42, project="test")
+            await http.deregister_node(old)
+            enqueue_backend.assert_not_called()
+            assert http.lost_nodes == {"amd64/node1": old}
+
+            registry.add(new)
+            assert await http.resume_build(new, 42) is True
+            assert registry.get_by_build(42) is new
+            assert new.project == "test"
+            assert http.lost_nodes == {}
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run())
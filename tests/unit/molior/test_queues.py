@@ -0,0 +1,168 @@
+"""
+Provides tests for the build task queues.
+"""
+import asyncio
+import pytest
+
+from mock import patch
+
+from molior.molior.queues import BuildQueue, AptlyLane, buildtask_done
+
+
+def test_buildqueue_policies():
+    """
+    Test build queue ordering by estimated duration
+    """
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {"ci": "shortest_first", "release": "longest_first"}
+        queue = BuildQueue()
+        queue.put_nowait({"build_id": 1, "project_dist": "unstable", "estimated_duration": 300})
+        queue.put_nowait({"build_id": 2, "project_dist": "unstable", "estimated_duration": 60})
+        queue.put_nowait({"build_id": 3, "project_dist": "stable", "estimated_duration": 60})
+        queue.put_nowait({"build_id": 4, "project_dist": "stable", "estimated_duration": 3600})
+
+    assert [queue.get_nowait()["build_id"] for _ in range(4)] == [4, 3, 2, 1]
+
+
+def test_buildqueue_fifo():
+    """
+    Test build queue fifo ordering
+    """
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {}
+        queue = BuildQueue()
+        for build_id in range(1, 4):
+            queue.put_nowait({"build_id": build_id, "estimated_duration": 100 * build_id})
+
+    assert [queue.get_nowait()["build_id"] for _ in range(3)] == [1, 2, 3]
+
+
+def test_buildqueue_aging():
+    """
+    Test long waiting builds are dequeued first
+    """
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {"ci": "shortest_first", "max_wait": 600}
+        queue = BuildQueue()
+        with patch("molior.molior.queues.time.monotonic", return_value=1000):
+            queue.put_nowait({"build_id": 1, "project_dist": "unstable", "estimated_duration": 3600})
+        with patch("molior.molior.queues.time.monotonic", return_value=1500):
+            queue.put_nowait({"build_id": 2, "project_dist": "unstable", "estimated_duration": 60})
+            queue.put_nowait({"build_id": 3, "project_dist": "unstable", "estimated_duration": 60})
+
+    with patch("molior.molior.queues.time.monotonic", return_value=1599):
+        assert queue.get_nowait()["build_id"] == 2
+    with patch("molior.molior.queues.time.monotonic", return_value=1600):
+        assert queue.get_nowait()["build_id"] == 1
+        assert queue.get_nowait()["build_id"] == 3
+
+
+def test_buildqueue_fair_share():
+    """
+    Test weighted fair sharing and concurrency caps between projects
+    """
+    BuildQueue.running.clear()
+    BuildQueue.dispatched.clear()
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {"project_weights": {"small": 2}, "project_max_running": {"capped": 1}}
+        queue = BuildQueue()
+        for build_id in range(1, 5):
+            queue.put_nowait({"build_id": build_id, "project": "big"})
+        queue.put_nowait({"build_id": 5, "project": "small"})
+        queue.put_nowait({"build_id": 6, "project": "small"})
+        queue.put_nowait({"build_id": 7, "project": "capped"})
+        queue.put_nowait({"build_id": 8, "project": "capped"})
+
+    assert [queue.get_nowait()["build_id"] for _ in range(6)] == [1, 5, 7, 6, 2, 3]
+    assert BuildQueue.running == {"big": 3, "small": 2, "capped": 1}
+
+    # capped project has to wait for its running build
+    assert queue.get_nowait()["build_id"] == 4
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+    buildtask_done("capped")
+    assert queue.get_nowait()["build_id"] == 8
+
+    BuildQueue.running.clear()
+    BuildQueue.dispatched.clear()
+
+
+def test_buildqueue_requeue():
+    """
+    Test requeued build tasks keep their position and accounting
+    """
+    BuildQueue.running.clear()
+    BuildQueue.dispatched.clear()
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {}
+        queue = BuildQueue()
+        for build_id in range(1, 4):
+            queue.put_nowait({"build_id": build_id, "project": "test"})
+
+    task = queue.get_nowait()
+    assert task["build_id"] == 1
+    assert BuildQueue.running == {"test": 1}
+    assert BuildQueue.dispatched == {"test": 1}
+
+    queue.requeue_nowait(task)
+    assert BuildQueue.running == {"test": 0}
+    assert BuildQueue.dispatched == {"test": 0}
+    assert [queue.get_nowait()["build_id"] for _ in range(3)] == [1, 2, 3]
+
+
+def test_buildqueue_remove():
+    """
+    Test removing queued build tasks
+    """
+    with patch("molior.molior.queues.Configuration") as cfg:
+        cfg.return_value.build_scheduling = {}
+        queue = BuildQueue()
+        for build_id in range(1, 4):
+            queue.put_nowait({"build_id": build_id, "project": "test"})
+
+    task = queue.get_nowait()
+    assert not queue.remove(task["build_id"])
+    assert queue.remove(3)
+    assert queue.qsize() == 1
+    assert queue.get_nowait()["build_id"] == 2
+    assert not queue.remove(2)
+    assert queue.empty()
+
+
+def test_aptly_lanes():
+    """
+    Test a long running lane does not block another lane
+    """
+    async def run():
+        done = []
+        blocker = asyncio.Event()
+
+        async def slow(args):
+            await blocker.wait()
+            done.append(args)
+
+        async def fast(args):
+            done.append(args)
+
+        mirror = AptlyLane("mirror", 1)
+        publish = AptlyLane("publish", 2)
+        mirror.start()
+        publish.start()
+        await mirror.put(slow, "mirror1")
+        await mirror.put(slow, "mirror2")
+        await publish.put(fast, "publish1")
+        await publish.put(fast, "publish2")
+        await publish.queue.join()
+
+        assert done == ["publish1", "publish2"]
+        metrics = mirror.get_metrics()
+        assert metrics["running"] == 1
+        assert metrics["queued"] == 1
+
+        blocker.set()
+        await mirror.queue.join()
+        assert done[2:] == ["mirror1", "mirror2"]
+        assert mirror.get_metrics()["done"] == 2
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run())
@@ -0,0 +1,50 @@
+"""
+Provides tests of the chunked build uploads.
+"""
+import os
+import asyncio
+import hashlib
+
+from mock import patch, MagicMock, AsyncMock
+
+# do not read the upload directories from the molior configuration
+with patch.dict(os.environ, {"IS_SPHINX": "1"}):
+    from molior.api import upload
+
+
+def mock_request(size, sha256):
+    request = MagicMock()
+    request.match_info = {"token": "abc", "filename": "empty.txt"}
+    request.json = AsyncMock(return_value={"size": size, "sha256": sha256})
+    return request
+
+
+def test_chunked_upload_empty_file(tmp_path):
+    """
+    Test an empty file is uploaded without any chunks
+    """
+    (tmp_path / "buildout" / "1").mkdir(parents=True)
+    request = mock_request(0, hashlib.sha256(b"").hexdigest())
+    with patch.object(upload, "upload_dir", str(tmp_path / "upload")), \
+            patch.object(upload, "buildout_path", tmp_path / "buildout"), \
+            patch.object(upload, "Session"), \
+            patch.object(upload, "get_build_id", return_value=1):
+        loop = asyncio.get_event_loop()
+        response = loop.run_until_complete(upload.chunked_upload_complete(request))
+
+    assert response.status == 200
+    assert (tmp_path / "buildout" / "1" / "empty.txt").read_bytes() == b""
+
+
+def test_chunked_upload_missing_chunks(tmp_path):
+    """
+    Test a chunked upload is not completed before all chunks were received
+    """
+    request = mock_request(10, "")
+    with patch.object(upload, "upload_dir", str(tmp_path / "upload")), \
+            patch.object(upload, "Session"), \
+            patch.object(upload, "get_build_id", return_value=1):
+        loop = asyncio.get_event_loop()
+        response = loop.run_until_complete(upload.chunked_upload_complete(request))
+
+    assert response.status == 400
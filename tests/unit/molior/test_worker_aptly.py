@@ -0,0 +1,160 @@
+"""
+Provides tests of the aptly worker.
+"""
+import asyncio
+
+from mock import patch, MagicMock, AsyncMock
+
+from molior.aptly import AptlyApi
+from molior.molior import worker_aptly
+
+
+def mock_mirror_session(release_hash):
+    mirror = MagicMock()
+    mirror.fullname = "debian/10"
+    mirror.mirror_components = "main,contrib"
+    mirror.basemirror = None
+    mirror.project.is_basemirror = False
+    mirror.mirror_release_hash = release_hash
+    session = MagicMock()
+    session.query.return_value.filter.return_value.first.return_value = mirror
+    session_cls = MagicMock()
+    session_cls.return_value.__enter__.return_value = session
+    return session_cls, mirror
+
+
+def test_check_mirror_unchanged():
+    """
+    Test mirrors with an unchanged upstream Release file are not updated
+    """
+    session_cls, mirror = mock_mirror_session("abc")
+    aptly = MagicMock()
+    with patch.object(worker_aptly, "Session", session_cls), \
+            patch.object(worker_aptly, "get_release_hash", AsyncMock(return_value="abc")), \
+            patch.object(worker_aptly, "get_local_tz"), \
+            patch.object(worker_aptly, "get_aptly_connection", return_value=aptly):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(worker_aptly.check_mirror(1))
+
+    aptly.mirror_update.assert_not_called()
+    assert mirror.mirror_release_hash == "abc"
+
+
+def test_check_mirror_changed():
+    """
+    Test mirrors with a changed upstream Release file are updated and republished
+    """
+    session_cls, mirror = mock_mirror_session("abc")
+    aptly = MagicMock()
+    aptly.mirror_update = AsyncMock(return_value=[1, 2])
+    aptly.wait_task = AsyncMock(return_value=True)
+    aptly.mirror_republish = AsyncMock(return_value=True)
+    with patch.object(worker_aptly, "Session", session_cls), \
+            patch.object(worker_aptly, "get_release_hash", AsyncMock(return_value="def")), \
+            patch.object(worker_aptly, "get_local_tz"), \
+            patch.object(worker_aptly, "get_aptly_connection", return_value=aptly):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(worker_aptly.check_mirror(1))
+
+    assert aptly.wait_task.call_count == 2
+    aptly.mirror_republish.assert_called_once()
+    assert mirror.mirror_release_hash == "def"
+    assert mirror.mirror_state == "ready"
+
+
+def test_check_mirror_not_ready():
+    """
+    Test mirrors which started updating meanwhile are not updated
+    """
+    session_cls, mirror = mock_mirror_session("abc")
+    session = session_cls.return_value.__enter__.return_value
+    session.query.return_value.filter.return_value.update.return_value = 0
+    aptly = MagicMock()
+    with patch.object(worker_aptly, "Session", session_cls), \
+            patch.object(worker_aptly, "get_release_hash", AsyncMock(return_value="def")), \
+            patch.object(worker_aptly, "get_local_tz"), \
+            patch.object(worker_aptly, "get_aptly_connection", return_value=aptly):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(worker_aptly.check_mirror(1))
+
+    aptly.mirror_update.assert_not_called()
+    assert mirror.mirror_release_hash == "abc"
+
+
+def test_check_mirror_refresh_chroots():
+    """
+    Test the ready chroots of an updated basemirror are refreshed
+    """
+    session_cls, mirror = mock_mirror_session("abc")
+    mirror.project.is_basemirror = True
+    chroot = MagicMock(id=3, ready=True)
+    pending = MagicMock(id=4, ready=False)
+    session = session_cls.return_value.__enter__.return_value
+    session.query.return_value.filter.return_value.all.return_value = [chroot, pending]
+    aptly = MagicMock()
+    aptly.mirror_update = AsyncMock(return_value=[1])
+    aptly.wait_task = AsyncMock(return_value=True)
+    aptly.mirror_republish = AsyncMock(return_value=True)
+    enqueue_task = AsyncMock()
+    with patch.object(worker_aptly, "Session", session_cls), \
+            patch.object(worker_aptly, "get_release_hash", AsyncMock(return_value="def")), \
+            patch.object(worker_aptly, "get_local_tz"), \
+            patch.object(worker_aptly, "enqueue_task", enqueue_task), \
+            patch.object(worker_aptly, "get_aptly_connection", return_value=aptly):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(worker_aptly.check_mirror(1))
+
+    enqueue_task.assert_called_once_with({"refresh_buildenv": [3]})
+
+
+def test_delete_build_republish_serialized():
+    """
+    Test the republish after deleting a build does not overlap
+    a batched republish of the same publish point
+    """
+    deb = MagicMock()
+    deb.name = "foo"
+    src = MagicMock(version="1.0", projectversions=[5], debianpackages=[deb], children=[])
+    topbuild = MagicMock(is_ci=False, children=[src])
+    session = MagicMock()
+    session.query.return_value.filter.return_value.first.return_value = topbuild
+    session_cls = MagicMock()
+    session_cls.return_value.__enter__.return_value = session
+    projectversion = MagicMock()
+    projectversion.basemirror.project.name = "debian"
+    projectversion.basemirror.name = "10"
+    projectversion.project.name = "proj"
+    projectversion.name = "1"
+
+    aptly = AptlyApi("http://foo.bar/api", "a@b.c", publish_window=0.01)
+    aptly.repo_packages_find = AsyncMock(return_value=["Pall foo 1.0 abc"])
+    aptly.repo_packages_delete = AsyncMock(return_value=1)
+    aptly.wait_task = AsyncMock(return_value=True)
+    running = []
+    overlaps = []
+
+    async def republish(dist, repo_name, publish_name):
+        running.append(publish_name)
+        overlaps.append(len(running))
+        await asyncio.sleep(0.05)
+        running.remove(publish_name)
+
+    aptly.republish = republish
+
+    async def run():
+        # a batched republish after adding packages is running meanwhile
+        add = asyncio.ensure_future(aptly.publisher.republish("stable", "debian-10-proj-1-stable",
+                                                              "debian_10_repos_proj_1"))
+        await asyncio.sleep(0.02)
+        await worker_aptly.AptlyWorker()._delete_build([1])
+        await add
+
+    with patch.object(worker_aptly, "Session", session_cls), \
+            patch.object(worker_aptly, "get_projectversion_byid", return_value=projectversion), \
+            patch.object(worker_aptly, "get_aptly_lane"), \
+            patch.object(worker_aptly, "get_aptly_connection", return_value=aptly):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run())
+
+    assert len(overlaps) == 2
+    assert max(overlaps) == 1
@@ -0,0 +1,65 @@
+"""
+Provides tests of the backend worker.
+"""
+import asyncio
+
+from mock import patch, AsyncMock
+
+from molior.molior import worker_backend
+from molior.molior.worker_backend import BackendWorker
+
+
+def test_cancel_supersedes_cancelled_builds():
+    """
+    Test only builds which the backend cancelled are superseded
+    """
+    worker = BackendWorker()
+    backend = AsyncMock()
+    supersede = AsyncMock()
+    loop = asyncio.get_event_loop()
+    with patch.object(worker_backend, "Backend") as backend_cls, \
+            patch.object(worker_backend, "SupersedeBuild", supersede):
+        backend_cls.return_value.get_backend.return_value = backend
+
+        # already sent to a build node
+        backend.cancel.return_value = None
+        loop.run_until_complete(worker._cancel([1, False, 10]))
+        supersede.assert_not_called()
+
+        backend.cancel.return_value = "dequeued"
+        loop.run_until_complete(worker._cancel([2, False, 10]))
+        supersede.assert_called_with(2, 10, True)
+        assert worker.cancelled == []
+
+        backend.cancel.return_value = "aborted"
+        loop.run_until_complete(worker._cancel([3, True, 10]))
+        supersede.assert_called_with(3, 10, False)
+        assert worker.cancelled == [3]
+
+
+def test_log_reconnect():
+    """
+    Test a reconnected build log is not terminated by the lost connection
+    """
+    worker = BackendWorker()
+    enqueue = AsyncMock()
+    loop = asyncio.get_event_loop()
+    with patch.object(worker_backend, "enqueue_backend", enqueue):
+        loop.run_until_complete(worker._logging_started(1))
+        # log reconnects before the lost connection is closed
+        loop.run_until_complete(worker._logging_started(1))
+        loop.run_until_complete(worker._logging_done(1))
+        loop.run_until_complete(worker._succeeded(1))
+        enqueue.assert_not_called()
+        loop.run_until_complete(worker._logging_done(1))
+        enqueue.assert_called_with({"terminate": 1})
+
+        enqueue.reset_mock()
+        loop.run_until_complete(worker._logging_started(2))
+        loop.run_until_complete(worker._logging_done(2))
+        # log reconnects after the lost connection is closed
+        loop.run_until_complete(worker._logging_started(2))
+        loop.run_until_complete(worker._failed(2))
+        enqueue.assert_not_called()
+        loop.run_until_complete(worker._logging_done(2))
+        enqueue.assert_called_with({"terminate": 2})